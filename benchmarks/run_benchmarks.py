@@ -0,0 +1,222 @@
+"""
+times the main stages of the analyzer on a synthetic dump and stores the results as JSON
+
+    python benchmarks/run_benchmarks.py --values 100000 --output before.json
+    python benchmarks/run_benchmarks.py --values 100000 --output after.json --compare before.json
+
+Every benchmark runs in a fresh process, so the peak RSS of each one can be compared as well.
+"""
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import click
+
+
+def _largest_report(dump_dir: Path) -> Path:
+    from xla_memory_analyzer.dump_files import buffer_assignment_path, memory_report_files
+    return max(memory_report_files(dump_dir), key=lambda f: buffer_assignment_path(f).stat().st_size)
+
+
+def _parsed_module(dump_dir: Path, parser: str):
+    from xla_memory_analyzer.xla_memory_analyzer import parsers
+    return parsers[parser](_largest_report(dump_dir))
+
+
+def bench_analyze_module(dump_dir: Path, parser: str):
+    from xla_memory_analyzer.xla_memory_analyzer import parsers
+    file = _largest_report(dump_dir)
+    return lambda: None, lambda _: parsers[parser](file)
+
+
+def bench_load_all_modules(dump_dir: Path, parser: str):
+    from xla_memory_analyzer.xla_memory_analyzer import load_all_modules
+    return lambda: None, lambda _: load_all_modules(dump_dir, jobs=1, cache=None, parser=parser)
+
+
+def bench_size_over_time(dump_dir: Path, parser: str):
+    from xla_memory_analyzer.models import ModuleStats
+    arrays = _parsed_module(dump_dir, parser).to_arrays()
+    return lambda: ModuleStats.from_arrays(arrays), lambda module: module.size_over_time
+
+
+def bench_allocation_peaks(dump_dir: Path, parser: str):
+    from xla_memory_analyzer.models import ModuleStats
+    arrays = _parsed_module(dump_dir, parser).to_arrays()
+
+    def setup():
+        module = ModuleStats.from_arrays(arrays)
+        module.size_over_time
+        return module
+
+    return setup, lambda module: module.allocation_peaks
+
+
+def bench_report_rendering(dump_dir: Path, parser: str):
+    from xla_memory_analyzer.memory_stats import print_peak_stats
+    from xla_memory_analyzer.models import ModuleStats
+    arrays = _parsed_module(dump_dir, parser).to_arrays()
+
+    def setup():
+        module = ModuleStats.from_arrays(arrays)
+        module.main_allocation_peak
+        return module
+
+    def run(module):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            print_peak_stats(module, only_main_peak=True)
+
+    return setup, run
+
+
+benchmarks = {
+    "analyze_module": bench_analyze_module,
+    "load_all_modules": bench_load_all_modules,
+    "size_over_time": bench_size_over_time,
+    "allocation_peaks": bench_allocation_peaks,
+    "report_rendering": bench_report_rendering,
+}
+
+
+def _run_benchmark(name: str, dump_dir: Path, parser: str, repeat: int, results):
+    setup, run = benchmarks[name](dump_dir, parser)
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+    results.put({
+        "min_s": min(times),
+        "mean_s": sum(times) / len(times),
+        "repeat": repeat,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    })
+
+
+def run_isolated(name: str, dump_dir: Path, parser: str, repeat: int, timeout: float) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    process = ctx.Process(target=_run_benchmark, args=(name, dump_dir, parser, repeat, results))
+    process.start()
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                # polled, a crashed benchmark never puts its result
+                result = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if not process.is_alive():
+                    try:
+                        # put just before the process exited
+                        result = results.get_nowait()
+                        break
+                    except queue.Empty:
+                        raise click.ClickException(
+                            f"benchmark {name} failed with exit code {process.exitcode}"
+                        ) from None
+                if time.monotonic() > deadline:
+                    raise click.ClickException(f"benchmark {name} didn't finish in {timeout:g}s")
+    finally:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+        process.join()
+    if process.exitcode != 0:
+        raise click.ClickException(f"benchmark {name} failed with exit code {process.exitcode}")
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_comparison(old: dict, new: dict):
+    print(f"{'benchmark':<20} {'old':>10} {'new':>10} {'speedup':>8} {'old RSS':>10} {'new RSS':>10}")
+    for name, result in new["benchmarks"].items():
+        if name not in old["benchmarks"]:
+            continue
+        before = old["benchmarks"][name]
+        print(
+            f"{name:<20} {before['min_s']:>9.3f}s {result['min_s']:>9.3f}s "
+            f"{before['min_s'] / result['min_s']:>7.2f}x "
+            f"{before['peak_rss_bytes'] / 1024 ** 2:>8.1f}MB {result['peak_rss_bytes'] / 1024 ** 2:>8.1f}MB"
+        )
+
+
+@click.command()
+@click.option("--dump-dir", type=click.Path(file_okay=False, path_type=Path), default=None,
+              help="Existing dump directory to use instead of generating a synthetic one")
+@click.option("--modules", "num_modules", type=click.IntRange(min=1), default=4, show_default=True)
+@click.option("--allocations", "num_allocations", type=click.IntRange(min=1), default=16, show_default=True)
+@click.option("--values", "num_values", type=click.IntRange(min=1), default=20000, show_default=True)
+@click.option("--sequence-length", type=click.IntRange(min=1), default=40000, show_default=True)
+@click.option("--metadata-density", type=click.FloatRange(0, 1), default=0.8, show_default=True)
+@click.option("--parser", type=click.Choice(["regex", "mmap"]), default="regex", show_default=True)
+@click.option("--repeat", type=click.IntRange(min=1), default=3, show_default=True)
+@click.option("--timeout", type=click.FloatRange(min=0, min_open=True), default=600, show_default=True,
+              help="Seconds after which a benchmark is stopped")
+@click.option("-b", "--benchmark", "selected", multiple=True, type=click.Choice(list(benchmarks)),
+              help="Only run these benchmarks")
+@click.option("-o", "--output", type=click.Path(dir_okay=False, path_type=Path), default=None,
+              help="Write the results to this JSON file")
+@click.option("--compare", type=click.Path(exists=True, dir_okay=False, path_type=Path), default=None,
+              help="Results of an earlier run to compare against")
+def main(dump_dir, num_modules, num_allocations, num_values, sequence_length, metadata_density, parser, repeat,
+         timeout, selected, output, compare):
+    from xla_memory_analyzer.synthetic import generate_dump
+
+    params = {
+        "modules": num_modules,
+        "allocations": num_allocations,
+        "values": num_values,
+        "sequence_length": sequence_length,
+        "metadata_density": metadata_density,
+        "parser": parser,
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if dump_dir is None:
+            dump_dir = Path(tmp_dir)
+            start = time.perf_counter()
+            generate_dump(dump_dir, num_modules, num_allocations, num_values, sequence_length, metadata_density)
+            print(f"generated dump in {time.perf_counter() - start:.1f}s")
+        else:
+            params = {"dump_dir": str(dump_dir.resolve()), "parser": parser}
+        results = {}
+        for name in selected or benchmarks:
+            results[name] = run_isolated(name, dump_dir, parser, repeat, timeout)
+            print(f"{name:<20} {results[name]['min_s']:>9.4f}s  "
+                  f"peak RSS {results[name]['peak_rss_bytes'] / 1024 ** 2:.1f}MB")
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "params": params,
+        "benchmarks": results,
+    }
+    if output is not None:
+        output.write_text(json.dumps(report, indent=2))
+    if compare is not None:
+        print_comparison(json.loads(compare.read_text()), report)
+
+
+if __name__ == '__main__':
+    main()
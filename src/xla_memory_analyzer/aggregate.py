@@ -0,0 +1,168 @@
+"""
+compares the modules of many dump directories, usually one `dump_host_<pid>_<n>` directory per host.
+The n-th module with a given name on one host is matched with the n-th module of that name on every other host.
+Identical buffer-assignment files (same size and content hash) are only parsed once, whichever host they came from.
+"""
+import glob
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from .cache import ParseCache, file_hash
+from .dump_files import ModuleSummary, buffer_assignment_path, filter_modules, plan_modules, summarize
+from .utils import pretty_byte_size
+from .value_filter import ValueFilter
+from .xla_memory_analyzer import iter_modules
+
+
+def expand_directories(patterns: list[str]) -> list[Path]:
+    """
+    directories and glob patterns, in the given order and without duplicates
+    """
+    directories = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for match in matches:
+            path = Path(match)
+            if path.is_dir() and path not in directories:
+                directories.append(path)
+    return directories
+
+
+def fingerprints(files: list[Path], jobs: int = 1) -> dict[Path, tuple]:
+    """
+    (size, content hash) of every buffer-assignment file. Files whose size no other file has can't have a twin,
+    so only files with equal sizes are hashed.
+    """
+    sizes = {file: buffer_assignment_path(file).stat().st_size for file in files}
+    by_size = defaultdict(list)
+    for file, size in sizes.items():
+        by_size[size].append(file)
+    to_hash = [file for same_size in by_size.values() if len(same_size) > 1 for file in same_size]
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        hashes = dict(zip(to_hash, pool.map(lambda f: file_hash(buffer_assignment_path(f)), to_hash)))
+    return {file: (sizes[file], hashes.get(file)) for file in files}
+
+
+def _parse_key(fingerprint: tuple, file: Path):
+    # files without a hash have a size no other file has
+    return fingerprint if fingerprint[1] is not None else file
+
+
+class Spread(NamedTuple):
+    min: int
+    max: int
+    mean: float
+
+    @classmethod
+    def of(cls, numbers: list[int]) -> "Spread":
+        return cls(min(numbers), max(numbers), sum(numbers) / len(numbers))
+
+    @property
+    def skew(self) -> float:
+        """
+        how much the largest host exceeds the average one
+        """
+        return self.max / self.mean - 1 if self.mean else 0.0
+
+
+class AggregatedModule(NamedTuple):
+    name: str
+    occurrence: int
+    num_hosts: int
+    num_variants: int
+    total_allocation: Spread
+    peak_size: Spread
+    largest_host: Path
+
+
+def aggregate(
+        directories: list[Path],
+        interesting_modules: Optional[list[str]] = None,
+        jobs: int = 1,
+        cache: Optional[ParseCache] = None,
+        parser: str = "regex",
+        where: Optional[ValueFilter] = None,
+) -> tuple[list[AggregatedModule], int]:
+    """
+    the matched modules and the number of files that actually had to be parsed
+    """
+    host_modules = defaultdict(list)
+    all_files = []
+    for directory in directories:
+        occurrences = defaultdict(int)
+        for module_file in sorted(filter_modules(plan_modules(directory), interesting_modules), key=lambda m: m.id):
+            key = module_file.name, occurrences[module_file.name]
+            occurrences[module_file.name] += 1
+            host_modules[key].append((directory, module_file))
+            all_files.append(module_file.memory_report_file)
+
+    prints = fingerprints(all_files, jobs)
+    unique = {}
+    for file in all_files:
+        unique.setdefault(_parse_key(prints[file], file), file)
+    summaries: dict[Path, ModuleSummary] = {}
+    for file, module in zip(unique.values(), iter_modules(list(unique.values()), jobs, cache, parser, where)):
+        summaries[file] = summarize(module)
+
+    result = []
+    for (name, occurrence), hosts in host_modules.items():
+        per_host = []
+        for directory, module_file in hosts:
+            file = module_file.memory_report_file
+            parsed = unique[_parse_key(prints[file], file)]
+            per_host.append((directory, summaries[parsed], prints[file]))
+        totals = [summary.total_allocation for _, summary, _ in per_host]
+        largest = max(per_host, key=lambda h: h[1].total_allocation)
+        result.append(AggregatedModule(
+            name=name,
+            occurrence=occurrence,
+            num_hosts=len(per_host),
+            num_variants=len({fingerprint for _, _, fingerprint in per_host}),
+            total_allocation=Spread.of(totals),
+            peak_size=Spread.of([summary.peak_size for _, summary, _ in per_host]),
+            largest_host=largest[0],
+        ))
+    return result, len(unique)
+
+
+def print_aggregate(directories: list[Path], modules: list[AggregatedModule], num_parsed: int, top: int,
+                    sort_by: str = "total"):
+    console = Console()
+    keys = {
+        "total": lambda m: -m.total_allocation.max,
+        "peak": lambda m: -m.peak_size.max,
+        "skew": lambda m: -m.total_allocation.skew,
+    }
+    table = Table(title=f"{len(modules)} modules on {len(directories)} hosts", box=box.MARKDOWN)
+    table.add_column("Name", no_wrap=False)
+    table.add_column("Hosts")
+    table.add_column("Variants")
+    table.add_column("Total min")
+    table.add_column("Total max")
+    table.add_column("Skew")
+    table.add_column("Peak min")
+    table.add_column("Peak max")
+    table.add_column("Peak skew")
+    table.add_column("Largest on", no_wrap=False)
+    for m in sorted(modules, key=keys[sort_by])[:top]:
+        table.add_row(
+            m.name if m.occurrence == 0 else f"{m.name} #{m.occurrence + 1}",
+            str(m.num_hosts),
+            str(m.num_variants),
+            pretty_byte_size(m.total_allocation.min),
+            pretty_byte_size(m.total_allocation.max),
+            f"{m.total_allocation.skew:.1%}",
+            pretty_byte_size(m.peak_size.min),
+            pretty_byte_size(m.peak_size.max),
+            f"{m.peak_size.skew:.1%}",
+            m.largest_host.name,
+        )
+    console.print(table)
+    num_files = sum(m.num_hosts for m in modules)
+    console.print(f"parsed {num_parsed} of {num_files} module files, the others were identical to one of them")
@@ -0,0 +1,173 @@
+"""
+which lines of code and which operations the bytes live at a peak come from.
+Every value is assigned to a (source file, line) group and an op_name group once per module, so adding up the
+bytes of any set of values is one `bincount` per grouping.
+"""
+from functools import cached_property
+from typing import Optional
+
+import numpy as np
+from rich.console import Console
+from rich.markup import escape
+from rich.tree import Tree
+
+from .models import ModuleStats
+from .sources import SourceResolver
+from .utils import pretty_byte_size
+
+no_source = "<no source>"
+no_op_name = "<no op_name>"
+unknown_function = "<file not found>"
+
+
+class AttributionIndex:
+    def __init__(self, module: ModuleStats):
+        self.module = module
+        file_idx = module.source_file_idx.astype(np.int64)
+        lines = module.source_line
+        # values without source share the key 0
+        keys = np.where(file_idx >= 0, (file_idx + 1) * (int(lines.max(initial=0)) + 1) + lines, 0)
+        _, self.line_group = np.unique(keys, return_inverse=True)
+        first_rows = np.unique(self.line_group, return_index=True)[1]
+        self.line_files = file_idx[first_rows]
+        self.line_numbers = lines[first_rows]
+        self.op_group = module.op_name_idx.astype(np.int64) + 1
+
+    @property
+    def num_lines(self) -> int:
+        return len(self.line_files)
+
+    def line(self, group: int) -> Optional[tuple[str, int]]:
+        file_idx = self.line_files[group]
+        if file_idx < 0:
+            return None
+        return self.module.source_file_table.get(int(file_idx)), int(self.line_numbers[group])
+
+    def op_name(self, group: int) -> Optional[str]:
+        return self.module.op_name_table.get(group - 1)
+
+    @cached_property
+    def _line_groups(self) -> dict[tuple[str, int], int]:
+        return {self.line(group): group for group in range(self.num_lines) if self.line(group) is not None}
+
+    def rows_of_line(self, source_file: str, source_line: int) -> np.ndarray:
+        """
+        all values created by one line of code
+        """
+        group = self._line_groups.get((source_file, source_line))
+        if group is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.line_group == group)
+
+    def rows_of_op_name(self, prefix: str) -> np.ndarray:
+        """
+        all values whose op_name starts with `prefix`
+        """
+        groups = [i + 1 for i, op_name in enumerate(self.module.op_name_table.strings) if op_name.startswith(prefix)]
+        return np.flatnonzero(np.isin(self.op_group, groups))
+
+    def bytes_by_line(self, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        bytes and number of values of every line group among `rows`
+        """
+        groups = self.line_group[rows]
+        sizes = self.module.value_sizes[rows]
+        return (np.bincount(groups, weights=sizes, minlength=self.num_lines).astype(np.int64),
+                np.bincount(groups, minlength=self.num_lines))
+
+    def bytes_by_op_name(self, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        groups = self.op_group[rows]
+        sizes = self.module.value_sizes[rows]
+        n = len(self.module.op_name_table) + 1
+        return (np.bincount(groups, weights=sizes, minlength=n).astype(np.int64),
+                np.bincount(groups, minlength=n))
+
+
+class FlameNode:
+    def __init__(self, name: str):
+        self.name = name
+        self.size = 0
+        self.count = 0
+        self.children: dict[str, "FlameNode"] = {}
+
+    def add(self, path: list[str], size: int, count: int):
+        node = self
+        node.size += size
+        node.count += count
+        for part in path:
+            node = node.children.setdefault(part, FlameNode(part))
+            node.size += size
+            node.count += count
+
+    def render(self, tree: Tree, total: int, min_share: float, max_children: int):
+        children = sorted(self.children.values(), key=lambda c: -c.size)
+        shown = [c for c in children[:max_children] if total and c.size / total >= min_share]
+        for child in shown:
+            share = child.size / total
+            # op_names like `transpose[permutation=(1, 0)]` would otherwise be read as markup
+            label = f"[bold]{pretty_byte_size(child.size)}[/bold] {share:6.1%}  {escape(child.name)}"
+            child.render(tree.add(f"{label}  [dim]({child.count})[/dim]"), total, min_share, max_children)
+        rest = children[len(shown):]
+        if rest:
+            size = sum(c.size for c in rest)
+            tree.add(f"[dim]{pretty_byte_size(size)} in {len(rest)} more[/dim]")
+
+
+def source_flame(index: AttributionIndex, rows: np.ndarray, sources: SourceResolver) -> FlameNode:
+    """
+    file > function > line
+    """
+    sizes, counts = index.bytes_by_line(rows)
+    root = FlameNode("source")
+    for group in np.flatnonzero(counts).tolist():
+        line = index.line(group)
+        if line is None:
+            root.add([no_source], int(sizes[group]), int(counts[group]))
+            continue
+        source_file, source_line = line
+        if sources.resolve(source_file) is None:
+            function = unknown_function
+        else:
+            function = sources.enclosing_function(source_file, source_line) or "<module>"
+        root.add([source_file, function, f"line {source_line}"], int(sizes[group]), int(counts[group]))
+    return root
+
+
+def op_name_flame(index: AttributionIndex, rows: np.ndarray) -> FlameNode:
+    """
+    op_names split at `/` into their scopes
+    """
+    sizes, counts = index.bytes_by_op_name(rows)
+    root = FlameNode("op_name")
+    for group in np.flatnonzero(counts).tolist():
+        op_name = index.op_name(group)
+        path = op_name.split("/") if op_name is not None else [no_op_name]
+        root.add(path, int(sizes[group]), int(counts[group]))
+    return root
+
+
+def print_attribution(
+        module: ModuleStats,
+        peaks,
+        sources: Optional[SourceResolver] = None,
+        by: str = "both",
+        min_share: float = 0.01,
+        max_children: int = 10,
+):
+    console = Console()
+    if sources is None:
+        sources = SourceResolver()
+    index = AttributionIndex(module)
+    for peak in peaks:
+        rows = module.live_index.at(int(peak))
+        total = int(module.value_sizes[rows].sum())
+        title = f"peak at {peak}: {pretty_byte_size(total)} in {len(rows)} values"
+        flames = []
+        if by in ("source", "both"):
+            flames.append(source_flame(index, rows, sources))
+        if by in ("op_name", "both"):
+            flames.append(op_name_flame(index, rows))
+        for flame in flames:
+            tree = Tree(f"{title}, by {flame.name}")
+            flame.render(tree, total, min_share, max_children)
+            console.print(tree)
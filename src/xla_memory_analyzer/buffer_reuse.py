@@ -0,0 +1,202 @@
+"""
+how well the buffer assigner packed the values of every allocation.
+For each allocation the occupancy over offset and time follows from the offset, size and live range of its values:
+the live bytes at every step, the high-water mark (end of the highest live value) and the holes below it.
+"""
+from typing import NamedTuple
+
+import numpy as np
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from .models import ModuleStats
+from .sparse_table import range_chmax
+from .utils import pretty_byte_size
+
+
+class AllocationReuse(NamedTuple):
+    alloc_id: int
+    size: int
+    num_values: int
+    first_step: int
+    last_step: int
+    peak_live: int
+    peak_high_water: int
+    # mean of live bytes / allocation size over the steps the allocation is in use
+    mean_packing: float
+    min_packing: float
+    min_packing_step: int
+    # step with the most bytes below the high-water mark that are not live
+    worst_fragmentation_step: int
+    worst_fragmentation: int
+    # live bytes / allocation size at every step from first_step to last_step
+    packing: np.ndarray
+
+
+class ReusedSlice(NamedTuple):
+    alloc_id: int
+    offset: int
+    size: int
+    num_values: int
+    # sum of the live range lengths of all values in the slice
+    live_steps: int
+    rows: np.ndarray
+
+
+def live_bytes(starts: np.ndarray, ends: np.ndarray, sizes: np.ndarray) -> tuple[int, np.ndarray]:
+    """
+    live bytes at every step from the first start to the last end
+    """
+    first = int(starts.min())
+    events = np.zeros(int(ends.max()) - first + 2, dtype=np.int64)
+    np.add.at(events, starts - first, sizes)
+    np.add.at(events, ends - first + 1, -sizes)
+    return first, np.cumsum(events[:-1])
+
+
+def occupancy(starts: np.ndarray, ends: np.ndarray, sizes: np.ndarray, offsets: np.ndarray):
+    """
+    live bytes and high-water mark at every step from the first start to the last end
+    """
+    first, live = live_bytes(starts, ends, sizes)
+    high_water = range_chmax(len(live), starts - first, ends - first, offsets + sizes)
+    return first, live, high_water
+
+
+def _allocation_groups(module: ModuleStats) -> list[tuple[int, int, np.ndarray]]:
+    """
+    (allocation id, allocation size, rows) of every allocation with live values
+    """
+    rows = np.flatnonzero(module.live_start >= 0)
+    alloc_ids = module.value_alloc_ids[rows]
+    order = np.argsort(alloc_ids, kind="stable")
+    rows = rows[order]
+    groups = np.split(rows, np.flatnonzero(np.diff(alloc_ids[order])) + 1) if rows.size else []
+    alloc_sizes = dict(zip(module.allocation_ids.tolist(), module.allocation_sizes.tolist()))
+    result = []
+    for group in groups:
+        alloc_id = int(module.value_alloc_ids[group[0]])
+        result.append((alloc_id, alloc_sizes[alloc_id], group))
+    return result
+
+
+def _packing(live: np.ndarray, size: int) -> np.ndarray:
+    return live / size if size else np.zeros(len(live))
+
+
+def allocation_packing(module: ModuleStats) -> list[tuple[int, int, np.ndarray]]:
+    """
+    (allocation id, first step, live bytes / allocation size at every step) of every allocation with live values,
+    without the high-water marks of `allocation_reuse`
+    """
+    result = []
+    for alloc_id, size, group in _allocation_groups(module):
+        first, live = live_bytes(module.live_start[group], module.live_end[group], module.value_sizes[group])
+        result.append((alloc_id, first, _packing(live, size)))
+    return result
+
+
+def allocation_reuse(module: ModuleStats) -> list[AllocationReuse]:
+    result = []
+    for alloc_id, size, group in _allocation_groups(module):
+        starts = module.live_start[group]
+        ends = module.live_end[group]
+        first, live, high_water = occupancy(starts, ends, module.value_sizes[group], module.value_offsets[group])
+        fragmentation = high_water - live
+        worst = int(np.argmax(fragmentation))
+        packing = _packing(live, size)
+        lowest = int(np.argmin(packing))
+        result.append(AllocationReuse(
+            alloc_id=alloc_id,
+            size=size,
+            num_values=len(group),
+            first_step=first,
+            last_step=first + len(live) - 1,
+            peak_live=int(live.max()),
+            peak_high_water=int(high_water.max()),
+            mean_packing=float(packing.mean()),
+            min_packing=float(packing[lowest]),
+            min_packing_step=first + lowest,
+            worst_fragmentation_step=first + worst,
+            worst_fragmentation=int(fragmentation[worst]),
+            packing=packing,
+        ))
+    return result
+
+
+def reused_slices(module: ModuleStats, top: int = 25) -> list[ReusedSlice]:
+    """
+    (allocation, offset, size) slices shared by the most values
+    """
+    rows = np.flatnonzero(module.live_start >= 0)
+    if rows.size == 0:
+        return []
+    keys = np.stack([module.value_alloc_ids[rows], module.value_offsets[rows], module.value_sizes[rows]], axis=1)
+    unique, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    live_steps = np.bincount(inverse, weights=module.live_end[rows] - module.live_start[rows] + 1)
+    # most values first, larger slices first among equally reused ones
+    best = np.lexsort((-unique[:, 2], -counts))[:top]
+    return [
+        ReusedSlice(
+            alloc_id=int(unique[i, 0]),
+            offset=int(unique[i, 1]),
+            size=int(unique[i, 2]),
+            num_values=int(counts[i]),
+            live_steps=int(live_steps[i]),
+            rows=rows[inverse == i],
+        )
+        for i in best
+    ]
+
+
+def print_buffer_reuse(module: ModuleStats, top: int = 25):
+    console = Console()
+    allocations = sorted(allocation_reuse(module), key=lambda a: -a.size)
+    table = Table(title="Allocations", box=box.MARKDOWN)
+    table.add_column("a")
+    table.add_column("Size")
+    table.add_column("Values")
+    table.add_column("Peak live")
+    table.add_column("High-water")
+    table.add_column("Packing")
+    table.add_column("Lowest packing")
+    table.add_column("Fragmented")
+    table.add_column("at")
+    for a in allocations[:top]:
+        table.add_row(
+            str(a.alloc_id),
+            pretty_byte_size(a.size),
+            str(a.num_values),
+            pretty_byte_size(a.peak_live),
+            pretty_byte_size(a.peak_high_water),
+            f"{a.mean_packing:.1%}",
+            f"{a.min_packing:.1%} at {a.min_packing_step}",
+            pretty_byte_size(a.worst_fragmentation),
+            str(a.worst_fragmentation_step),
+        )
+    console.print(table)
+    total = sum(a.size for a in allocations)
+    unused = sum(a.size - a.peak_high_water for a in allocations)
+    console.print(f"{pretty_byte_size(unused)} of {pretty_byte_size(total)} are above the high-water mark "
+                  f"of their allocation at every step")
+
+    table = Table(title="Most reused slices", box=box.MARKDOWN)
+    table.add_column("a")
+    table.add_column("Offset")
+    table.add_column("Size")
+    table.add_column("Values")
+    table.add_column("Live steps")
+    table.add_column("e.g.", no_wrap=False)
+    for s in reused_slices(module, top):
+        names = [module.value_names[row] for row in s.rows[:3]]
+        table.add_row(
+            str(s.alloc_id),
+            pretty_byte_size(s.offset),
+            pretty_byte_size(s.size),
+            str(s.num_values),
+            str(s.live_steps),
+            ", ".join(names) + (", …" if s.num_values > len(names) else ""),
+        )
+    console.print(table)
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    # NumPy and the models are only imported once a module is loaded or stored, so that
+    # `--help` and shell completion stay fast
+    import numpy as np
+
+    from .models import ModuleStats
+
+# bump when the layout of ModuleStats.to_arrays() changes
+CACHE_VERSION = 2
+DEFAULT_MAX_CACHE_SIZE = 2 * 1024 ** 3  # 2GB
+
+
+def default_cache_dir() -> Path:
+    if "XLA_MEMORY_ANALYZER_CACHE" in os.environ:
+        return Path(os.environ["XLA_MEMORY_ANALYZER_CACHE"])
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "xla_memory_analyzer"
+
+
+def content_hasher():
+    """
+    the hash of `file_hash`, for hashing a file while it is read anyway
+    """
+    return hashlib.blake2b(digest_size=16)
+
+
+def file_hash(file: Path) -> str:
+    h = content_hasher()
+    with file.open("rb") as f:
+        while chunk := f.read(1024 ** 2):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ParseCache:
+    """
+    stores parsed modules as .npz files, one per buffer-assignment file.
+    An entry is valid if path, size and mtime of the file match, or if only the mtime changed but the content hash
+    is still the same. Entries are evicted least recently used first once the cache grows beyond `max_size`.
+    """
+
+    def __init__(self, directory: Optional[Path] = None, max_size: int = DEFAULT_MAX_CACHE_SIZE):
+        self.directory = directory if directory is not None else default_cache_dir()
+        self.max_size = max_size
+
+    def entry_path(self, file: Path) -> Path:
+        key = hashlib.blake2b(str(file.resolve()).encode(), digest_size=16).hexdigest()
+        return self.directory / f"{key}.npz"
+
+    def load(self, file: Path) -> Optional["ModuleStats"]:
+        import numpy as np
+
+        from .models import ModuleStats
+
+        entry = self.entry_path(file)
+        try:
+            stat = file.stat()
+            with np.load(entry, allow_pickle=False) as npz:
+                arrays = dict(npz)
+        except (OSError, ValueError):
+            return None
+        if int(arrays.pop("cache_version")) != CACHE_VERSION or int(arrays.pop("cache_size")) != stat.st_size:
+            return None
+        cached_hash = str(arrays.pop("cache_hash"))
+        if int(arrays.pop("cache_mtime_ns")) != stat.st_mtime_ns:
+            if file_hash(file) != cached_hash:
+                return None
+            self._write(entry, arrays, stat, cached_hash)
+        else:
+            # mark as recently used for the LRU eviction
+            os.utime(entry)
+        return ModuleStats.from_arrays(arrays)
+
+    def is_cached(self, file: Path) -> bool:
+        """
+        whether `load` would return the module, without reading its arrays
+        """
+        import numpy as np
+
+        try:
+            stat = file.stat()
+            with np.load(self.entry_path(file), allow_pickle=False) as npz:
+                version, size, mtime_ns, cached_hash = [
+                    npz[key] for key in ("cache_version", "cache_size", "cache_mtime_ns", "cache_hash")
+                ]
+        except (OSError, ValueError, KeyError):
+            return False
+        if int(version) != CACHE_VERSION or int(size) != stat.st_size:
+            return False
+        return int(mtime_ns) == stat.st_mtime_ns or file_hash(file) == str(cached_hash)
+
+    def store(self, file: Path, module: "ModuleStats", stat: os.stat_result, content_hash: str):
+        """
+        `stat` of the file is taken before it was parsed and `content_hash` is of the content it was parsed from.
+        Nothing is stored if the file changed in between.
+        """
+        current = file.stat()
+        if (current.st_size, current.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._write(self.entry_path(file), module.to_arrays(), stat, content_hash)
+        self.evict()
+
+    def _write(self, entry: Path, arrays: dict[str, "np.ndarray"], stat: os.stat_result, content_hash: str):
+        import numpy as np
+
+        tmp_file = entry.with_name(f"{entry.stem}.{os.getpid()}.tmp.npz")
+        np.savez(
+            tmp_file,
+            cache_version=np.array(CACHE_VERSION),
+            cache_size=np.array(stat.st_size),
+            cache_mtime_ns=np.array(stat.st_mtime_ns),
+            cache_hash=np.array(content_hash),
+            **arrays,
+        )
+        os.replace(tmp_file, entry)
+
+    def entries(self, include_tmp: bool = False) -> list[os.DirEntry]:
+        try:
+            return [
+                e for e in os.scandir(self.directory)
+                if e.name.endswith(".npz") and (include_tmp or ".tmp." not in e.name)
+            ]
+        except FileNotFoundError:
+            return []
+
+    @property
+    def total_size(self) -> int:
+        total = 0
+        for entry in self.entries():
+            try:
+                total += entry.stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    def evict(self):
+        entries = []
+        for entry in self.entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self) -> int:
+        removed = 0
+        for entry in self.entries(include_tmp=True):
+            try:
+                os.unlink(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+class ModuleNameIndex:
+    """
+    names and ids of the modules of each dump directory for shell completion, stored as small JSON files next to
+    the parse cache. An entry is valid as long as the mtime of the directory, which changes whenever a file is
+    added, removed or renamed, is the same.
+    """
+
+    def __init__(self, directory: Optional[Path] = None):
+        self.directory = (directory if directory is not None else default_cache_dir()) / "module_names"
+
+    def entry_path(self, dump_directory: Path) -> Path:
+        key = hashlib.blake2b(str(dump_directory.resolve()).encode(), digest_size=16).hexdigest()
+        return self.directory / f"{key}.json"
+
+    def modules(self, dump_directory: Path) -> list[tuple[str, int]]:
+        from .dump_files import memory_report_files, module_name_and_id
+
+        mtime_ns = dump_directory.stat().st_mtime_ns
+        entry = self.entry_path(dump_directory)
+        try:
+            with entry.open() as f:
+                cached = json.load(f)
+            if cached["mtime_ns"] == mtime_ns:
+                return [(name, module_id) for name, module_id in cached["modules"]]
+        except (OSError, ValueError, KeyError):
+            pass
+        modules = [module_name_and_id(file) for file in memory_report_files(dump_directory)]
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_file = entry.with_name(f"{entry.stem}.{os.getpid()}.tmp")
+            with tmp_file.open("w") as f:
+                json.dump({"mtime_ns": mtime_ns, "modules": modules}, f)
+            os.replace(tmp_file, entry)
+        except OSError:
+            # completion still works with a read-only cache directory, just without the index
+            pass
+        return modules
@@ -1,17 +1,183 @@
+import functools
+import sys
 from pathlib import Path
+from typing import Callable, Optional
 
 import click
-from rich.console import Console
 
-from .cli_utils import BYTE_SIZE, module_name_completer
+from .cache import ParseCache
+from .cli_utils import BYTE_SIZE, STEP_RANGE, module_name_completer, path_map_callback, where_callback
+from .config import load_config
+from .dump_files import filter_modules, plan_modules
+from .sources import SourceResolver
 from .utils import pretty_byte_size
-from .xla_memory_analyzer import main, load_all_modules
+# the modules doing the actual work import NumPy, pydantic, rich and scipy, so every command imports what it needs
+# itself, which keeps `--help` and shell completion fast
 
 
-@click.group()
-def cli():
+class CliGroup(click.Group):
+    def parse_args(self, ctx, args):
+        # the original command line, which is handed to a `serve` process unchanged
+        ctx.meta["argv"] = list(args)
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=CliGroup)
+@click.option("--no-cache", is_flag=True, help="Always parse the dump files instead of using the parse cache")
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Directory of the parse cache (default: ~/.cache/xla_memory_analyzer)",
+)
+@click.option(
+    "--cache-size",
+    "cache_size_bytes",
+    type=BYTE_SIZE,
+    default="2G",
+    show_default=True,
+    help="Maximum size of the parse cache",
+)
+@click.option(
+    "--parser",
+    type=click.Choice(["regex", "mmap"]),
+    default="regex",
+    show_default=True,
+    help="Parser engine for the buffer-assignment files, mmap scans each section of the memory-mapped file at once",
+)
+@click.option(
+    "--path-map",
+    "path_map",
+    multiple=True,
+    callback=path_map_callback,
+    metavar="FROM=TO",
+    help="Look for source files starting with FROM under TO instead (can be repeated)",
+)
+@click.option(
+    "--config",
+    "config_file",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    help="TOML config file (default: ~/.config/xla_memory_analyzer/config.toml)",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Print wall time, CPU time and memory of every phase and module to stderr after the command",
+)
+@click.option(
+    "--profile-json",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Also write the profile with all counters and phase records to this JSON file (implies --profile)",
+)
+@click.option(
+    "--profile-cprofile",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Run the command under cProfile and dump the stats to this file, e.g. for `python -m pstats` "
+         "(implies --profile)",
+)
+@click.option(
+    "--profile-tracemalloc",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Trace Python allocations, report the traced peak of every phase and dump a tracemalloc snapshot "
+         "to this file (implies --profile, slows everything down)",
+)
+@click.option(
+    "--no-server",
+    is_flag=True,
+    help="Run the command here even if a `serve` process for the dump directory is running",
+)
+@click.option(
+    "--where",
+    callback=where_callback,
+    metavar="EXPRESSION",
+    help="Only look at the values matching EXPRESSION, e.g. 'size > 1G and op_name ~ \"scatter\"'. Fields: size, "
+         "offset, id, at, allocation, start, end, length, sequence, line (numbers with ==, !=, <, <=, >, >=) and "
+         "name, op_name, source, array_info (strings with ==, != and regular expressions with ~, !~), combined "
+         "with and, or, not and parentheses",
+)
+@click.pass_context
+def cli(ctx, no_cache, cache_dir, cache_size_bytes, parser, path_map, config_file, profile, profile_json,
+        profile_cprofile, profile_tracemalloc, no_server, where):
     """XLA Memory Analyzer"""
-    pass
+    if profile or profile_json or profile_cprofile or profile_tracemalloc:
+        start_profile(ctx, profile_json, profile_cprofile, profile_tracemalloc)
+    config = load_config(config_file)
+    # set when the command runs inside a `serve` process
+    resident = (ctx.obj or {}).get("resident")
+    ctx.obj = {
+        "cache": resident if resident is not None else None if no_cache else ParseCache(cache_dir, cache_size_bytes),
+        "cache_dir": cache_dir,
+        "parser": parser,
+        # rules from the command line are tried before the ones of the config file
+        "sources": SourceResolver(path_map + list(config.get("path_map", {}).items())),
+        "forward": resident is None and not no_server,
+        "where": where,
+    }
+
+
+def start_profile(ctx, json_file: Optional[Path], cprofile_file: Optional[Path], tracemalloc_file: Optional[Path]):
+    """
+    the profile is printed and written when the command is done, even if it failed
+    """
+    from . import profiling
+
+    profiler = profiling.start(trace_memory=tracemalloc_file is not None)
+    cprofile = None
+    if cprofile_file is not None:
+        import cProfile
+
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+
+    def finish():
+        if ctx.meta.get("forwarded"):
+            # the server profiled the command
+            profiling.stop()
+            return
+        if cprofile is not None:
+            cprofile.disable()
+            cprofile.dump_stats(cprofile_file)
+        if tracemalloc_file is not None:
+            import tracemalloc
+
+            tracemalloc.take_snapshot().dump(str(tracemalloc_file))
+            tracemalloc.stop()
+        profiling.stop()
+        profiler.print_summary()
+        if json_file is not None:
+            profiler.write_json(json_file)
+
+    ctx.call_on_close(finish)
+
+
+def forward_to_server(f: Optional[Callable] = None, *, unless: Optional[Callable[[dict], bool]] = None):
+    """
+    runs the command in a `serve` process for the same directory if one is running, except when `unless` is true
+    for the parameters of the command
+    """
+    if f is None:
+        return functools.partial(forward_to_server, unless=unless)
+
+    @functools.wraps(f)
+    def wrapper(obj, *args, **kwargs):
+        if obj["forward"] and not (unless is not None and unless(click.get_current_context().params)):
+            from .server import find_server
+
+            ctx = click.get_current_context()
+            server = find_server(ctx.params["directory"], obj["cache_dir"])
+            response = server.run(ctx.meta["argv"]) if server is not None else None
+            if response is not None:
+                ctx.meta["forwarded"] = True
+                sys.stdout.write(response["stdout"])
+                sys.stderr.write(response["stderr"])
+                ctx.exit(response["exit_code"])
+        return f(obj, *args, **kwargs)
+
+    return wrapper
 
 
 def common_directory_arg(f):
@@ -21,6 +187,16 @@ def common_directory_arg(f):
     )(f)
 
 
+def common_jobs_option(f):
+    return click.option(
+        "-j", "--jobs",
+        type=click.IntRange(min=0),
+        default=1,
+        show_default=True,
+        help="Number of processes used to parse the modules (0 for all cores)",
+    )(f)
+
+
 @cli.command("list-modules")
 @common_directory_arg
 @click.option(
@@ -47,17 +223,26 @@ def common_directory_arg(f):
     is_flag=True,
     help="Show allocation sizes in bytes"
 )
-def list_modules(directory, sort_by_size, ignore_tiny, min_size_bytes, show_bytes):
+@common_jobs_option
+@click.pass_obj
+@forward_to_server
+def list_modules(obj, directory, sort_by_size, ignore_tiny, min_size_bytes, show_bytes, jobs):
     """
     List all XLA modules and their allocation sizes.
 
     DIRECTORY must be the folder created via:
       XLA_FLAGS="--xla_dump_to=some_directory"
     """
+    from rich.console import Console
+
+    from .xla_memory_analyzer import load_all_modules
+
     console = Console()
 
-    xla_dump = load_all_modules(directory)
+    xla_dump = load_all_modules(directory, jobs, obj["cache"], obj["parser"], obj["where"])
     all_modules = xla_dump.modules
+    if obj["where"] is not None:
+        all_modules = [module for module in all_modules if len(module.value_ids)]
     if ignore_tiny:
         all_modules = filter(lambda module: module.total_allocation > min_size_bytes, all_modules)
     if sort_by_size:
@@ -80,17 +265,346 @@ def list_modules(directory, sort_by_size, ignore_tiny, min_size_bytes, show_byte
 )
 @click.option("--only-main-peak", is_flag=True)
 @click.option("--skip-small-modules", is_flag=True)
+@click.option(
+    "--prominence",
+    type=click.FloatRange(0, 1),
+    default=0.2,
+    show_default=True,
+    help="Minimum prominence of a peak as a fraction of the largest size",
+)
+@click.option(
+    "--width",
+    type=click.FloatRange(min=0),
+    default=None,
+    help="Minimum width of a peak in steps",
+)
+@click.option(
+    "--plot",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Save the size over time with the peaks marked to this image (one file per module if several match)",
+)
+@common_jobs_option
+@click.pass_obj
+@forward_to_server
 def main_command(
+        obj: dict,
         directory: Path,
         modules: list[str],
         skip_small_modules: bool,
         only_main_peak: bool,
+        prominence: float,
+        width: Optional[float],
+        plot: Optional[Path],
+        jobs: int,
 ):
-    if modules is None:
+    from .xla_memory_analyzer import main
+
+    if not modules:
         modules = [
             "function_using_idx", "forward_model",
             "unnamed_wrapped_function", "scatter_gather_func",
             "scan_body", "jit_scan"
         ]
     print(modules)
-    main(directory, modules, skip_small_modules, only_main_peak)
+    main(directory, modules, skip_small_modules, only_main_peak, jobs, obj["cache"], obj["parser"], prominence, width,
+         plot, obj["sources"], obj["where"])
+
+
+@cli.command("live-at")
+@common_directory_arg
+@click.argument("module", shell_complete=module_name_completer)
+@click.argument("steps", nargs=-1, required=True, type=STEP_RANGE)
+@click.option(
+    "-n", "--limit",
+    type=click.IntRange(min=0),
+    default=25,
+    show_default=True,
+    help="Number of values listed per step (0 for all)",
+)
+@common_jobs_option
+@click.pass_obj
+@forward_to_server
+def live_at_command(obj: dict, directory: Path, module: str, steps: list[tuple[int, int]], limit: int, jobs: int):
+    """
+    List the values of MODULE that are live at a step (e.g. 120) or at any point of a range of steps (e.g. 100-200).
+    Several STEPS can be queried at once, the module is only parsed once.
+    """
+    from .xla_memory_analyzer import live_at
+
+    live_at(directory, [module], steps, limit, jobs, obj["cache"], obj["parser"], obj["where"])
+
+
+@cli.command("watch")
+@common_directory_arg
+@click.option("--interval", type=click.FloatRange(min=0.05), default=1.0, show_default=True,
+              help="Seconds between updates")
+@click.option("-n", "--top", type=click.IntRange(min=1), default=20, show_default=True,
+              help="Number of largest modules shown")
+@click.option("--memory-limit", "memory_limit_bytes", type=BYTE_SIZE, default=None,
+              help="Highlight modules allocating more than this (e.g. 80G)")
+@click.option("--exit-on-limit", is_flag=True, help="Stop with exit code 1 as soon as a module exceeds --memory-limit")
+@click.option("--polling", is_flag=True, help="Poll the directory even if inotify is available")
+@common_jobs_option
+@click.pass_obj
+def watch_command(obj, directory, interval, top, memory_limit_bytes, exit_on_limit, polling, jobs):
+    """
+    Follow a dump directory while XLA writes it and keep a live table of the largest modules.
+    Only new or rewritten modules are parsed. Stop with Ctrl-C.
+    """
+    from .watch import watch
+
+    state = watch(directory, interval, top, memory_limit_bytes, exit_on_limit, polling, jobs, obj["cache"],
+                  obj["parser"], obj["where"])
+    if exit_on_limit and state.over_limit:
+        sys.exit(1)
+
+
+@cli.command("buffer-reuse")
+@common_directory_arg
+@click.argument("modules", nargs=-1, required=True, shell_complete=module_name_completer)
+@click.option("-n", "--top", type=click.IntRange(min=1), default=25, show_default=True,
+              help="Number of allocations and slices listed")
+@common_jobs_option
+@click.pass_obj
+@forward_to_server
+def buffer_reuse_command(obj: dict, directory: Path, modules: list[str], top: int, jobs: int):
+    """
+    Show how densely the values of each allocation of MODULES are packed: live bytes against the allocation size,
+    the step with the most fragmentation and the slices reused by the most values.
+    """
+    from .xla_memory_analyzer import buffer_reuse
+
+    buffer_reuse(directory, modules, top, jobs, obj["cache"], obj["parser"], obj["where"])
+
+
+@cli.command("export")
+@common_directory_arg
+@click.argument("modules", nargs=-1, shell_complete=module_name_completer)
+@click.option(
+    "-f", "--format",
+    type=click.Choice(["ndjson", "arrow", "npz"]),
+    default="ndjson",
+    show_default=True,
+    help="ndjson: one JSON object per line, arrow: one Arrow IPC stream per table (needs pyarrow), "
+         "npz: one NumPy archive per module",
+)
+@click.option(
+    "-o", "--output",
+    type=click.Path(path_type=Path),
+    default=None,
+    help="Output file for ndjson (default: stdout), output directory for arrow and npz",
+)
+@common_jobs_option
+@click.pass_obj
+# the server would hold the whole export to stdout in memory and send it back in one reply
+@forward_to_server(unless=lambda params: params["output"] is None or str(params["output"]) == "-")
+def export_command(obj: dict, directory: Path, modules: list[str], format: str, output: Optional[Path], jobs: int):
+    """
+    Export modules, allocations, values, size curves and allocation packing of all MODULES (default: all modules),
+    one module at a time.
+    """
+    from .xla_memory_analyzer import export
+
+    if output is None:
+        if format != "ndjson":
+            raise click.UsageError(f"--output directory is required for {format}")
+        output = Path("-")
+    if format == "arrow":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise click.UsageError("the arrow format needs pyarrow, install it or use --format npz")
+    count = export(directory, list(modules) or None, format, output, jobs, obj["cache"], obj["parser"], obj["where"])
+    if str(output) != "-":
+        click.echo(f"exported {count} modules to {output}", err=True)
+
+
+@cli.command("aggregate")
+@click.argument("directories", nargs=-1, required=True)
+@click.option("-m", "--module", "modules", multiple=True,
+              help="Only modules whose name contains this (can be repeated)")
+@click.option("-n", "--top", type=click.IntRange(min=1), default=25, show_default=True)
+@click.option("--sort-by", type=click.Choice(["total", "peak", "skew"]), default="total", show_default=True)
+@common_jobs_option
+@click.pass_obj
+def aggregate_command(obj: dict, directories: list[str], modules: list[str], top: int, sort_by: str, jobs: int):
+    """
+    Compare the modules of many dump directories (e.g. one per host), given as paths or glob patterns
+    like 'dump_host_*'. Modules are matched by name across hosts, identical files are only parsed once.
+    """
+    from .aggregate import aggregate, expand_directories, print_aggregate
+
+    dirs = expand_directories(list(directories))
+    if not dirs:
+        raise click.BadParameter("no dump directory found", param_hint="DIRECTORIES")
+    aggregated, num_parsed = aggregate(dirs, list(modules) or None, jobs, obj["cache"], obj["parser"], obj["where"])
+    print_aggregate(dirs, aggregated, num_parsed, top, sort_by)
+
+
+@cli.command("attribute")
+@common_directory_arg
+@click.argument("modules", nargs=-1, required=True, shell_complete=module_name_completer)
+@click.option("--all-peaks", is_flag=True, help="Attribute every peak instead of only the main one")
+@click.option("--by", type=click.Choice(["source", "op_name", "both"]), default="both", show_default=True)
+@click.option("--min-share", type=click.FloatRange(0, 1), default=0.01, show_default=True,
+              help="Hide entries with a smaller share of the bytes at the peak")
+@click.option("--max-children", type=click.IntRange(min=1), default=10, show_default=True)
+@common_jobs_option
+@click.pass_obj
+@forward_to_server
+def attribute_command(obj: dict, directory: Path, modules: list[str], all_peaks: bool, by: str, min_share: float,
+                      max_children: int, jobs: int):
+    """
+    Break down the bytes live at the main peak (or every peak) of MODULES by source file, function and line
+    and by op_name scope.
+    """
+    from .xla_memory_analyzer import attribute
+
+    attribute(directory, modules, all_peaks, by, min_share, max_children, jobs, obj["cache"], obj["parser"],
+              obj["sources"], obj["where"])
+
+
+@cli.command("what-if")
+@common_directory_arg
+@click.argument("modules", nargs=-1, required=True, shell_complete=module_name_completer)
+@click.option("--min-size", "min_size_bytes", type=BYTE_SIZE, default="1M", show_default=True,
+              help="Only consider values at least this large")
+@click.option("--shorten-to", type=click.IntRange(min=1), default=1, show_default=True,
+              help="Steps a shortened value stays live")
+@click.option("--sort-by", type=click.Choice(["removed", "shortened", "rematerialized"]), default="removed",
+              show_default=True)
+@click.option("-n", "--top", type=click.IntRange(min=1), default=25, show_default=True)
+@common_jobs_option
+@click.pass_obj
+@forward_to_server
+def what_if_command(obj: dict, directory: Path, modules: list[str], min_size_bytes: int, shorten_to: int,
+                    sort_by: str, top: int, jobs: int):
+    """
+    Rank the values of MODULES by how much the module peak would drop if each of them was removed, freed earlier
+    or rematerialized.
+    """
+    from .xla_memory_analyzer import what_if
+
+    what_if(directory, modules, min_size_bytes, shorten_to, sort_by, top, jobs, obj["cache"], obj["parser"],
+            obj["where"])
+
+
+@cli.command("graph")
+@common_directory_arg
+@click.argument("module", shell_complete=module_name_completer)
+@click.option("--peak", type=int, default=None, help="Start from the values live at this step (default: main peak)")
+@click.option("--value", "value_names", multiple=True,
+              help="Start from this value instead, by name or id (can be repeated)")
+@click.option("--hops", type=click.IntRange(min=0), default=2, show_default=True,
+              help="Maximum number of use/operand edges from the start values")
+@click.option("--min-size", "min_size_bytes", type=BYTE_SIZE, default="1M", show_default=True,
+              help="Values smaller than this are neither drawn nor followed")
+@click.option("--max-seeds", type=click.IntRange(min=1), default=20, show_default=True,
+              help="Number of largest values at the peak to start from")
+@click.option("--max-nodes", type=click.IntRange(min=1), default=500, show_default=True)
+@click.option("--time-budget", type=click.FloatRange(min=0), default=5.0, show_default=True,
+              help="Stop expanding the graph after this many seconds")
+@click.option("-o", "--output", type=click.File("w"), default="-",
+              help="DOT file to write (default: stdout), e.g. render it with `dot -Tsvg`")
+@click.pass_obj
+@forward_to_server
+def graph_command(obj, directory, module, peak, value_names, hops, min_size_bytes, max_seeds, max_nodes, time_budget,
+                  output):
+    """
+    Write the neighbourhood of the values live at a peak of MODULE (or of single values) as a DOT graph.
+    """
+    from .graph import NeighbourhoodGraph, peak_seeds
+    from .xla_memory_analyzer import load_module
+
+    selected = filter_modules(plan_modules(directory), [module])
+    if not selected:
+        raise click.BadParameter(f"no module matches {module}", param_hint="MODULE")
+    module_stats = load_module(selected[0].memory_report_file, obj["cache"], obj["parser"])
+    if obj["where"] is not None:
+        module_stats = obj["where"].apply(module_stats)
+    if value_names:
+        seeds = []
+        for name in value_names:
+            try:
+                seeds.append(module_stats.row_of(int(name)) if name.isdigit()
+                             else module_stats.row_of(module_stats.value_name_to_id[name]))
+            except KeyError:
+                raise click.BadParameter(f"{module_stats.name} has no value {name}", param_hint="--value")
+    elif not len(module_stats.value_ids):
+        raise click.BadParameter(f"no values of {module_stats.name} match {obj['where'].expression}",
+                                 param_hint="--where")
+    else:
+        seeds = peak_seeds(module_stats, peak, min_size_bytes, max_seeds)
+    graph = NeighbourhoodGraph(module_stats, output, hops, min_size_bytes, max_nodes, time_budget)
+    graph.write(seeds)
+    if graph.truncated is not None:
+        click.echo(f"graph incomplete, stopped at the {graph.truncated}", err=True)
+
+
+@cli.command("serve")
+@common_directory_arg
+@click.option("--port", type=click.IntRange(0, 65535), default=0, show_default=True,
+              help="Port on localhost to listen on (0 for any free port)")
+@common_jobs_option
+@click.pass_obj
+def serve_command(obj: dict, directory: Path, port: int, jobs: int):
+    """
+    Parse all modules of DIRECTORY once and keep them in memory. Commands run on DIRECTORY while the server is
+    running are executed by it, only modules whose files changed are parsed again. Stop with Ctrl-C.
+    """
+    from .server import find_server, serve
+
+    if find_server(directory, obj["cache_dir"]) is not None:
+        raise click.UsageError(f"a server for {directory} is already running")
+    serve(directory, port, jobs, obj["cache"], obj["parser"], obj["cache_dir"])
+
+
+@cli.group("cache")
+def cache_group():
+    """Manage the parse cache"""
+    pass
+
+
+@cache_group.command("clear")
+@click.pass_obj
+def cache_clear(obj):
+    """Remove all cached modules"""
+    cache = ParseCache(obj["cache_dir"])
+    removed = cache.clear()
+    print(f"removed {removed} cached modules from {cache.directory}")
+
+
+@cache_group.command("info")
+@click.pass_obj
+def cache_info(obj):
+    """Show location and size of the parse cache"""
+    cache = ParseCache(obj["cache_dir"])
+    print(f"{cache.directory}: {len(cache.entries())} modules, {pretty_byte_size(cache.total_size)}")
+
+
+@cli.command("generate-dump")
+@click.argument("directory", type=click.Path(file_okay=False, path_type=Path))
+@click.option("--modules", "num_modules", type=click.IntRange(min=1), default=4, show_default=True)
+@click.option("--allocations", "num_allocations", type=click.IntRange(min=1), default=16, show_default=True)
+@click.option("--values", "num_values", type=click.IntRange(min=1), default=1000, show_default=True)
+@click.option("--sequence-length", type=click.IntRange(min=1), default=2000, show_default=True)
+@click.option(
+    "--metadata-density",
+    type=click.FloatRange(0, 1),
+    default=0.8,
+    show_default=True,
+    help="Fraction of instructions with op_name and source metadata",
+)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--hlo/--no-hlo", default=True, show_default=True, help="Also write the optimized HLO module")
+def generate_dump_command(directory, num_modules, num_allocations, num_values, sequence_length, metadata_density,
+                          seed, hlo):
+    """
+    Write a synthetic dump directory, e.g. for benchmarks.
+    """
+    from .synthetic import generate_dump
+
+    files = generate_dump(directory, num_modules, num_allocations, num_values, sequence_length, metadata_density, seed,
+                          hlo)
+    print(f"wrote {len(files)} modules to {directory}")
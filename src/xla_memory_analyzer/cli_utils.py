@@ -3,6 +3,10 @@ from pathlib import Path
 import click
 from click.shell_completion import CompletionItem
 
+from .cache import ModuleNameIndex
+from .sources import parse_path_map
+from .utils import byte_size_units
+
 
 class ByteSizeParamType(click.ParamType):
     name = "bytesize"
@@ -27,42 +31,71 @@ class ByteSizeParamType(click.ParamType):
         except ValueError:
             self.fail(f"invalid size value: {value}", param, ctx)
 
-        multipliers = {
-            "": 1024 ** 0,
-            "B": 1024 ** 0,
-            "K": 1024 ** 1,
-            "KB": 1024 ** 1,
-            "M": 1024 ** 2,
-            "MB": 1024 ** 2,
-            "G": 1024 ** 3,
-            "GB": 1024 ** 3,
-            "T": 1024 ** 4,
-            "TB": 1024 ** 4,
-        }
-
-        if unit_part not in multipliers:
+        if unit_part not in byte_size_units:
             self.fail(f"unknown size unit: {unit_part}", param, ctx)
 
-        return int(num * multipliers[unit_part])
+        return int(num * byte_size_units[unit_part])
 
 
 BYTE_SIZE = ByteSizeParamType()
 
 
+class StepRangeParamType(click.ParamType):
+    name = "steprange"
+
+    def convert(self, value, param, ctx):
+        """
+        Parse a single step like “120” or an inclusive range like “100-200”
+        into a (start, end) tuple.
+        """
+        if isinstance(value, tuple):
+            return value
+        start, sep, end = value.strip().partition("-")
+        try:
+            start = int(start)
+            end = int(end) if sep else start
+        except ValueError:
+            self.fail(f"invalid step or step range: {value}", param, ctx)
+        if end < start:
+            self.fail(f"range ends before it starts: {value}", param, ctx)
+        return start, end
+
+
+STEP_RANGE = StepRangeParamType()
+
+
+def path_map_callback(ctx, param, value):
+    try:
+        return parse_path_map(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e), ctx, param)
+
+
+def where_callback(ctx, param, value):
+    if value is None:
+        return None
+    # NumPy is only imported when a filter is given
+    from .value_filter import ValueFilter
+
+    try:
+        return ValueFilter(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e), ctx, param)
+
+
 def module_name_completer(ctx, param, incomplete):
     directory: Path = ctx.params.get("directory")
     if not directory:
         return []
 
-    # your own logic to discover module names under `directory`
-    all_suggestions:list[CompletionItem] = []
+    # the group callback doesn't run while completing, so the cache directory is read from its parameters
+    cache_dir = ctx.find_root().params.get("cache_dir")
     try:
-        for p in Path(directory).glob("*memory-usage-report.txt"):
-            module_name = p.stem.split(".")[1]
-            module_id = p.stem.split(".")[0].split("_")[1]
-            all_suggestions.append(CompletionItem(module_name, help=module_id))
+        modules = ModuleNameIndex(cache_dir).modules(Path(directory))
     except Exception:
         return []
-    suggestions = list(filter(lambda c: c.value.startswith(incomplete), all_suggestions))
-    print(len(suggestions))
-    return suggestions
+    return [
+        CompletionItem(module_name, help=str(module_id))
+        for module_name, module_id in modules
+        if module_name.startswith(incomplete)
+    ]
@@ -0,0 +1,30 @@
+"""
+optional TOML config file, e.g.
+
+    [path_map]
+    "/builds/project/" = "/home/user/project/"
+"""
+import os
+from pathlib import Path
+from typing import Optional
+
+
+def default_config_path() -> Path:
+    if "XLA_MEMORY_ANALYZER_CONFIG" in os.environ:
+        return Path(os.environ["XLA_MEMORY_ANALYZER_CONFIG"])
+    config_home = os.environ.get("XDG_CONFIG_HOME") or Path.home() / ".config"
+    return Path(config_home) / "xla_memory_analyzer" / "config.toml"
+
+
+def load_config(path: Optional[Path] = None) -> dict:
+    """
+    an explicitly given config file has to exist, the default one is optional
+    """
+    if path is None:
+        path = default_config_path()
+        if not path.exists():
+            return {}
+    import tomllib
+
+    with path.open("rb") as f:
+        return tomllib.load(f)
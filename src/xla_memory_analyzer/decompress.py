@@ -0,0 +1,169 @@
+"""
+reading dump files that are stored gzip (`.gz`) or zstd (`.zst`) compressed.
+Compressed files are decompressed in a background thread into a small queue of chunks, so that reading the file
+(often from a network filesystem) and decompressing it overlaps with parsing the lines in the calling thread.
+Nothing is ever written to disk uncompressed.
+With a `hasher`, everything read from the file itself (the compressed bytes of compressed files) is fed into it, so
+that the parse cache gets the content hash without reading the file a second time.
+"""
+import gzip
+import io
+import queue
+import threading
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+compression_suffixes = (".gz", ".zst")
+CHUNK_SIZE = 1024 ** 2
+# decompressed chunks the background thread may be ahead of the parser
+QUEUE_SIZE = 8
+
+
+def is_compressed(file: Path) -> bool:
+    return file.suffix in compression_suffixes
+
+
+def strip_compression_suffix(name: str) -> str:
+    for suffix in compression_suffixes:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def with_existing_suffix(file: Path) -> Path:
+    """
+    `file` itself if it exists, otherwise the first compressed variant of it that does
+    """
+    plain = file.with_name(strip_compression_suffix(file.name))
+    for candidate in (file, plain, *(plain.with_name(plain.name + suffix) for suffix in compression_suffixes)):
+        if candidate.exists():
+            return candidate
+    return file
+
+
+class HashingReader(io.RawIOBase):
+    """
+    raw stream of `file` that feeds everything read into `hasher`
+    """
+
+    def __init__(self, file: Path, hasher):
+        self._raw = file.open("rb", buffering=0)
+        self.hasher = hasher
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = self._raw.readinto(buffer)
+        if n:
+            self.hasher.update(memoryview(buffer)[:n])
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._raw.close()
+        super().close()
+
+
+def _open_decompressed(file: Path, raw: Optional[BinaryIO] = None) -> BinaryIO:
+    """
+    decompressed stream of `file`, read from `raw` if given, which is left open
+    """
+    if file.suffix == ".gz":
+        return gzip.open(file, "rb") if raw is None else gzip.GzipFile(fileobj=raw, mode="rb")
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(f"reading {file.name} needs the zstandard package (the `zstd` extra)") from None
+    return zstandard.ZstdDecompressor().stream_reader(
+        file.open("rb") if raw is None else raw, read_size=CHUNK_SIZE, closefd=raw is None
+    )
+
+
+class ThreadedDecompressor(io.RawIOBase):
+    """
+    raw stream of the decompressed content of `file`, filled by a background thread
+    """
+
+    def __init__(self, file: Path, hasher=None):
+        self.file = file
+        self._queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._stop = threading.Event()
+        self._chunk = memoryview(b"")
+        self._eof = False
+        # open in the calling thread, so that a missing file or package raises right here
+        self._raw = HashingReader(file, hasher) if hasher is not None else None
+        self._source = _open_decompressed(file, self._raw)
+        self._thread = threading.Thread(target=self._run, name=f"decompress {file.name}", daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        try:
+            with self._source:
+                while chunk := self._source.read(CHUNK_SIZE):
+                    if not self._put(chunk):
+                        return
+            if self._raw is not None:
+                # the hash covers the whole file, also anything after the compressed data
+                while self._raw.read(CHUNK_SIZE):
+                    pass
+        except Exception as e:
+            # raised again in the reading thread
+            self._put(e)
+            return
+        finally:
+            if self._raw is not None:
+                self._raw.close()
+        self._put(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self._chunk and not self._eof:
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                self._eof = True
+                raise item
+            if not item:
+                self._eof = True
+            self._chunk = memoryview(item)
+        n = min(len(buffer), len(self._chunk))
+        buffer[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+        super().close()
+
+
+def open_dump_file(file: Path, hasher=None) -> BinaryIO:
+    """
+    binary stream of a plain or compressed dump file, best iterated line by line
+    """
+    if not is_compressed(file):
+        if hasher is None:
+            return file.open("rb")
+        return io.BufferedReader(HashingReader(file, hasher), buffer_size=CHUNK_SIZE)
+    return io.BufferedReader(ThreadedDecompressor(file, hasher), buffer_size=CHUNK_SIZE)
+
+
+def open_dump_text(file: Path) -> io.TextIOBase:
+    """
+    for reading a few lines, e.g. a header, where a background thread isn't worth it
+    """
+    if not is_compressed(file):
+        return file.open("r")
+    return io.TextIOWrapper(_open_decompressed(file))
@@ -0,0 +1,113 @@
+import re
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from .decompress import open_dump_text, strip_compression_suffix, with_existing_suffix
+
+total_bytes_re = re.compile(r'^Total bytes used:\s*(?P<total>\d+)')
+allocation_size_re = re.compile(r'^allocation\s+\d+:\s*size\s+(?P<size>\d+),')
+
+
+class ModuleFile(NamedTuple):
+    memory_report_file: Path
+    name: str
+    id: int
+    total_allocation: int
+
+
+class ModuleSummary(NamedTuple):
+    id: int
+    name: str
+    total_allocation: int
+    peak_size: int
+
+
+def summarize(module) -> ModuleSummary:
+    """
+    the few numbers of a parsed module that are kept when the module itself isn't
+    """
+    times, sizes = module.size_over_time
+    return ModuleSummary(module.id, module.name, module.total_allocation, int(sizes.max()) if sizes.size else 0)
+
+
+def memory_report_files(directory: Path) -> list[Path]:
+    """
+    plain or compressed, if a report exists both ways the plain one is used
+    """
+    reports = {}
+    for file in sorted(directory.glob("*memory-usage-report.txt*")):
+        plain_name = strip_compression_suffix(file.name)
+        if plain_name.endswith("memory-usage-report.txt") and (plain_name not in reports or file.name == plain_name):
+            reports[plain_name] = file
+    return sorted(reports.values())
+
+
+def buffer_assignment_path(memory_report_file: Path) -> Path:
+    """
+    the buffer-assignment file may be compressed differently than the memory-usage-report
+    """
+    return with_existing_suffix(
+        memory_report_file.parent / memory_report_file.name.replace("memory-usage-report", "buffer-assignment")
+    )
+
+
+def hlo_path(buffer_assignment_file: Path) -> Path:
+    """
+    the optimized HLO module next to a buffer-assignment file, which may be compressed as well
+    """
+    name = strip_compression_suffix(buffer_assignment_file.name).replace("-buffer-assignment", "")
+    return with_existing_suffix(buffer_assignment_file.parent / name)
+
+
+def module_name_and_id(memory_report_file: Path) -> tuple[str, int]:
+    """
+    XLA names the dump files `module_<id>.<name>.<suffix>`
+    """
+    parts = memory_report_file.stem.split(".")
+    return parts[1], int(parts[0].split("_")[1])
+
+
+def read_total_allocation(memory_report_file: Path) -> int:
+    """
+    total size of all allocations of a module without parsing the buffer assignment.
+    The memory-usage-report starts with this number, otherwise only the allocation headers are summed up.
+    """
+    with open_dump_text(memory_report_file) as f:
+        m = total_bytes_re.match(f.readline())
+    if m:
+        return int(m["total"])
+    total = 0
+    with open_dump_text(buffer_assignment_path(memory_report_file)) as f:
+        for line in f:
+            if line.startswith("Used values:"):
+                break
+            m = allocation_size_re.match(line)
+            if m:
+                total += int(m["size"])
+    return total
+
+
+def plan_modules(directory: Path) -> list[ModuleFile]:
+    """
+    name, id and total allocation size of all modules, read only from the file names and headers
+    """
+    modules = []
+    for file in memory_report_files(directory):
+        name, module_id = module_name_and_id(file)
+        modules.append(ModuleFile(file, name, module_id, read_total_allocation(file)))
+    return modules
+
+
+def filter_modules(
+        modules: list[ModuleFile],
+        interesting_modules: Optional[list[str]] = None,
+        min_size: int = 0,
+) -> list[ModuleFile]:
+    """
+    keep modules whose name contains one of `interesting_modules` and that allocate at least `min_size` bytes
+    """
+    return [
+        module for module in modules
+        if module.total_allocation >= min_size
+           and (interesting_modules is None or any(name in module.name for name in interesting_modules))
+    ]
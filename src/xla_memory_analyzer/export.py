@@ -0,0 +1,237 @@
+"""
+machine-readable export of modules, allocations, values, size curves and the packing of every allocation (live
+bytes / allocation size). The packing only changes where a value becomes live or dead, so it is stored as runs of
+steps with the same packing.
+Modules are written one at a time as they are parsed, so a dump never has to fit into memory as a whole.
+
+Formats:
+- ndjson: one JSON object per line, the `type` field says which table the line belongs to
+- arrow: one Arrow IPC stream per table with one record batch per module (needs pyarrow),
+  strings are dictionary encoded like in `ModuleStats`
+- npz: one NumPy archive per module with the same columns, no extra dependency
+"""
+import json
+import sys
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Optional, TextIO
+
+import numpy as np
+
+from .buffer_reuse import allocation_packing
+from .models import ModuleStats, pack_strings
+
+# integer columns using -1 for missing values
+nullable_columns = {"peak_step", "live_start", "live_end", "sequence", "source_line"}
+
+
+def packing_runs(module: ModuleStats) -> dict[str, np.ndarray]:
+    """
+    the packing of every allocation with live values, from the first step one of its values is live to the last
+    """
+    alloc_ids, start_steps, end_steps, packings = [], [], [], []
+    for alloc_id, first, packing in allocation_packing(module):
+        # NaN differs from the first packing, which starts the first run
+        starts = np.flatnonzero(np.diff(packing, prepend=np.nan))
+        alloc_ids.append(np.full(len(starts), alloc_id, dtype=np.int64))
+        start_steps.append(first + starts)
+        end_steps.append(first + np.append(starts[1:], len(packing)) - 1)
+        packings.append(packing[starts])
+    return {
+        "alloc_id": np.concatenate(alloc_ids or [np.zeros(0, dtype=np.int64)]),
+        "start_step": np.concatenate(start_steps or [np.zeros(0, dtype=np.int64)]),
+        "end_step": np.concatenate(end_steps or [np.zeros(0, dtype=np.int64)]),
+        "packing": np.concatenate(packings or [np.zeros(0)]),
+    }
+
+
+def module_columns(module: ModuleStats) -> dict[str, dict]:
+    """
+    all tables of one module as columns, string columns are (indices, strings) pairs with -1 for None
+    """
+    n = len(module.value_ids)
+    times, sizes = module.size_over_time
+    peak = int(np.argmax(sizes)) if sizes.size else -1
+    packing = packing_runs(module)
+    return {
+        "modules": {
+            "module_id": np.array([module.id], dtype=np.int64),
+            "name": (np.zeros(1, dtype=np.int32), [module.name]),
+            "total_allocation": np.array([module.total_allocation], dtype=np.int64),
+            "num_values": np.array([n], dtype=np.int64),
+            "peak_step": np.array([times[peak] if peak >= 0 else -1], dtype=np.int64),
+            "peak_size": np.array([sizes[peak] if peak >= 0 else 0], dtype=np.int64),
+        },
+        "allocations": {
+            "module_id": np.full(len(module.allocation_ids), module.id, dtype=np.int64),
+            "alloc_id": module.allocation_ids,
+            "size": module.allocation_sizes,
+        },
+        "values": {
+            "module_id": np.full(n, module.id, dtype=np.int64),
+            "id": module.value_ids,
+            "name": (np.arange(n, dtype=np.int32), module.value_names),
+            "at": module.value_at,
+            "size": module.value_sizes,
+            "offset": module.value_offsets,
+            "alloc_id": module.value_alloc_ids,
+            "array_info": (module.array_info_idx, module.array_info_table.strings),
+            "live_start": module.live_start,
+            "live_end": module.live_end,
+            "sequence": module.sequence,
+            "op_name": (module.op_name_idx, module.op_name_table.strings),
+            "source_file": (module.source_file_idx, module.source_file_table.strings),
+            "source_line": module.source_line,
+        },
+        "size_curves": {
+            "module_id": np.full(len(times), module.id, dtype=np.int64),
+            "step": times,
+            "size": sizes,
+        },
+        "allocation_packing": {
+            "module_id": np.full(len(packing["alloc_id"]), module.id, dtype=np.int64),
+            **packing,
+        },
+    }
+
+
+def _null_if_negative(v: int) -> Optional[int]:
+    return v if v >= 0 else None
+
+
+def write_ndjson(module: ModuleStats, out: TextIO):
+    columns = module_columns(module)
+    dumps = json.JSONEncoder(separators=(",", ":")).encode
+    m = columns["modules"]
+    out.write(dumps({
+        "type": "module", "module_id": module.id, "name": module.name,
+        "total_allocation": module.total_allocation, "num_values": int(m["num_values"][0]),
+        "peak_step": _null_if_negative(int(m["peak_step"][0])), "peak_size": int(m["peak_size"][0]),
+    }) + "\n")
+    for alloc_id, size in zip(module.allocation_ids.tolist(), module.allocation_sizes.tolist()):
+        out.write(dumps({"type": "allocation", "module_id": module.id, "alloc_id": alloc_id, "size": size}) + "\n")
+
+    v = columns["values"]
+    array_info_table = module.array_info_table.strings
+    op_name_table = module.op_name_table.strings
+    source_file_table = module.source_file_table.strings
+    rows = zip(
+        v["id"].tolist(), module.value_names, v["at"].tolist(), v["size"].tolist(), v["offset"].tolist(),
+        v["alloc_id"].tolist(), v["array_info"][0].tolist(), v["live_start"].tolist(), v["live_end"].tolist(),
+        v["sequence"].tolist(), v["op_name"][0].tolist(), v["source_file"][0].tolist(), v["source_line"].tolist(),
+    )
+    for (value_id, name, at, size, offset, alloc_id, array_info, live_start, live_end, sequence, op_name,
+         source_file, source_line) in rows:
+        out.write(dumps({
+            "type": "value", "module_id": module.id, "id": value_id, "name": name, "at": at, "size": size,
+            "offset": offset, "alloc_id": alloc_id,
+            "array_info": array_info_table[array_info] if array_info >= 0 else None,
+            "live_range": [live_start, live_end] if live_start >= 0 else None,
+            "sequence": _null_if_negative(sequence),
+            "op_name": op_name_table[op_name] if op_name >= 0 else None,
+            "source_file": source_file_table[source_file] if source_file >= 0 else None,
+            "source_line": _null_if_negative(source_line),
+        }) + "\n")
+
+    # the curve is dense, so it is stored as one line per module starting at `first_step`
+    steps = columns["size_curves"]["step"]
+    out.write(dumps({
+        "type": "size_curve", "module_id": module.id, "first_step": int(steps[0]) if steps.size else None,
+        "sizes": columns["size_curves"]["size"].tolist(),
+    }) + "\n")
+    p = columns["allocation_packing"]
+    for alloc_id, start_step, end_step, packing in zip(
+            p["alloc_id"].tolist(), p["start_step"].tolist(), p["end_step"].tolist(), p["packing"].tolist()
+    ):
+        out.write(dumps({
+            "type": "allocation_packing", "module_id": module.id, "alloc_id": alloc_id,
+            "start_step": start_step, "end_step": end_step, "packing": packing,
+        }) + "\n")
+
+
+def write_npz(module: ModuleStats, directory: Path) -> Path:
+    arrays = {}
+    for table, columns in module_columns(module).items():
+        for name, column in columns.items():
+            if isinstance(column, tuple):
+                idx, strings = column
+                arrays[f"{table}.{name}"] = idx
+                arrays[f"{table}.{name}.strings"] = pack_strings(strings)
+                arrays[f"{table}.{name}.count"] = np.array(len(strings))
+            else:
+                arrays[f"{table}.{name}"] = column
+    file = directory / f"module_{module.id:04d}.{module.name}.npz"
+    np.savez(file, **arrays)
+    return file
+
+
+class ArrowWriter:
+    """
+    one IPC stream file per table, every module appends a record batch (dictionaries are replaced per batch)
+    """
+
+    def __init__(self, directory: Path):
+        import pyarrow
+
+        self.pa = pyarrow
+        self.directory = directory
+        self.writers = {}
+        self.sinks = {}
+
+    def _array(self, name: str, column):
+        pa = self.pa
+        if isinstance(column, tuple):
+            idx, strings = column
+            return pa.DictionaryArray.from_arrays(
+                pa.array(idx, mask=idx < 0, type=pa.int32()), pa.array(strings, type=pa.string())
+            )
+        if name in nullable_columns:
+            return pa.array(column, mask=column < 0)
+        return pa.array(column)
+
+    def write(self, module: ModuleStats):
+        pa = self.pa
+        for table, columns in module_columns(module).items():
+            batch = pa.RecordBatch.from_arrays([self._array(name, c) for name, c in columns.items()], names=list(columns))
+            if table not in self.writers:
+                self.sinks[table] = pa.OSFile(str(self.directory / f"{table}.arrow"), "wb")
+                self.writers[table] = pa.ipc.new_stream(self.sinks[table], batch.schema)
+            self.writers[table].write_batch(batch)
+
+    def close(self):
+        for table, writer in self.writers.items():
+            writer.close()
+            self.sinks[table].close()
+
+
+def export_modules(modules: Iterable[ModuleStats], format: str, output: Path) -> int:
+    """
+    `output` is a file for ndjson (`-` for stdout) and a directory for the other formats
+    """
+    count = 0
+    if format == "ndjson":
+        out = sys.stdout if str(output) == "-" else output.open("w")
+        try:
+            for module in modules:
+                write_ndjson(module, out)
+                count += 1
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        return count
+
+    output.mkdir(parents=True, exist_ok=True)
+    if format == "npz":
+        for module in modules:
+            write_npz(module, output)
+            count += 1
+        return count
+
+    writer = ArrowWriter(output)
+    try:
+        for module in modules:
+            writer.write(module)
+            count += 1
+    finally:
+        writer.close()
+    return count
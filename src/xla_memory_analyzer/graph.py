@@ -1,11 +1,15 @@
-from graphviz import Digraph
-from matplotlib import pyplot as plt
-from matplotlib.colors import to_hex
+import time
+from collections import defaultdict, deque
+from typing import Optional, TextIO
 
-from models import ModuleStats
+from .models import ModuleStats, Value
 
 
 def make_graph(module_stats: ModuleStats):
+    from graphviz import Digraph
+    from matplotlib import pyplot as plt
+    from matplotlib.colors import to_hex
+
     dot = Digraph('memory-graph', comment='Memory Graph')
     for val in module_stats.values.values():
         label = val.name + "\n" + val.pretty_size + "\n" + val.array_info
@@ -17,12 +21,7 @@ def make_graph(module_stats: ModuleStats):
 
         dot.node(str(val.id), label=label, fontsize="14" if val.is_large_array else "8", style="filled",
                  fillcolor=to_hex(color) + "33", )
-        for uses in val.value_detailed.uses:
-            if not uses:
-                continue
-            uses_name, operand_str = uses.split(",", maxsplit=1)
-            uses_name = uses_name.strip()
-            operand = operand_str.split()[-1]
+        for uses_name, operand in _uses(val):
             if uses_name in module_stats.value_name_to_id:
                 dot.edge(str(val.id), str(module_stats.value_name_to_id[uses_name]), headlabel=operand,
                          labeldistance="2")
@@ -31,3 +30,174 @@ def make_graph(module_stats: ModuleStats):
                 dot.edge(str(val.id), str(uses_name), headlabel=operand, labeldistance="2")
     # print(dot.source)
     dot.render(directory='.', format='svg')
+
+
+def _quote(s: str) -> str:
+    return '"' + s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+
+def rows_by_instruction(module: ModuleStats) -> dict[str, list[int]]:
+    """
+    the values an instruction defines, `fusion.3{1}` belongs to `fusion.3`
+    """
+    rows = defaultdict(list)
+    for row, name in enumerate(module.value_names):
+        rows[name.split("{")[0]].append(row)
+    return rows
+
+
+def _uses(value: Value) -> list[tuple[str, str]]:
+    """
+    (user, operand number) of every use of a value, from the HLO index if the dump contains the HLO module,
+    otherwise from the uses listed in the buffer-assignment
+    """
+    module = value.module
+    hlo_row = int(module.hlo_rows[value.row])
+    if hlo_row >= 0:
+        return [(module.hlo.names[user], str(operand)) for user, operand in module.hlo.users(hlo_row)]
+    if value.value_detailed is None:
+        return []
+    uses = []
+    for use in value.value_detailed.uses:
+        if not use:
+            continue
+        user, _, operand = use.partition(",")
+        uses.append((user.strip(), operand.split()[-1] if operand.strip() else ""))
+    return uses
+
+
+def _operands(value: Value) -> list[str]:
+    module = value.module
+    hlo_row = int(module.hlo_rows[value.row])
+    if hlo_row >= 0:
+        return [module.hlo.names[operand] for operand in module.hlo.operands(hlo_row).tolist() if operand >= 0]
+    if value.value_detailed is None:
+        return []
+    instruction = value.value_detailed.instruction
+    if instruction is None:
+        return []
+    return [operand.lstrip("%") for operand in instruction["operands"]]
+
+
+class NeighbourhoodGraph:
+    """
+    writes the values within `hops` use/operand edges of the seed values as DOT while they are discovered.
+    Values smaller than `min_size` are neither drawn nor followed, and the search stops once `max_nodes` are drawn
+    or `time_budget` seconds have passed.
+    """
+
+    def __init__(
+            self,
+            module: ModuleStats,
+            out: TextIO,
+            hops: int = 2,
+            min_size: int = 0,
+            max_nodes: int = 500,
+            time_budget: float = 5.0,
+    ):
+        self.module = module
+        self.out = out
+        self.hops = hops
+        self.min_size = min_size
+        self.max_nodes = max_nodes
+        self.time_budget = time_budget
+        self.instructions = rows_by_instruction(module)
+        self.nodes: set = set()
+        self.edges: set = set()
+        self.truncated = None
+
+    def _color(self, value: Value) -> str:
+        from matplotlib import colormaps
+        from matplotlib.colors import to_hex
+
+        if value.sequence is None or not self.module.largest_sequence_value:
+            return "#00800033"
+        return to_hex(colormaps["plasma"](value.sequence / self.module.largest_sequence_value)) + "33"
+
+    def _value_node(self, row: int, seed: bool) -> bool:
+        if row in self.nodes:
+            return True
+        if len(self.nodes) >= self.max_nodes:
+            self.truncated = f"node budget of {self.max_nodes}"
+            return False
+        value = Value(self.module, row)
+        self.nodes.add(row)
+        label = value.name + "\n" + value.pretty_size + "\n" + value.array_info
+        self.out.write(
+            f'  v{value.id} [label={_quote(label)}, fontsize="{14 if seed else 10}", style="filled", '
+            f'fillcolor="{self._color(value)}"{", penwidth=3" if seed else ""}];\n'
+        )
+        return True
+
+    def _instruction_node(self, name: str) -> bool:
+        if name in self.nodes:
+            return True
+        if len(self.nodes) >= self.max_nodes:
+            self.truncated = f"node budget of {self.max_nodes}"
+            return False
+        self.nodes.add(name)
+        self.out.write(f'  {_quote(name)} [fontsize="8", shape="box"];\n')
+        return True
+
+    def _edge(self, source: str, target: str, label: str = ""):
+        if (source, target) in self.edges:
+            return
+        self.edges.add((source, target))
+        attrs = f' [headlabel={_quote(label)}, labeldistance="2"]' if label else ""
+        self.out.write(f"  {source} -> {target}{attrs};\n")
+
+    def _large_enough(self, rows: list[int]) -> list[int]:
+        return [row for row in rows if self.module.value_sizes[row] >= self.min_size]
+
+    def write(self, seeds: list[int]):
+        deadline = time.perf_counter() + self.time_budget
+        self.out.write("digraph \"memory-graph\" {\n")
+        queue = deque()
+        for row in seeds:
+            if not self._value_node(row, seed=True):
+                break
+            queue.append((row, 0))
+        while queue and self.truncated is None:
+            if time.perf_counter() > deadline:
+                self.truncated = f"time budget of {self.time_budget}s"
+                break
+            row, depth = queue.popleft()
+            if depth >= self.hops:
+                continue
+            value = Value(self.module, row)
+            for user, operand in _uses(value):
+                users = self.instructions.get(user)
+                if users is None:
+                    if self._instruction_node(user):
+                        self._edge(f"v{value.id}", _quote(user), operand)
+                    continue
+                for user_row in self._large_enough(users):
+                    new = user_row not in self.nodes
+                    if not self._value_node(user_row, seed=False):
+                        break
+                    self._edge(f"v{value.id}", f"v{self.module.value_ids[user_row]}", operand)
+                    if new:
+                        queue.append((user_row, depth + 1))
+            for operand_name in _operands(value):
+                for operand_row in self._large_enough(self.instructions.get(operand_name, [])):
+                    new = operand_row not in self.nodes
+                    if not self._value_node(operand_row, seed=False):
+                        break
+                    self._edge(f"v{self.module.value_ids[operand_row]}", f"v{value.id}")
+                    if new:
+                        queue.append((operand_row, depth + 1))
+        if self.truncated is not None:
+            self.out.write(f"  // stopped early: {self.truncated}\n")
+        self.out.write("}\n")
+        self.out.flush()
+
+
+def peak_seeds(module: ModuleStats, peak: Optional[int], min_size: int, max_seeds: int) -> list[int]:
+    """
+    rows of the largest values live at `peak` (the main peak by default)
+    """
+    if peak is None:
+        peak = int(module.main_allocation_peak)
+    rows = module.live_index.at(peak)
+    rows = rows[module.value_sizes[rows] >= min_size]
+    return [int(row) for row in rows[(-module.value_sizes[rows]).argsort(kind="stable")][:max_seeds]]
@@ -0,0 +1,170 @@
+"""
+index of all instructions of the optimized HLO module (`*after_optimizations.txt`), read in one pass.
+Every instruction is parsed once and stored as columns: op, shape, computation, fused computation, metadata and
+its operands as row numbers, so that operands and users of an instruction are array lookups.
+"""
+from functools import cached_property
+from pathlib import Path
+
+import numpy as np
+
+from .decompress import open_dump_file
+from .models import StringTable
+from .parse_mlir import parse_mlir_line
+
+
+def _computation_name(header: str) -> str:
+    """
+    `ENTRY %main.5 (Arg_0.1: f32[8]) -> f32[8] {` or `fused_computation.1 {`
+    """
+    parts = header.split()
+    name = parts[1] if parts[0] == "ENTRY" and len(parts) > 1 else parts[0]
+    return name.partition("(")[0].lstrip("%")
+
+
+def _operand_name(operand: str) -> str:
+    """
+    operands are printed as `%name` or with their shape as `f32[8]{0} %name`
+    """
+    return operand.rpartition(" ")[2].lstrip("%")
+
+
+class HloIndex:
+    def __init__(self, file: Path):
+        self.file = file
+        self.names: list[str] = []
+        self.rows: dict[str, int] = {}
+        self.op_table = StringTable()
+        self.shape_table = StringTable()
+        self.computation_table = StringTable()
+        self.op_name_table = StringTable()
+        self.source_file_table = StringTable()
+        op_idx = []
+        shape_idx = []
+        computation_idx = []
+        calls_idx = []
+        op_name_idx = []
+        source_file_idx = []
+        source_line = []
+        operand_counts = []
+        operand_names = []
+        strings = {}
+        computation = -1
+        # bound once, the loop runs for every instruction of the module
+        add_op, add_shape = self.op_table.add, self.shape_table.add
+        add_op_name, add_source_file = self.op_name_table.add, self.source_file_table.add
+        with open_dump_file(file) as f:
+            for line in f:
+                if not line[:1].isspace():
+                    line = line.rstrip()
+                    if line.endswith(b"{"):
+                        computation = self.computation_table.add(_computation_name(line.decode()))
+                    elif line == b"}":
+                        computation = -1
+                    continue
+                line = line.strip().decode()
+                if line.startswith("ROOT "):
+                    line = line[5:]
+                if not line.startswith("%"):
+                    line = "%" + line
+                instruction = parse_mlir_line(line, strings)
+                if instruction is None:
+                    continue
+                name = instruction["var"][1:]
+                self.rows[name] = len(self.names)
+                self.names.append(name)
+                op_idx.append(add_op(instruction["op"]))
+                shape_idx.append(add_shape(instruction["dtype"]))
+                computation_idx.append(computation)
+                calls = instruction["attrs"].get("calls")
+                calls_idx.append(self.computation_table.add(calls.lstrip("%")) if calls else -1)
+                metadata = instruction["metadata"]
+                op_name_idx.append(add_op_name(metadata.get("op_name")))
+                if "source_file" in metadata and "source_line" in metadata:
+                    source_file_idx.append(add_source_file(metadata["source_file"]))
+                    source_line.append(metadata["source_line"])
+                else:
+                    source_file_idx.append(-1)
+                    source_line.append(-1)
+                operands = instruction["operands"]
+                operand_counts.append(len(operands))
+                operand_names += operands
+
+        self.op_idx = np.array(op_idx, dtype=np.int32)
+        self.shape_idx = np.array(shape_idx, dtype=np.int32)
+        self.computation_idx = np.array(computation_idx, dtype=np.int32)
+        self.calls_idx = np.array(calls_idx, dtype=np.int32)
+        self.op_name_idx = np.array(op_name_idx, dtype=np.int32)
+        self.source_file_idx = np.array(source_file_idx, dtype=np.int32)
+        self.source_line = np.array(source_line, dtype=np.int64)
+        # operands of row i are operand_rows[operand_ptr[i]:operand_ptr[i + 1]], -1 if they aren't defined
+        self.operand_ptr = np.zeros(len(self.names) + 1, dtype=np.int64)
+        np.cumsum(operand_counts, out=self.operand_ptr[1:])
+        self.operand_rows = np.array(
+            [self.rows.get(_operand_name(operand), -1) for operand in operand_names], dtype=np.int64
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    def row(self, name: str) -> int:
+        """
+        row of an instruction or of the instruction defining a value (`fusion.3{1}` is defined by `fusion.3`), -1
+        if it isn't in the module
+        """
+        return self.rows.get(name.split("{")[0], -1)
+
+    def operands(self, row: int) -> np.ndarray:
+        return self.operand_rows[self.operand_ptr[row]:self.operand_ptr[row + 1]]
+
+    @cached_property
+    def _users(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        operand edges sorted by operand, the reverse of the operand columns
+        """
+        counts = np.diff(self.operand_ptr)
+        users = np.repeat(np.arange(len(self.names), dtype=np.int64), counts)
+        operand_numbers = np.arange(len(self.operand_rows)) - np.repeat(self.operand_ptr[:-1], counts)
+        defined = self.operand_rows >= 0
+        operands = self.operand_rows[defined]
+        order = np.argsort(operands, kind="stable")
+        user_ptr = np.searchsorted(operands[order], np.arange(len(self.names) + 1))
+        return user_ptr, users[defined][order], operand_numbers[defined][order]
+
+    def users(self, row: int) -> list[tuple[int, int]]:
+        """
+        (user row, operand number) of every instruction that uses `row`
+        """
+        user_ptr, users, operand_numbers = self._users
+        start, end = user_ptr[row], user_ptr[row + 1]
+        return list(zip(users[start:end].tolist(), operand_numbers[start:end].tolist()))
+
+    def called_rows(self, row: int) -> np.ndarray:
+        """
+        instructions of the fused computation that `row` calls
+        """
+        calls = self.calls_idx[row]
+        if calls < 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.computation_idx == calls)
+
+    def instruction(self, row: int) -> dict:
+        """
+        the instruction in the format of `parse_mlir_line`, with only the `calls` attribute
+        """
+        metadata = {}
+        op_name = self.op_name_table.get(int(self.op_name_idx[row]))
+        if op_name is not None:
+            metadata["op_name"] = op_name
+        if self.source_file_idx[row] >= 0:
+            metadata["source_file"] = self.source_file_table.get(int(self.source_file_idx[row]))
+            metadata["source_line"] = int(self.source_line[row])
+        calls = self.computation_table.get(int(self.calls_idx[row]))
+        return {
+            'var': "%" + self.names[row],
+            'dtype': self.shape_table.get(int(self.shape_idx[row])),
+            'op': self.op_table.get(int(self.op_idx[row])),
+            'operands': ["%" + self.names[operand] for operand in self.operands(row).tolist() if operand >= 0],
+            'attrs': {"calls": "%" + calls} if calls is not None else {},
+            'metadata': metadata,
+        }
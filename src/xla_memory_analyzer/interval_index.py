@@ -0,0 +1,118 @@
+"""
+centered interval tree over the live ranges of a module.
+Every node stores the intervals containing its center twice, sorted by start and sorted by end, so the matching
+intervals of a node are always one contiguous slice found with `searchsorted`. Point and range queries therefore
+take O(log n + k) instead of scanning all values.
+"""
+import numpy as np
+
+
+class IntervalIndex:
+    """
+    closed intervals `[starts[i], ends[i]]` labelled with `rows[i]`
+    """
+
+    # nodes with at most this many intervals aren't split any further and are scanned instead
+    leaf_size = 32
+
+    def __init__(self, rows: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+        centers = []
+        leaves = []
+        lefts = []
+        rights = []
+        offsets = []
+        by_start = []
+        by_end = []
+        offset = 0
+
+        # nodes are numbered in the order they are created, children are filled in once they exist
+        stack = [(np.arange(len(rows)), -1, 0)] if len(rows) else []
+        while stack:
+            idx, parent, side = stack.pop()
+            node = len(centers)
+            if parent >= 0:
+                (lefts if side == 0 else rights)[parent] = node
+            if len(idx) <= self.leaf_size:
+                centers.append(0)
+                leaves.append(True)
+                lefts.append(-1)
+                rights.append(-1)
+                offsets.append(offset)
+                offset += len(idx)
+                by_start.append(idx)
+                by_end.append(idx)
+                continue
+            node_starts = starts[idx]
+            node_ends = ends[idx]
+            # the median start lies inside its own interval, so no node is empty and both halves shrink
+            center = np.partition(node_starts, len(idx) // 2)[len(idx) // 2]
+            left = node_ends < center
+            right = node_starts > center
+            here = idx[~(left | right)]
+
+            centers.append(center)
+            leaves.append(False)
+            lefts.append(-1)
+            rights.append(-1)
+            offsets.append(offset)
+            offset += len(here)
+            by_start.append(here[np.argsort(starts[here], kind="stable")])
+            by_end.append(here[np.argsort(ends[here], kind="stable")])
+            if left.any():
+                stack.append((idx[left], node, 0))
+            if right.any():
+                stack.append((idx[right], node, 1))
+        offsets.append(offset)
+
+        self.centers = np.asarray(centers, dtype=np.int64)
+        self.leaves = np.asarray(leaves, dtype=bool)
+        self.lefts = np.asarray(lefts, dtype=np.int64)
+        self.rights = np.asarray(rights, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        by_start = np.concatenate(by_start) if by_start else np.zeros(0, dtype=np.int64)
+        by_end = np.concatenate(by_end) if by_end else np.zeros(0, dtype=np.int64)
+        self.rows_by_start = rows[by_start]
+        self.starts_sorted = starts[by_start]
+        self.rows_by_end = rows[by_end]
+        self.ends_sorted = ends[by_end]
+
+    def __len__(self):
+        return len(self.rows_by_start)
+
+    def overlapping(self, start: int, end: int) -> np.ndarray:
+        """
+        rows of all intervals sharing at least one step with `[start, end]`, in ascending order
+        """
+        if start > end or len(self) == 0:
+            return np.zeros(0, dtype=np.int64)
+        found = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            center = self.centers[node]
+            lo = self.offsets[node]
+            hi = self.offsets[node + 1]
+            if self.leaves[node]:
+                mask = (self.starts_sorted[lo:hi] <= end) & (self.ends_sorted[lo:hi] >= start)
+                found.append(self.rows_by_start[lo:hi][mask])
+                continue
+            if end < center:
+                # every interval of this node ends at or after the center, only the start matters
+                cut = lo + np.searchsorted(self.starts_sorted[lo:hi], end, side="right")
+                found.append(self.rows_by_start[lo:cut])
+                children = [self.lefts[node]]
+            elif start > center:
+                cut = lo + np.searchsorted(self.ends_sorted[lo:hi], start, side="left")
+                found.append(self.rows_by_end[cut:hi])
+                children = [self.rights[node]]
+            else:
+                found.append(self.rows_by_start[lo:hi])
+                children = [self.lefts[node], self.rights[node]]
+            stack.extend(child for child in children if child >= 0)
+        return np.sort(np.concatenate(found))
+
+    def at(self, t: int) -> np.ndarray:
+        """
+        rows of all intervals containing `t`
+        """
+        return self.overlapping(t, t)
@@ -1,51 +1,33 @@
 from collections import defaultdict
-from pathlib import Path
+from typing import Optional
 
 from rich import box
 from rich.console import Console
 from rich.panel import Panel
-from rich.syntax import Syntax
 from rich.table import Table
 
 from .models import ModuleStats, Value
+from .sources import SourceResolver
 from .utils import pretty_byte_size
 
 
-def sourcefile_to_snippet(value: Value):
+def sourcefile_to_snippet(value: Value, sources: SourceResolver, console: Console):
     if value.value_detailed.source is None:
         return None
     source_file, source_line = value.value_detailed.source
-    file = Path(source_file)
-    if not file.exists():
-        if "DISCO-DJ" in source_file:
-            rel_path = Path(source_file.split("DISCO-DJ/")[-1])
-            if "__editable__" in str(source_file):
-                parts = rel_path.parts
-                start_index = parts.index("discodj")
-                rel_path = Path("src") / Path(*parts[start_index:])
-
-            disc_path_local = Path("/home/lukas/cosmoca/DISCO-DJ")
-            # disc_path_local = Path("/home/lukas/cosmoca/DISCO-DJ/vsc_scripts/")
-            file = disc_path_local / rel_path
-        else:
-            print(f"{file} not found")
-            return None
-    lines = file.open().readlines()
-    start_line = max(0, source_line - 3)
-    end_line = min(len(lines), source_line + 1)
-    code = "".join(lines[start_line:end_line])
-    syntax = Syntax(code, "python",
-                    dedent=True, line_numbers=True, indent_guides=True, word_wrap=True,
-                    start_line=start_line + 1, highlight_lines={source_line})
-    background_style = syntax._theme.get_background_style()
+    snippet = sources.snippet(source_file, source_line, console)
+    if snippet is None:
+        return None
     title = f"{value.pretty_size} | {value.name} | {value.array_info_without_order} "
-    panel = Panel(syntax, style=background_style, title=title,
+    panel = Panel(snippet, style=sources.background_style, title=title,
                   subtitle=value.value_detailed.short_source + " | " + value.value_detailed.op_name)
-    console = Console()
     console.print(panel)
 
 
-def print_memory_stats(values: list[Value]):
+def print_memory_stats(values: list[Value], sources: Optional[SourceResolver] = None):
+    console = Console()
+    if sources is None:
+        sources = SourceResolver()
     cumsize = 0
     table = Table(title="Memory Stats", box=box.MARKDOWN)
     table.add_column("Cumulative Size")
@@ -60,7 +42,7 @@ def print_memory_stats(values: list[Value]):
         if not v.is_large_array:
             continue
 
-        sourcefile_to_snippet(v)
+        sourcefile_to_snippet(v, sources, console)
         table.add_row(
             pretty_byte_size(cumsize),
             v.pretty_size,
@@ -71,7 +53,6 @@ def print_memory_stats(values: list[Value]):
             str(v.allocation.alloc_id)
         )
 
-    console = Console()
     console.print(table)
 
 
@@ -84,21 +65,59 @@ def print_stats(module_stats: ModuleStats):
     print_memory_stats(ordered_values[:3])
 
 
-def print_peak_stats(module_stats: ModuleStats, only_main_peak: bool = False):
+def print_peak_stats(
+        module_stats: ModuleStats,
+        only_main_peak: bool = False,
+        peaks=None,
+        sources: Optional[SourceResolver] = None,
+):
     console = Console()
-    peaks = [module_stats.main_allocation_peak] if only_main_peak else module_stats.allocation_peaks
+    if sources is None:
+        sources = SourceResolver()
+    if peaks is None:
+        peaks = [module_stats.main_allocation_peak] if only_main_peak else module_stats.allocation_peaks
     for peak in peaks:
-        time_map = module_stats.size_over_time[0]
-        values_at_peak = sorted(time_map[peak], key=lambda x: -x.size)
+        values_at_peak = sorted(module_stats.values_live_at(peak), key=lambda x: -x.size)
         total_at_peak = sum(v.size for v in values_at_peak)
         console.rule(f"peak at {peak} totalling {pretty_byte_size(total_at_peak)}")
-        print_memory_stats(values_at_peak)
+        print_memory_stats(values_at_peak, sources)
+
+
+def print_live_values(module_stats: ModuleStats, start: int, end: int, limit: int = 0):
+    """
+    table of the values live at any step between `start` and `end`, largest first
+    """
+    values = sorted(module_stats.values_live_between(start, end), key=lambda x: -x.size)
+    step = str(start) if start == end else f"{start}-{end}"
+    total = sum(v.size for v in values)
+    table = Table(title=f"{len(values)} values live at {step} totalling {pretty_byte_size(total)}", box=box.MARKDOWN)
+    table.add_column("Size")
+    table.add_column("Name", no_wrap=False)
+    table.add_column("Live range")
+    table.add_column("op_name", no_wrap=False)
+    table.add_column("array_info", no_wrap=False)
+    table.add_column("a", no_wrap=False)
+    for v in values[:limit or None]:
+        live_start, live_end = v.live_range
+        detail = v.value_detailed
+        table.add_row(
+            v.pretty_size,
+            v.name,
+            f"{live_start}-{live_end}",
+            detail.op_name if detail is not None else None,
+            v.array_info.split("{")[0],
+            str(v.allocation.alloc_id)
+        )
+    console = Console()
+    console.print(table)
 
 
 def memory_buffer_over_time(module_stats: ModuleStats):
     """
     show how the same memory buffer is reused within one module
     """
+    console = Console()
+    sources = SourceResolver()
     by_buffer = defaultdict(list)
     by_buffer_size = {}
     for val in module_stats.values.values():
@@ -118,11 +137,13 @@ def memory_buffer_over_time(module_stats: ModuleStats):
                   v.array_info_without_order[0])
             print(v.allocation.alloc_id, pretty_byte_size(v.size), pretty_byte_size(v.offset),
                   pretty_byte_size(v.allocation.total_size))
-            sourcefile_to_snippet(v)
+            sourcefile_to_snippet(v, sources, console)
         print("\n\n")
 
 
 def vals_by_line_of_code(module_stats: ModuleStats):
+    console = Console()
+    sources = SourceResolver()
     for val in module_stats.values.values():
         if val.value_detailed.source is None:
             continue
@@ -140,4 +161,4 @@ def vals_by_line_of_code(module_stats: ModuleStats):
                 print("alloc", v.allocation.alloc_id, pretty_byte_size(v.size), pretty_byte_size(v.offset),
                       pretty_byte_size(v.allocation.total_size))
 
-                sourcefile_to_snippet(v)
+                sourcefile_to_snippet(v, sources, console)
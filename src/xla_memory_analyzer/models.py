@@ -1,15 +1,21 @@
-from collections import defaultdict
+from collections.abc import Mapping
 from functools import cached_property
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 import numpy as np
-import scipy
-from matplotlib import pyplot as plt
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
+from . import profiling
+from .interval_index import IntervalIndex
+from .parse_mlir import parse_mlir_line
+from .profiling import module_label
+from .used_values import UsedValue, UsedValuesReader
 from .utils import pretty_byte_size
 
+if TYPE_CHECKING:
+    from .hlo_index import HloIndex
+
 large_array_threshold = 1024 ** 2  # 1MB
 
 
@@ -18,14 +24,84 @@ class Allocation(BaseModel):
     total_size: int
 
 
-class ValueDetailed(BaseModel):
-    id: int
-    name: str
-    at: int
-    uses: list[str] = []
-    positions: list[str] = []
-    instruction: Optional[dict] = None
-    opt_name: Optional[str] = None
+def pack_strings(strings: list[str]) -> np.ndarray:
+    """
+    encode a list of strings without newlines as one NUL separated byte array
+    """
+    return np.frombuffer("\0".join(strings).encode(), dtype=np.uint8)
+
+
+def unpack_strings(data: np.ndarray, count: int) -> list[str]:
+    if count == 0:
+        return []
+    return data.tobytes().decode().split("\0")
+
+
+class StringTable:
+    """
+    stores every distinct string once, columns refer to it by index (-1 for None)
+    """
+
+    def __init__(self, strings: Optional[list[str]] = None):
+        self.strings: list[str] = list(strings) if strings else []
+        self._index = {s: i for i, s in enumerate(self.strings)}
+
+    def add(self, s: Optional[str]) -> int:
+        if s is None:
+            return -1
+        try:
+            return self._index[s]
+        except KeyError:
+            self._index[s] = len(self.strings)
+            self.strings.append(s)
+            return len(self.strings) - 1
+
+    def get(self, i: int) -> Optional[str]:
+        if i < 0:
+            return None
+        return self.strings[i]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class ValueDetailed:
+    """
+    view on the "Used values" information of one value of a ModuleStats
+    """
+    __slots__ = ("module", "row")
+
+    def __init__(self, module: "ModuleStats", row: int):
+        self.module = module
+        self.row = row
+
+    @property
+    def id(self) -> int:
+        return int(self.module.value_ids[self.row])
+
+    @property
+    def name(self) -> str:
+        return self.module.value_names[self.row]
+
+    @property
+    def at(self) -> int:
+        return int(self.module.value_at[self.row])
+
+    @property
+    def uses(self) -> list[str]:
+        return self.module.used_value(self.row).uses
+
+    @property
+    def positions(self) -> list[str]:
+        return self.module.used_value(self.row).positions
+
+    @property
+    def instruction(self) -> Optional[dict]:
+        return self.module.instruction(self.row)
+
+    @property
+    def opt_name(self) -> Optional[str]:
+        return self.module.opt_names.get(self.id)
 
     @property
     def op_name(self):
@@ -52,17 +128,63 @@ class ValueDetailed(BaseModel):
         return f"{filename}:{source_line}"
 
 
-class Value(BaseModel):
-    id: int
-    name: str
-    at: int
-    size: int
-    offset: int
-    array_info: str
-    allocation: Allocation
-    value_detailed: Optional[ValueDetailed] = None
-    live_range: Optional[tuple[int, int]] = None
-    sequence: Optional[int] = None
+class Value:
+    """
+    view on one row of the value columns of a ModuleStats
+    """
+    __slots__ = ("module", "row")
+
+    def __init__(self, module: "ModuleStats", row: int):
+        self.module = module
+        self.row = row
+
+    @property
+    def id(self) -> int:
+        return int(self.module.value_ids[self.row])
+
+    @property
+    def name(self) -> str:
+        return self.module.value_names[self.row]
+
+    @property
+    def at(self) -> int:
+        return int(self.module.value_at[self.row])
+
+    @property
+    def size(self) -> int:
+        return int(self.module.value_sizes[self.row])
+
+    @property
+    def offset(self) -> int:
+        return int(self.module.value_offsets[self.row])
+
+    @property
+    def array_info(self) -> str:
+        return self.module.array_info_table.strings[self.module.array_info_idx[self.row]]
+
+    @property
+    def allocation(self) -> Allocation:
+        return self.module.allocations[int(self.module.value_alloc_ids[self.row])]
+
+    @property
+    def value_detailed(self) -> Optional[ValueDetailed]:
+        if not self.module.has_detail[self.row]:
+            return None
+        return ValueDetailed(self.module, self.row)
+
+    @property
+    def live_range(self) -> Optional[tuple[int, int]]:
+        start = self.module.live_start[self.row]
+        if start < 0:
+            return None
+        return int(start), int(self.module.live_end[self.row])
+
+    @property
+    def sequence(self) -> Optional[int]:
+        sequence = self.module.sequence[self.row]
+        if sequence < 0:
+            return None
+        return int(sequence)
 
     @property
     def is_large_array(self) -> bool:
@@ -77,70 +199,529 @@ class Value(BaseModel):
     def array_info_without_order(self):
         return self.array_info.split("{")[0]
 
+    def __repr__(self):
+        return f"Value({self.id}, {self.name!r}, {self.pretty_size})"
+
+
+class ValueMapping(Mapping):
+    """
+    read-only `value id -> Value` mapping over the value columns, creating views on access
+    """
+
+    def __init__(self, module: "ModuleStats"):
+        self.module = module
+
+    def __getitem__(self, value_id: int) -> Value:
+        return Value(self.module, self.module.row_of(value_id))
+
+    def __iter__(self):
+        return (int(i) for i in self.module.value_ids)
+
+    def __len__(self):
+        return len(self.module.value_ids)
+
+    def values(self):
+        return (Value(self.module, row) for row in range(len(self)))
+
 
 class ModuleStats(BaseModel):
+    """
+    all values of one module stored as columns, one row per value in the order of the buffer-assignment file.
+    Missing integers are stored as -1, strings are stored as indices into a StringTable.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     name: str
     id: int
-    value_name_to_id: dict[str, int] = {}
-    value_id_to_name: dict[int, str] = {}
-    values: dict[int, Value] = {}
-    used_values: dict[int, ValueDetailed] = {}
-    allocations: dict[int, Allocation] = {}
+    allocation_ids: np.ndarray
+    allocation_sizes: np.ndarray
+
+    value_ids: np.ndarray
+    value_at: np.ndarray
+    value_sizes: np.ndarray
+    value_offsets: np.ndarray
+    value_alloc_ids: np.ndarray
+    live_start: np.ndarray
+    live_end: np.ndarray
+    sequence: np.ndarray
+    value_names: list[str]
+    array_info_idx: np.ndarray
+    array_info_table: StringTable
+
+    buffer_assignment_file: Optional[Path] = None
+    # byte range of the block of each value in the "Used values" section, -1 if it has none
+    detail_start: np.ndarray
+    detail_end: np.ndarray
+    opt_names: dict[int, str] = {}
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """
+        flatten the module into plain NumPy arrays, which are cheap to send between processes or store on disk
+        """
+        opt_name_ids = np.array(list(self.opt_names.keys()), dtype=np.int64)
+        return {
+            "name": np.array(self.name),
+            "id": np.array(self.id),
+            "allocation_ids": self.allocation_ids,
+            "allocation_sizes": self.allocation_sizes,
+            "value_ids": self.value_ids,
+            "value_at": self.value_at,
+            "value_sizes": self.value_sizes,
+            "value_offsets": self.value_offsets,
+            "value_alloc_ids": self.value_alloc_ids,
+            "live_start": self.live_start,
+            "live_end": self.live_end,
+            "sequence": self.sequence,
+            "value_names": pack_strings(self.value_names),
+            "array_info_idx": self.array_info_idx,
+            "array_info_table": pack_strings(self.array_info_table.strings),
+            "array_info_count": np.array(len(self.array_info_table)),
+            "buffer_assignment_file": np.array(str(self.buffer_assignment_file or "")),
+            "detail_start": self.detail_start,
+            "detail_end": self.detail_end,
+            "opt_name_ids": opt_name_ids,
+            "opt_names": pack_strings(list(self.opt_names.values())),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]) -> "ModuleStats":
+        n = len(arrays["value_ids"])
+        opt_name_ids = arrays["opt_name_ids"]
+        buffer_assignment_file = str(arrays["buffer_assignment_file"])
+        return cls.model_construct(
+            name=str(arrays["name"]),
+            id=int(arrays["id"]),
+            allocation_ids=arrays["allocation_ids"],
+            allocation_sizes=arrays["allocation_sizes"],
+            value_ids=arrays["value_ids"],
+            value_at=arrays["value_at"],
+            value_sizes=arrays["value_sizes"],
+            value_offsets=arrays["value_offsets"],
+            value_alloc_ids=arrays["value_alloc_ids"],
+            live_start=arrays["live_start"],
+            live_end=arrays["live_end"],
+            sequence=arrays["sequence"],
+            value_names=unpack_strings(arrays["value_names"], n),
+            array_info_idx=arrays["array_info_idx"],
+            array_info_table=StringTable(unpack_strings(arrays["array_info_table"], int(arrays["array_info_count"]))),
+            buffer_assignment_file=Path(buffer_assignment_file) if buffer_assignment_file else None,
+            detail_start=arrays["detail_start"],
+            detail_end=arrays["detail_end"],
+            opt_names=dict(zip(opt_name_ids.tolist(), unpack_strings(arrays["opt_names"], len(opt_name_ids)))),
+        )
+
+    def select(self, rows: np.ndarray) -> "ModuleStats":
+        """
+        a module with only the values in `rows`, e.g. those matching a `--where` filter. The allocations stay the
+        same, the size over time and the peaks are the ones of the selected values.
+        """
+        ids = set(self.value_ids[rows].tolist()) if self.opt_names else ()
+        module = ModuleStats.model_construct(
+            name=self.name,
+            id=self.id,
+            allocation_ids=self.allocation_ids,
+            allocation_sizes=self.allocation_sizes,
+            value_ids=self.value_ids[rows],
+            value_at=self.value_at[rows],
+            value_sizes=self.value_sizes[rows],
+            value_offsets=self.value_offsets[rows],
+            value_alloc_ids=self.value_alloc_ids[rows],
+            live_start=self.live_start[rows],
+            live_end=self.live_end[rows],
+            sequence=self.sequence[rows],
+            value_names=[self.value_names[row] for row in rows.tolist()],
+            array_info_idx=self.array_info_idx[rows],
+            array_info_table=self.array_info_table,
+            buffer_assignment_file=self.buffer_assignment_file,
+            detail_start=self.detail_start[rows],
+            detail_end=self.detail_end[rows],
+            opt_names={value_id: name for value_id, name in self.opt_names.items() if value_id in ids},
+        )
+        # what was already read for all values isn't read again
+        for name in ("hlo", "_used_values_reader", "_interned_strings"):
+            if name in self.__dict__:
+                module.__dict__[name] = self.__dict__[name]
+        if "hlo_rows" in self.__dict__:
+            module.__dict__["hlo_rows"] = self.hlo_rows[rows]
+        if "_metadata_columns" in self.__dict__:
+            op_name_idx, op_name_table, source_file_idx, source_file_table, source_line = self._metadata_columns
+            module.__dict__["_metadata_columns"] = (
+                op_name_idx[rows], op_name_table, source_file_idx[rows], source_file_table, source_line[rows]
+            )
+        return module
+
+    @property
+    def has_detail(self) -> np.ndarray:
+        return self.detail_start >= 0
 
     @cached_property
-    def largest_sequence_value(self):
-        l = 0
-        for v in self.values.values():
-            if v.sequence is None:
+    def _used_values_reader(self) -> Optional[UsedValuesReader]:
+        if self.buffer_assignment_file is None:
+            return None
+        has_detail = self.has_detail
+        if not has_detail.any():
+            return UsedValuesReader(self.buffer_assignment_file)
+        window = int(self.detail_start[has_detail].min()), int(self.detail_end[has_detail].max())
+        return UsedValuesReader(self.buffer_assignment_file, window)
+
+    @cached_property
+    def _used_value_cache(self) -> dict[int, UsedValue]:
+        return {}
+
+    def used_value(self, row: int) -> UsedValue:
+        """
+        positions, uses and raw instruction of one value, parsed from its block on first access
+        """
+        try:
+            return self._used_value_cache[row]
+        except KeyError:
+            pass
+        start = self.detail_start[row]
+        if start < 0 or self._used_values_reader is None:
+            used_value = UsedValue([], [], None)
+        else:
+            used_value = self._used_values_reader.read(int(start), int(self.detail_end[row]))
+        self._used_value_cache[row] = used_value
+        return used_value
+
+    @cached_property
+    def _instruction_cache(self) -> dict[int, Optional[dict]]:
+        return {}
+
+    @cached_property
+    def _interned_strings(self) -> dict[str, str]:
+        # shared by all instructions of the module, so each op_name and source file is only stored once
+        return {}
+
+    def _parse_instruction(self, instruction_raw: Optional[str]) -> Optional[dict]:
+        if instruction_raw is None:
+            return None
+        return parse_mlir_line(instruction_raw, self._interned_strings)
+
+    @cached_property
+    def hlo(self) -> Optional["HloIndex"]:
+        """
+        index of the optimized HLO module next to the buffer-assignment file, None if the dump doesn't contain it
+        """
+        from .dump_files import hlo_path
+        from .hlo_index import HloIndex
+
+        if self.buffer_assignment_file is None:
+            return None
+        file = hlo_path(self.buffer_assignment_file)
+        if not file.exists():
+            return None
+        with profiling.phase("hlo index", self.label):
+            index = HloIndex(file)
+        profiling.count(self.label, "instructions indexed", len(index))
+        return index
+
+    @cached_property
+    def hlo_rows(self) -> np.ndarray:
+        """
+        row of the instruction defining each value in the HLO index, -1 if it isn't there
+        """
+        if self.hlo is None:
+            return np.full(len(self.value_ids), -1, dtype=np.int64)
+        return np.array([self.hlo.row(name) for name in self.value_names], dtype=np.int64)
+
+    def instruction(self, row: int) -> Optional[dict]:
+        try:
+            return self._instruction_cache[row]
+        except KeyError:
+            pass
+        hlo_row = int(self.hlo_rows[row])
+        if hlo_row >= 0:
+            instruction = self.hlo.instruction(hlo_row)
+        else:
+            instruction = self._parse_instruction(self.used_value(row).instruction_raw)
+        self._instruction_cache[row] = instruction
+        return instruction
+
+    @cached_property
+    def _metadata_columns(self):
+        """
+        op_name and source of every value, taken from the HLO index or, for values that aren't in it, by parsing the
+        instruction of their used value block
+        """
+        with profiling.phase("metadata", self.label):
+            return self._read_metadata_columns()
+
+    def _read_metadata_columns(self):
+        n = len(self.value_ids)
+        hlo_rows = self.hlo_rows
+        in_hlo = hlo_rows >= 0
+        if in_hlo.any():
+            hlo = self.hlo
+            # copies, values that aren't in the HLO module may add strings
+            op_name_table = StringTable(hlo.op_name_table.strings)
+            source_file_table = StringTable(hlo.source_file_table.strings)
+            op_name_idx = np.where(in_hlo, hlo.op_name_idx[hlo_rows], -1).astype(np.int32)
+            source_file_idx = np.where(in_hlo, hlo.source_file_idx[hlo_rows], -1).astype(np.int32)
+            source_line = np.where(in_hlo, hlo.source_line[hlo_rows], -1)
+        else:
+            op_name_table = StringTable()
+            source_file_table = StringTable()
+            op_name_idx = np.full(n, -1, dtype=np.int32)
+            source_file_idx = np.full(n, -1, dtype=np.int32)
+            source_line = np.full(n, -1, dtype=np.int64)
+        reader = self._used_values_reader
+        if reader is None:
+            return op_name_idx, op_name_table, source_file_idx, source_file_table, source_line
+        rows = np.flatnonzero(self.has_detail & ~in_hlo).tolist()
+        profiling.count(self.label, "instructions parsed", len(rows))
+        for row in rows:
+            if row in self._instruction_cache:
+                instruction = self._instruction_cache[row]
+            else:
+                instruction_raw = reader.read_instruction(int(self.detail_start[row]), int(self.detail_end[row]))
+                instruction = self._parse_instruction(instruction_raw)
+            if instruction is None:
                 continue
-            if v.sequence > l:
-                l = v.sequence
-        return l
+            metadata = instruction["metadata"]
+            op_name_idx[row] = op_name_table.add(metadata.get("op_name"))
+            if "source_file" in metadata and "source_line" in metadata:
+                source_file_idx[row] = source_file_table.add(metadata["source_file"])
+                source_line[row] = metadata["source_line"]
+        return op_name_idx, op_name_table, source_file_idx, source_file_table, source_line
+
+    @property
+    def op_name_idx(self) -> np.ndarray:
+        return self._metadata_columns[0]
+
+    @property
+    def op_name_table(self) -> StringTable:
+        return self._metadata_columns[1]
+
+    @property
+    def source_file_idx(self) -> np.ndarray:
+        return self._metadata_columns[2]
+
+    @property
+    def source_file_table(self) -> StringTable:
+        return self._metadata_columns[3]
+
+    @property
+    def source_line(self) -> np.ndarray:
+        return self._metadata_columns[4]
+
+    @cached_property
+    def _id_order(self):
+        return np.argsort(self.value_ids, kind="stable")
+
+    def row_of(self, value_id: int) -> int:
+        order = self._id_order
+        i = np.searchsorted(self.value_ids, value_id, sorter=order)
+        if i == len(order) or self.value_ids[order[i]] != value_id:
+            raise KeyError(value_id)
+        return int(order[i])
+
+    @property
+    def values(self) -> ValueMapping:
+        return ValueMapping(self)
+
+    @property
+    def used_values(self) -> dict[int, ValueDetailed]:
+        return {int(self.value_ids[row]): ValueDetailed(self, int(row)) for row in np.flatnonzero(self.has_detail)}
+
+    @cached_property
+    def allocations(self) -> dict[int, Allocation]:
+        return {
+            int(alloc_id): Allocation(alloc_id=int(alloc_id), total_size=int(size))
+            for alloc_id, size in zip(self.allocation_ids, self.allocation_sizes)
+        }
+
+    @cached_property
+    def value_name_to_id(self) -> dict[str, int]:
+        return {name: int(value_id) for name, value_id in zip(self.value_names, self.value_ids)}
+
+    @cached_property
+    def value_id_to_name(self) -> dict[int, str]:
+        return {int(value_id): name for name, value_id in zip(self.value_names, self.value_ids)}
+
+    @cached_property
+    def largest_sequence_value(self):
+        if self.sequence.size == 0:
+            return 0
+        return max(int(self.sequence.max()), 0)
+
+    @cached_property
+    def _live_ranges(self):
+        rows = np.flatnonzero(self.live_start >= 0)
+        return rows, self.live_start[rows], self.live_end[rows], self.value_sizes[rows]
 
     @cached_property
     def size_over_time(self):
-        time_map = defaultdict(list)
-        for v in self.values.values():
-            if v.live_range is None:
-                continue
-            for i in range(v.live_range[0], v.live_range[1] + 1):
-                time_map[i].append(v)
+        """
+        total size of all live values at every step between the first and last live range.
+        Each value adds its size at the start of its live range and removes it after the end,
+        so the curve is the cumulative sum of these events.
+        """
+        rows, starts, ends, sizes = self._live_ranges
+        if rows.size == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        with profiling.phase("time map", self.label):
+            first = starts.min()
+            last = ends.max()
+            events = np.zeros(last - first + 2, dtype=np.int64)
+            np.add.at(events, starts - first, sizes)
+            np.add.at(events, ends - first + 1, -sizes)
+            times = np.arange(first, last + 1)
+            return times, np.cumsum(events[:-1])
 
-        time_map = {key: time_map[key] for key in sorted(time_map.keys())}
-        times = []
-        sizes = []
-        for t, values in time_map.items():
-            times.append(t)
-            sizes.append(sum(v.size for v in values))
-        return time_map, times, sizes
+    @cached_property
+    def live_index(self) -> IntervalIndex:
+        rows, starts, ends, sizes = self._live_ranges
+        with profiling.phase("interval index", self.label):
+            return IntervalIndex(rows, starts, ends)
+
+    def values_live_at(self, t: int) -> list[Value]:
+        return [Value(self, int(row)) for row in self.live_index.at(t)]
+
+    def values_live_between(self, start: int, end: int) -> list[Value]:
+        """
+        values whose live range overlaps the steps `start` to `end` (inclusive)
+        """
+        return [Value(self, int(row)) for row in self.live_index.overlapping(start, end)]
 
     @cached_property
     def main_allocation_peak(self):
-        time_map, times, sizes = self.size_over_time
-        times = np.array(times)
+        times, sizes = self.size_over_time
         return times[np.argmax(sizes)]
 
-    @cached_property
-    def allocation_peaks(self):
-        time_map, times, sizes = self.size_over_time
-        times = np.array(times)
-        plt.plot(times, sizes)
-        peaks, props = scipy.signal.find_peaks(sizes, prominence=np.max(sizes) / 5)
-        for peak in peaks:
-            plt.scatter(times[peak], sizes[peak])
-        plt.show()
-        if peaks.size == 0:
-            peaks = [times[np.argmax(sizes)]]
+    def find_peaks(self, prominence: float = 0.2, width: Optional[float] = None) -> np.ndarray:
+        """
+        steps at which the size curve peaks. `prominence` is relative to the maximum size, `width` is in steps.
+        If nothing qualifies, the global maximum is the only peak.
+        """
+        times, sizes = self.size_over_time
+        if sizes.size == 0:
+            return times
+        with profiling.phase("find peaks", self.label):
+            # scipy.signal takes seconds to import, so only when peaks are actually needed
+            import scipy.signal
 
+            peaks, props = scipy.signal.find_peaks(sizes, prominence=np.max(sizes) * prominence, width=width)
+        if peaks.size == 0:
+            peaks = np.array([np.argmax(sizes)])
         return times[peaks]
 
+    @cached_property
+    def allocation_peaks(self):
+        return self.find_peaks()
+
     @property
     def total_allocation(self):
-        return sum(alloc.total_size for alloc in self.allocations.values())
+        return int(self.allocation_sizes.sum())
+
+    @property
+    def label(self) -> str:
+        return module_label(self.name, self.id)
+
+
+class ModuleStatsBuilder:
+    """
+    collects the parsed lines of one buffer-assignment file and turns them into a columnar ModuleStats
+    """
+
+    def __init__(self, name: str, id: int, buffer_assignment_file: Optional[Path] = None):
+        self.name = name
+        self.id = id
+        self.buffer_assignment_file = buffer_assignment_file
+        self.allocation_ids: list[int] = []
+        self.allocation_sizes: list[int] = []
+        self.value_ids: list[int] = []
+        self.value_at: list[int] = []
+        self.value_sizes: list[int] = []
+        self.value_offsets: list[int] = []
+        self.value_alloc_ids: list[int] = []
+        self.value_names: list[str] = []
+        self.array_info_idx: list[int] = []
+        self.array_info_table = StringTable()
+        self.value_name_to_row: dict[str, int] = {}
+        self.value_id_to_row: dict[int, int] = {}
+        self.live_ranges: dict[int, tuple[int, int]] = {}
+        self.sequence: dict[int, int] = {}
+        self.detail_rows: list[int] = []
+        self.detail_starts: list[int] = []
+        self.used_values_end = 0
+        self.opt_names: dict[int, str] = {}
+
+    def add_allocation(self, alloc_id: int, total_size: int):
+        self.allocation_ids.append(alloc_id)
+        self.allocation_sizes.append(total_size)
+
+    def add_value(self, id: int, name: str, at: int, size: int, offset: int, array_info: str):
+        if id in self.value_id_to_row:
+            raise ValueError("duplicate value id")
+        if name in self.value_name_to_row:
+            raise ValueError("duplicate value name")
+        row = len(self.value_ids)
+        self.value_id_to_row[id] = row
+        self.value_name_to_row[name] = row
+        self.value_ids.append(id)
+        self.value_at.append(at)
+        self.value_sizes.append(size)
+        self.value_offsets.append(offset)
+        self.value_alloc_ids.append(self.allocation_ids[-1])
+        self.value_names.append(name)
+        self.array_info_idx.append(self.array_info_table.add(array_info))
+
+    def add_used_value(self, id: int, offset: int, opt_name: Optional[str] = None) -> int:
+        """
+        only remember where the block of the used value starts, it is parsed when it is needed
+        """
+        row = self.value_id_to_row[id]
+        self.detail_rows.append(row)
+        self.detail_starts.append(offset)
+        if opt_name is not None:
+            self.opt_names[id] = opt_name
+        return row
+
+    def row_of_name(self, name: str) -> int:
+        return self.value_name_to_row[name]
+
+    def build(self) -> ModuleStats:
+        n = len(self.value_ids)
+        live_start = np.full(n, -1, dtype=np.int64)
+        live_end = np.full(n, -1, dtype=np.int64)
+        for row, (start, end) in self.live_ranges.items():
+            live_start[row] = start
+            live_end[row] = end
+        sequence = np.full(n, -1, dtype=np.int64)
+        for row, order in self.sequence.items():
+            sequence[row] = order
+        detail_start = np.full(n, -1, dtype=np.int64)
+        detail_end = np.full(n, -1, dtype=np.int64)
+        detail_start[self.detail_rows] = self.detail_starts
+        # each block ends where the next one starts
+        detail_end[self.detail_rows] = self.detail_starts[1:] + [self.used_values_end]
+
+        # the columns are built from already parsed data, so pydantic validation is skipped
+        return ModuleStats.model_construct(
+            name=self.name,
+            id=self.id,
+            allocation_ids=np.array(self.allocation_ids, dtype=np.int64),
+            allocation_sizes=np.array(self.allocation_sizes, dtype=np.int64),
+            value_ids=np.array(self.value_ids, dtype=np.int64),
+            value_at=np.array(self.value_at, dtype=np.int64),
+            value_sizes=np.array(self.value_sizes, dtype=np.int64),
+            value_offsets=np.array(self.value_offsets, dtype=np.int64),
+            value_alloc_ids=np.array(self.value_alloc_ids, dtype=np.int64),
+            live_start=live_start,
+            live_end=live_end,
+            sequence=sequence,
+            value_names=self.value_names,
+            array_info_idx=np.array(self.array_info_idx, dtype=np.int32),
+            array_info_table=self.array_info_table,
+            buffer_assignment_file=self.buffer_assignment_file,
+            detail_start=detail_start,
+            detail_end=detail_end,
+            opt_names=self.opt_names,
+        )
 
 
 class DumpDirectory(BaseModel):
     directory: Path
     modules: list[ModuleStats]
     total_size: int
-
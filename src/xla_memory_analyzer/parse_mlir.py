@@ -1,5 +1,6 @@
 import json
 import re
+from typing import Optional
 
 base_re = re.compile(r'''
     ^
@@ -16,9 +17,125 @@ base_re = re.compile(r'''
 ''', re.VERBOSE)
 
 meta_kv_re = re.compile(r'(\w+)=("([^"]*)"|(\d+))')
+# tuples with many elements are annotated with `/*index=5*/`, whose `=` would end the type of the instruction
+index_comment_re = re.compile(r'/\*index=\d+\*/')
 
 
-def parse_mlir_line(line):
+head_re = re.compile(r'(?P<var>%[^\s=]+)\s*=\s*(?P<dtype>\([^=]*?\)|\S+)\s+(?P<op>[\w.\-]+)\(')
+parens_re = re.compile(r'[()]')
+brackets_re = re.compile(r'[()\[\]{}"]')
+metadata_re = re.compile(r'metadata=\{(?P<content>[^}"]*+(?:"[^"]*"[^}"]*+)*)\}')
+# one attribute or operand, allowing one level of nested brackets
+top_level_item_re = re.compile(r'(?:[^,()\[\]{}"]++|"[^"]*"|\([^()"]*\)|\[[^\[\]"]*\]|\{[^{}"]*\})+')
+
+
+def _closing_paren(line: str, pos: int) -> int:
+    """
+    index of the parenthesis closing the one before `pos`
+    """
+    close = line.find(")", pos)
+    if close < 0 or line.find("(", pos, close) < 0:
+        return close
+    depth = 1
+    for m in parens_re.finditer(line, pos):
+        depth += 1 if m.group() == "(" else -1
+        if depth == 0:
+            return m.start()
+    return -1
+
+
+def _split_top_level(s: str) -> list[str]:
+    """
+    split on commas that are not nested in brackets or quotes
+    """
+    if not brackets_re.search(s):
+        return [part for part in map(str.strip, s.split(",")) if part]
+    parts = top_level_item_re.findall(s)
+    if ",".join(parts) == s:
+        return [part for part in map(str.strip, parts) if part]
+    # deeper nesting or unbalanced brackets
+    parts = []
+    start = 0
+    depth = 0
+    quoted = False
+    for i, c in enumerate(s):
+        if c == '"':
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif c in "([{":
+            depth += 1
+        elif c in ")]}":
+            depth -= 1
+        elif c == "," and depth == 0:
+            parts.append(s[start:i].strip())
+            start = i + 1
+    parts.append(s[start:].strip())
+    return [part for part in parts if part]
+
+
+def parse_mlir_line(line: str, strings: Optional[dict[str, str]] = None) -> Optional[dict]:
+    """
+    split one HLO instruction into variable, type, op, operands, attributes and metadata in a single pass.
+    The literal of a constant is skipped instead of being split into operands.
+    Repeated strings (op, op_name, source_file, ...) are deduplicated through `strings`, which can be shared
+    between all instructions of a module.
+    """
+    line = line.strip()
+    if "/*" in line:
+        line = index_comment_re.sub("", line)
+    m = head_re.match(line)
+    if not m:
+        return None
+    op = m["op"]
+    operands_start = m.end()
+
+    metadata_m = metadata_re.search(line, operands_start)
+    head_end = metadata_m.start() if metadata_m else len(line)
+    if op == "constant":
+        # the literal can be huge, skip it without looking at its content
+        operands_end = line.rfind(")", operands_start, head_end)
+        operands = []
+    else:
+        operands_end = _closing_paren(line, operands_start)
+        operands = _split_top_level(line[operands_start:operands_end])
+    if operands_end < 0:
+        return None
+
+    metadata = {}
+    rest = line[operands_end + 1:head_end]
+    if metadata_m:
+        for key, full, strval, numval in meta_kv_re.findall(metadata_m["content"]):
+            if numval:
+                metadata[key] = int(numval)
+            elif strings is not None:
+                metadata[key] = strings.setdefault(strval, strval)
+            else:
+                metadata[key] = strval
+        rest += line[metadata_m.end():]
+
+    attrs = {}
+    for kv in _split_top_level(rest):
+        k, sep, v = kv.partition("=")
+        if sep:
+            attrs[k.strip()] = v.strip()
+
+    if strings is not None:
+        op = strings.setdefault(op, op)
+    return {
+        'var': m["var"],
+        'dtype': m["dtype"],
+        'op': op,
+        'operands': operands,
+        'attrs': attrs,
+        'metadata': metadata,
+    }
+
+
+def parse_mlir_line_regex(line):
+    """
+    previous regex based implementation, only kept as reference for the benchmark below
+    """
     m = base_re.match(line.strip())
     if not m:
         return None
@@ -59,6 +176,8 @@ def parse_mlir_line(line):
 
 
 if __name__ == '__main__':
+    import timeit
+
     lines = """
     %constant_1513_0 = f32[8]{0} constant({0.0608953461, 0.0608953387, 0.060895294, 0.0608953536, 0.0608953238, 0.0608952641, 0.0608952641, 0.0608953238})
     %loop_dynamic_slice_fusion.3 = f32[1]{0} fusion(%constant_1513_0, %param.42), kind=kLoop, calls=%fused_dynamic_slice.3, metadata={op_name="jit(<unnamed wrapped function>)/jit(main)/dynamic_slice" source_file="/home/luwi100116/DISCO-DJ/src/discodj/nbody/steppers/dkd_leapfrog.py" source_line=37 deduplicated_name="loop_dynamic_slice_fusion.2"}
@@ -67,7 +186,18 @@ if __name__ == '__main__':
     %conditional = () conditional(%loop_compare_fusion, %tuple.109.0, %tuple.109.0), true_computation=%true_computation, false_computation=%region_5.368_spmd, metadata={op_name="jit(<unnamed wrapped function>)/jit(main)/cond/branch_1_fun/debug_callback" source_file="/home/luwi100116/DISCO-DJ/src/discodj/core/scatter_and_gather.py" source_line=1330}
     %conditional.1 = () conditional(%loop_convert_fusion.2, %tuple.120.0, %tuple.121.0), branch_computations={%region_5.368_spmd.clone, %region_6.371_spmd}, metadata={op_name="jit(<unnamed wrapped function>)/jit(main)/cond" source_file="/home/luwi100116/DISCO-DJ/src/discodj/core/scatter_and_gather.py" source_line=1328}
     %conditional.2 = (c64[3072,24,1537]{2,1,0}) conditional(%bitcast.18.0, %tuple.122.0, %tuple.123.0, %tuple.124.0), branch_computations={%region_15.613_spmd, %region_16.620_spmd, %region_17.627_spmd}, metadata={op_name="jit(<unnamed wrapped function>)/jit(main)/cond" source_file="/home/luwi100116/DISCO-DJ/src/discodj/nbody/acc.py" source_line=380}
-    """.strip()
+    """.strip().splitlines()
+    lines.append(
+        "%constant.big = f32[4096]{0} constant({" + ", ".join(f"{i / 4096:.10f}" for i in range(4096)) + "})"
+    )
+
+    strings = {}
+    for line in lines[:-1]:
+        print(json.dumps(parse_mlir_line(line, strings), ensure_ascii=False))
 
-    for line in lines.splitlines():
-        parse_mlir_line(line)
+    # micro-benchmark against the previous regex based implementation
+    number = 200
+    for name, func in [("regex", parse_mlir_line_regex), ("tokenizer", parse_mlir_line)]:
+        for label, sample in [("instructions", lines[:-1]), ("large constant", lines[-1:])]:
+            t = timeit.timeit(lambda: [func(line) for line in sample], number=number)
+            print(f"{name:>10} {label:>15}: {t / number / len(sample) * 1e6:8.1f} µs per line")
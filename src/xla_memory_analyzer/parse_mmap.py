@@ -0,0 +1,155 @@
+"""
+second parser engine for buffer-assignment files.
+The file is memory-mapped, the section boundaries are located once and every section is then scanned with a
+bytes-level regex over the whole section instead of decoding and matching it line by line.
+The result is identical to `xla_memory_analyzer.analyze_module`.
+"""
+import mmap
+import re
+from pathlib import Path
+
+from .dump_files import buffer_assignment_path, module_name_and_id
+from . import profiling
+from .models import ModuleStats, ModuleStatsBuilder
+from .profiling import module_label
+from .used_values import used_id_re
+
+section_markers = [b"Used values:", b"InstructionSequence", b"BufferLiveRange", b"Live ranges at"]
+
+alloc_line_re = re.compile(rb'^[ \t]*(?:allocation|value)', re.M)
+alloc_re = re.compile(
+    rb'^[ \t]*(?:'
+    rb'allocation[ \t]+(?P<alloc_id>\d+):[ \t]*size[ \t]+(?P<total_size>\d+),[^\n]*'
+    rb'|'
+    rb'value:[ \t]+<(?P<id>\d+)[ \t]+(?P<name>[^@>\n]+?)[ \t]*?(?:\(\w+\))? '
+    rb'@(?P<at>\d+)>[ \t]*\(size=(?P<size>\d+),offset=(?P<offset>\d+)\):[ \t]*(?P<array_info>[^\n]+?)'
+    rb')[ \t\r]*$',
+    re.M
+)
+
+sequence_re = re.compile(rb'^[ \t]*(?P<order>\d+)[ \t]*:(?P<name>[^\n:]*?)[ \t\r]*$', re.M)
+# the lines the regex engine looks for a used value header in
+used_line_re = re.compile(rb'^[ \t]*<', re.M)
+live_range_re = re.compile(rb'^[ \t]*(?P<val>[^\n:]*?):[ \t]*(?P<start>\d+)-(?P<end>\d+)[ \t\r]*$', re.M)
+
+
+def _sections(data) -> dict[bytes, tuple[int, int]]:
+    """
+    byte range of the content of every section, the allocations are everything before the first section header
+    """
+    sections = {}
+    name, start = b"alloc", 0
+    for marker in section_markers:
+        pos = data.find(marker, start)
+        while pos >= 0:
+            line_start = data.rfind(b"\n", 0, pos) + 1
+            if not data[line_start:pos].strip():
+                break
+            pos = data.find(marker, pos + 1)
+        if pos < 0:
+            continue
+        line_end = data.find(b"\n", pos)
+        sections[name] = (start, line_start)
+        name, start = marker, len(data) if line_end < 0 else line_end + 1
+    sections[name] = (start, len(data))
+    return sections
+
+
+def _parse_allocations(data, start: int, end: int, builder: ModuleStatsBuilder):
+    section = data[start:end]
+    num_matches = 0
+    for m in alloc_re.finditer(section):
+        num_matches += 1
+        if m["alloc_id"] is not None:
+            builder.add_allocation(int(m["alloc_id"]), int(m["total_size"]))
+        else:
+            builder.add_value(
+                id=int(m["id"]), name=m["name"].decode(), at=int(m["at"]),
+                size=int(m["size"]), offset=int(m["offset"]), array_info=m["array_info"].decode(),
+            )
+    if num_matches != len(alloc_line_re.findall(section)):
+        raise ValueError("malformed allocation header or value")
+
+
+def _parse_used_values(data, start: int, end: int, builder: ModuleStatsBuilder) -> int:
+    """
+    only the start of the block of every used value is recorded, the blocks are parsed on demand.
+    Returns the number of used value headers.
+    """
+    num_matches = 0
+    for m in used_id_re.finditer(data, start, end):
+        num_matches += 1
+        opt_name = m["opt_name"]
+        builder.add_used_value(int(m["id"]), m.start(), opt_name.decode() if opt_name is not None else None)
+    builder.used_values_end = end
+    return num_matches
+
+
+def _parse_sequence(data, start: int, end: int, builder: ModuleStatsBuilder) -> int:
+    """
+    returns the number of instructions without a value of their own
+    """
+    misses = 0
+    for m in sequence_re.finditer(data[start:end]):
+        try:
+            row = builder.row_of_name(m["name"].decode())
+        except KeyError:
+            misses += 1
+            continue
+        builder.sequence[row] = int(m["order"])
+    return misses
+
+
+def _parse_live_ranges(data, start: int, end: int, builder: ModuleStatsBuilder):
+    for m in live_range_re.finditer(data[start:end]):
+        val = m["val"].decode()
+        try:
+            row = builder.row_of_name(val.rstrip("{}"))
+        except KeyError:
+            row = builder.row_of_name(val)
+        builder.live_ranges[row] = (int(m["start"]), int(m["end"]))
+
+
+def analyze_module_mmap(memory_report_file: Path, hasher=None) -> ModuleStats:
+    """
+    `hasher` is fed the content of the buffer-assignment file after parsing, while its pages are still cached
+    """
+    module_name, module_id = module_name_and_id(memory_report_file)
+    buffer_assignment_file = buffer_assignment_path(memory_report_file)
+    builder = ModuleStatsBuilder(name=module_name, id=module_id, buffer_assignment_file=buffer_assignment_file)
+    with buffer_assignment_file.open("rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            data = b""
+        try:
+            sections = _sections(data)
+            _parse_allocations(data, *sections[b"alloc"], builder)
+            used_headers = sequence_misses = 0
+            if b"Used values:" in sections:
+                used_headers = _parse_used_values(data, *sections[b"Used values:"], builder)
+            if b"InstructionSequence" in sections:
+                sequence_misses = _parse_sequence(data, *sections[b"InstructionSequence"], builder)
+            if b"BufferLiveRange" in sections:
+                _parse_live_ranges(data, *sections[b"BufferLiveRange"], builder)
+            if profiling.active() is not None:
+                label = module_label(module_name, module_id)
+                section_start = 0
+                for section, (_, end) in sections.items():
+                    # from the end of the previous section, the header line counts like in the regex engine.
+                    # mmap has no count()
+                    profiling.count(label, f"lines {section.decode()}", data[section_start:end].count(b"\n"))
+                    section_start = end
+                used_lines = 0
+                if b"Used values:" in sections:
+                    used_lines = len(used_line_re.findall(data, *sections[b"Used values:"]))
+                profiling.count(label, "misses used value header", used_lines - used_headers)
+                profiling.count(label, "sequence entries without value", sequence_misses)
+            if hasher is not None:
+                hasher.update(data)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+    with profiling.phase("build"):
+        return builder.build()
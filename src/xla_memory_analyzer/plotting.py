@@ -0,0 +1,37 @@
+"""
+export of the size curve of a module as an image.
+Only the object-oriented Matplotlib API is used, so no GUI backend is loaded and nothing ever blocks.
+"""
+from pathlib import Path
+
+import numpy as np
+from matplotlib.figure import Figure
+
+from .models import ModuleStats
+from .utils import pretty_byte_size
+
+
+def plot_path(path: Path, module: ModuleStats, multiple_modules: bool) -> Path:
+    """
+    `out.png` becomes `out.<id>.<name>.png` if several modules are plotted
+    """
+    if not multiple_modules:
+        return path
+    return path.with_name(f"{path.stem}.{module.id}.{module.name}{path.suffix}")
+
+
+def plot_size_over_time(module: ModuleStats, peaks: np.ndarray, path: Path):
+    times, sizes = module.size_over_time
+    fig = Figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    ax.plot(times, sizes)
+    peak_sizes = sizes[np.searchsorted(times, peaks)] if times.size else sizes
+    ax.scatter(peaks, peak_sizes, color="C1", zorder=3)
+    for peak, size in zip(peaks, peak_sizes):
+        ax.annotate(pretty_byte_size(int(size)), (peak, size), textcoords="offset points", xytext=(0, 5),
+                    ha="center", fontsize="small")
+    ax.set_title(f"{module.id} {module.name} ({pretty_byte_size(module.total_allocation)})")
+    ax.set_xlabel("step")
+    ax.set_ylabel("live bytes")
+    fig.tight_layout()
+    fig.savefig(path)
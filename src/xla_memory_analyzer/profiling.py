@@ -0,0 +1,247 @@
+"""
+opt-in instrumentation of where the time of a command goes (`--profile`).
+Code marks its phases with `with phase("parse", module):` and counts things with `count(module, "lines", n)`.
+Both do nothing unless a Profiler was started, so they can stay in the hot paths.
+
+Phases nest, a phase inside another one is recorded as `outer/inner` and inherits its module. For every phase the
+wall and CPU time (of the whole process, including background threads), the peak RSS of the process at its end
+and, with tracemalloc, the peak of the memory allocated by Python during the phase are recorded.
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+
+class PhaseRecord(NamedTuple):
+    phase: str
+    module: Optional[str]
+    wall: float
+    cpu: float
+    # ru_maxrss at the end of the phase and how much the phase raised it, in bytes
+    max_rss: int
+    rss_growth: int
+    # peak of the memory traced by tracemalloc during the phase, None without tracemalloc
+    traced_peak: Optional[int]
+    pid: int
+
+
+def module_label(name: str, module_id: int) -> str:
+    return f"{module_id} {name}"
+
+
+def _max_rss() -> int:
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows, the RSS columns are 0 there
+        return 0
+    # kilobytes on Linux, bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class Profiler:
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.records: list[PhaseRecord] = []
+        self.counters: dict[Optional[str], dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        # (name, module, highest traced peak so far) of the open phases
+        self._stack: list[list] = []
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str, module: Optional[str] = None):
+        if self._stack:
+            outer_name, outer_module, _ = self._stack[-1]
+            name = f"{outer_name}/{name}"
+            module = module if module is not None else outer_module
+        if self.trace_memory:
+            if self._stack:
+                self._stack[-1][2] = max(self._stack[-1][2], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        frame = [name, module, 0]
+        self._stack.append(frame)
+        rss_before = _max_rss()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            max_rss = _max_rss()
+            self._stack.pop()
+            traced_peak = None
+            if self.trace_memory:
+                traced_peak = max(frame[2], tracemalloc.get_traced_memory()[1])
+                if self._stack:
+                    self._stack[-1][2] = max(self._stack[-1][2], traced_peak)
+                tracemalloc.reset_peak()
+            self.records.append(
+                PhaseRecord(name, module, wall, cpu, max_rss, max_rss - rss_before, traced_peak, os.getpid())
+            )
+
+    def count(self, module: Optional[str], counter: str, n: int = 1):
+        self.counters[module][counter] += n
+
+    def merge(self, records: list[PhaseRecord], counters: dict):
+        """
+        add what a worker process recorded
+        """
+        self.records.extend(PhaseRecord(*record) for record in records)
+        for module, module_counters in counters.items():
+            for counter, n in module_counters.items():
+                self.counters[module][counter] += n
+
+    def export(self) -> tuple[list[tuple], dict]:
+        """
+        records and counters as plain tuples and dicts, e.g. to send them from a worker process
+        """
+        return [tuple(record) for record in self.records], {m: dict(c) for m, c in self.counters.items()}
+
+    def phase_totals(self) -> dict[str, dict]:
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record.phase, {
+                "calls": 0, "wall": 0.0, "cpu": 0.0, "max_rss": 0, "rss_growth": 0, "traced_peak": None,
+            })
+            total["calls"] += 1
+            total["wall"] += record.wall
+            total["cpu"] += record.cpu
+            total["max_rss"] = max(total["max_rss"], record.max_rss)
+            total["rss_growth"] += record.rss_growth
+            if record.traced_peak is not None:
+                total["traced_peak"] = max(total["traced_peak"] or 0, record.traced_peak)
+        return totals
+
+    def module_totals(self) -> dict[str, dict]:
+        """
+        time of the outermost phases of every module and the slowest of its phases
+        """
+        totals = {}
+        for record in self.records:
+            if record.module is None:
+                continue
+            total = totals.setdefault(record.module, {"wall": 0.0, "cpu": 0.0, "slowest": None})
+            if "/" not in record.phase:
+                total["wall"] += record.wall
+                total["cpu"] += record.cpu
+            if total["slowest"] is None or record.wall > total["slowest"][1]:
+                total["slowest"] = (record.phase, record.wall)
+        return totals
+
+    def unaccounted_wall(self) -> float:
+        """
+        time of this process that no top-level phase accounts for
+        """
+        pid = os.getpid()
+        accounted = sum(r.wall for r in self.records if "/" not in r.phase and r.pid == pid)
+        return time.perf_counter() - self.started - accounted
+
+    def to_json(self) -> dict:
+        return {
+            "wall": time.perf_counter() - self.started,
+            "unaccounted_wall": self.unaccounted_wall(),
+            "phases": self.phase_totals(),
+            "modules": {
+                module: {**total, **self.counters.get(module, {})} for module, total in self.module_totals().items()
+            },
+            "counters": {str(module): dict(c) for module, c in self.counters.items()},
+            "records": [record._asdict() for record in self.records],
+        }
+
+    def write_json(self, file: Path):
+        with file.open("w") as f:
+            json.dump(self.to_json(), f, indent=2)
+
+    def print_summary(self):
+        from rich import box
+        from rich.console import Console
+        from rich.table import Table
+
+        from .utils import pretty_byte_size
+
+        # stderr, so that the summary doesn't end up in exported data
+        console = Console(stderr=True)
+        table = Table(title=f"profile, {time.perf_counter() - self.started:.2f}s in total", box=box.MARKDOWN)
+        table.add_column("Phase", no_wrap=False)
+        table.add_column("Calls", justify="right")
+        table.add_column("Wall", justify="right")
+        table.add_column("CPU", justify="right")
+        table.add_column("Max RSS", justify="right")
+        table.add_column("RSS growth", justify="right")
+        if self.trace_memory:
+            table.add_column("Traced peak", justify="right")
+        for name, total in sorted(self.phase_totals().items()):
+            row = [
+                name, str(total["calls"]), f"{total['wall']:.3f}s", f"{total['cpu']:.3f}s",
+                pretty_byte_size(total["max_rss"]), pretty_byte_size(total["rss_growth"]),
+            ]
+            if self.trace_memory:
+                # worker processes don't trace their allocations
+                row.append(pretty_byte_size(total["traced_peak"]) if total["traced_peak"] is not None else "")
+            table.add_row(*row)
+        # imports, command line parsing and anything else that isn't marked as a phase
+        table.add_row("(outside of phases)", "", f"{self.unaccounted_wall():.3f}s", "", "", "",
+                      *([""] if self.trace_memory else []), style="dim")
+        console.print(table)
+
+        modules = self.module_totals()
+        if not modules:
+            return
+        table = Table(title="per module", box=box.MARKDOWN)
+        table.add_column("Module", no_wrap=False)
+        table.add_column("Values", justify="right")
+        table.add_column("Lines", justify="right")
+        table.add_column("Misses", justify="right")
+        table.add_column("Wall", justify="right")
+        table.add_column("CPU", justify="right")
+        table.add_column("Slowest phase")
+        for module, total in sorted(modules.items(), key=lambda m: -m[1]["wall"]):
+            counters = self.counters.get(module, {})
+            lines = sum(n for counter, n in counters.items() if counter.startswith("lines "))
+            misses = sum(n for counter, n in counters.items() if counter.startswith("misses "))
+            slowest, slowest_wall = total["slowest"]
+            table.add_row(
+                module, str(counters.get("values", "")), str(lines or ""), str(misses),
+                f"{total['wall']:.3f}s", f"{total['cpu']:.3f}s", f"{slowest} ({slowest_wall:.3f}s)",
+            )
+        console.print(table)
+
+
+_active: Optional[Profiler] = None
+
+
+def active() -> Optional[Profiler]:
+    return _active
+
+
+def start(trace_memory: bool = False) -> Profiler:
+    global _active
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _active = Profiler(trace_memory)
+    return _active
+
+
+def stop() -> Optional[Profiler]:
+    global _active
+    profiler, _active = _active, None
+    return profiler
+
+
+def phase(name: str, module: Optional[str] = None):
+    if _active is None:
+        return nullcontext()
+    return _active.phase(name, module)
+
+
+def count(module: Optional[str], counter: str, n: int = 1):
+    if _active is not None:
+        _active.count(module, counter, n)
@@ -0,0 +1,291 @@
+"""
+`serve` keeps the parsed modules of one dump directory in memory and runs commands on them.
+Commands on a served directory are sent to the server automatically: the client posts its original command line,
+the server runs it with the modules it has in memory and sends back stdout, stderr and the exit code.
+Before every request the server re-parses the modules whose buffer-assignment file changed (size or mtime).
+
+The server listens on localhost only. Its port and a random token are written to a state file in the cache
+directory that only the user can read, requests without the token are rejected.
+"""
+import contextlib
+import hashlib
+import io
+import json
+import os
+import secrets
+import sys
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import Optional
+
+from .cache import ParseCache, default_cache_dir
+
+TOKEN_HEADER = "X-Token"
+
+
+def state_file(directory: Path, cache_dir: Optional[Path] = None) -> Path:
+    key = hashlib.blake2b(str(directory.resolve()).encode(), digest_size=16).hexdigest()
+    return (cache_dir if cache_dir is not None else default_cache_dir()) / "servers" / f"{key}.json"
+
+
+def _signature(file: Path) -> Optional[tuple[int, int]]:
+    try:
+        stat = file.stat()
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ResidentCache:
+    """
+    parsed modules kept in memory by buffer-assignment file, valid while its size and mtime are unchanged.
+    Used in place of the ParseCache, which is still consulted for modules that aren't in memory.
+    """
+
+    def __init__(self, cache: Optional[ParseCache] = None):
+        self.cache = cache
+        self.modules: dict[Path, tuple[tuple[int, int], object]] = {}
+
+    def __getstate__(self):
+        # worker processes only need the parse cache, not the modules in memory
+        return {"cache": self.cache, "modules": {}}
+
+    def is_current(self, file: Path) -> bool:
+        entry = self.modules.get(file.resolve())
+        return entry is not None and entry[0] == _signature(file)
+
+    def put(self, file: Path, module, stat: Optional[os.stat_result] = None):
+        signature = _signature(file) if stat is None else (stat.st_size, stat.st_mtime_ns)
+        if signature is not None:
+            self.modules[file.resolve()] = signature, module
+
+    def load(self, file: Path):
+        entry = self.modules.get(file.resolve())
+        if entry is not None and entry[0] == _signature(file):
+            return entry[1]
+        module = self.cache.load(file) if self.cache is not None else None
+        if module is not None:
+            self.put(file, module)
+        return module
+
+    def is_cached(self, file: Path) -> bool:
+        return self.is_current(file) or (self.cache is not None and self.cache.is_cached(file))
+
+    def store(self, file: Path, module, stat: os.stat_result, content_hash: str):
+        if self.cache is not None:
+            self.cache.store(file, module, stat, content_hash)
+        self.put(file, module, stat)
+
+
+class DumpServer:
+    def __init__(self, directory: Path, resident: ResidentCache, jobs: int = 1, parser: str = "regex"):
+        self.directory = directory
+        self.resident = resident
+        self.jobs = jobs
+        self.parser = parser
+        self.token = secrets.token_hex(16)
+
+    def refresh(self) -> int:
+        """
+        parse new and changed modules, forget removed ones, returns the number of parsed modules
+        """
+        from .dump_files import buffer_assignment_path, memory_report_files
+        from .xla_memory_analyzer import iter_modules
+
+        files = memory_report_files(self.directory)
+        current = {buffer_assignment_path(file).resolve() for file in files}
+        for file in list(self.resident.modules):
+            if file not in current:
+                del self.resident.modules[file]
+        changed = [file for file in files if not self.resident.is_current(buffer_assignment_path(file))]
+        for file, module in zip(changed, iter_modules(changed, self.jobs, self.resident.cache, self.parser)):
+            self.resident.put(buffer_assignment_path(file), module)
+        return len(changed)
+
+    def modules(self) -> list[dict]:
+        from .dump_files import summarize
+
+        return [summarize(module)._asdict() for _, module in self.resident.modules.values()]
+
+    def run(self, argv: list[str], cwd: str, columns: int, color: bool) -> dict:
+        """
+        run a command line like the CLI would, but with the modules in memory
+        """
+        import click
+
+        from .cli import cli
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        environ = {"COLUMNS": str(columns)}
+        if color:
+            environ["FORCE_COLOR"] = "1"
+        saved_environ = {key: os.environ.get(key) for key in environ}
+        saved_cwd = os.getcwd()
+        exit_code = 0
+        try:
+            os.environ.update(environ)
+            os.chdir(cwd)
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                try:
+                    result = cli.main(args=argv, prog_name="xla_memory_analyzer", standalone_mode=False,
+                                      obj={"resident": self.resident})
+                    # click returns the exit code of ctx.exit() when not in standalone mode
+                    exit_code = result if isinstance(result, int) else 0
+                except click.ClickException as e:
+                    e.show()
+                    exit_code = e.exit_code
+                except click.Abort:
+                    print("Aborted!", file=sys.stderr)
+                    exit_code = 1
+                except SystemExit as e:
+                    exit_code = e.code if isinstance(e.code, int) else int(e.code is not None)
+                except Exception:
+                    traceback.print_exc()
+                    exit_code = 1
+        finally:
+            os.chdir(saved_cwd)
+            for key, value in saved_environ.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+        return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "exit_code": exit_code}
+
+
+def _handler(server: DumpServer):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _authorized(self) -> bool:
+            if secrets.compare_digest(self.headers.get(TOKEN_HEADER, ""), server.token):
+                return True
+            self._reply(403, {"error": "invalid token"})
+            return False
+
+        def do_GET(self):
+            if not self._authorized():
+                return
+            if self.path == "/modules":
+                server.refresh()
+                self._reply(200, {"directory": str(server.directory), "modules": server.modules()})
+            else:
+                self._reply(404, {"error": f"unknown path {self.path}"})
+
+        def do_POST(self):
+            if not self._authorized():
+                return
+            if self.path != "/run":
+                self._reply(404, {"error": f"unknown path {self.path}"})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            start = time.perf_counter()
+            parsed = server.refresh()
+            response = server.run(request["argv"], request["cwd"], request.get("columns", 80),
+                                  request.get("color", False))
+            print(f"{' '.join(request['argv'])}: exit code {response['exit_code']}, "
+                  f"{parsed} modules parsed, {time.perf_counter() - start:.2f}s", file=sys.stderr)
+            self._reply(200, response)
+
+        def log_message(self, format, *args):
+            # every request is logged once after it ran
+            pass
+
+    return Handler
+
+
+def serve(
+        directory: Path,
+        port: int = 0,
+        jobs: int = 1,
+        cache: Optional[ParseCache] = None,
+        parser: str = "regex",
+        cache_dir: Optional[Path] = None,
+):
+    """
+    runs until interrupted
+    """
+    server = DumpServer(directory, ResidentCache(cache), jobs, parser)
+    start = time.perf_counter()
+    server.refresh()
+    httpd = HTTPServer(("127.0.0.1", port), _handler(server))
+    state = state_file(directory, cache_dir)
+    state.parent.mkdir(parents=True, exist_ok=True)
+    # the token must only be readable by the user
+    fd = os.open(state, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"pid": os.getpid(), "port": httpd.server_port, "token": server.token,
+                   "directory": str(directory.resolve())}, f)
+    print(f"serving {len(server.resident.modules)} modules of {directory} on http://127.0.0.1:{httpd.server_port} "
+          f"(loaded in {time.perf_counter() - start:.1f}s)", file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        try:
+            with state.open() as f:
+                ours = json.load(f)["pid"] == os.getpid()
+        except (OSError, ValueError, KeyError):
+            ours = False
+        if ours:
+            state.unlink()
+
+
+class ServerClient:
+    def __init__(self, port: int, token: str):
+        self.port = port
+        self.token = token
+
+    def run(self, argv: list[str]) -> Optional[dict]:
+        """
+        None if the server can't be reached
+        """
+        import http.client
+        import shutil
+
+        body = json.dumps({
+            "argv": argv,
+            "cwd": os.getcwd(),
+            "columns": shutil.get_terminal_size().columns,
+            "color": sys.stdout.isatty() and "NO_COLOR" not in os.environ,
+        })
+        connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        try:
+            connection.request("POST", "/run", body, {"Content-Type": "application/json", TOKEN_HEADER: self.token})
+            response = connection.getresponse()
+            if response.status != 200:
+                return None
+            return json.loads(response.read())
+        except OSError:
+            return None
+        finally:
+            connection.close()
+
+
+def find_server(directory: Path, cache_dir: Optional[Path] = None) -> Optional[ServerClient]:
+    """
+    the server for `directory` if one is running, stale state files are removed
+    """
+    state = state_file(directory, cache_dir)
+    try:
+        with state.open() as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    try:
+        os.kill(info["pid"], 0)
+    except ProcessLookupError:
+        state.unlink(missing_ok=True)
+        return None
+    except (PermissionError, KeyError):
+        return None
+    return ServerClient(info["port"], info["token"])
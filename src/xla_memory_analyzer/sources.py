@@ -0,0 +1,131 @@
+"""
+finds the source files referenced in the metadata of instructions and renders snippets of them.
+Dumps are often created on another machine, so path prefixes can be remapped to a local checkout.
+"""
+import ast
+from functools import cached_property, lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    # rich.syntax pulls in pygments, it is only imported once a snippet is rendered
+    from rich.console import Console
+    from rich.segment import Segments
+
+
+def parse_path_map(rules: list[str]) -> list[tuple[str, str]]:
+    """
+    `FROM=TO` strings as given on the command line
+    """
+    path_map = []
+    for rule in rules:
+        prefix, sep, replacement = rule.partition("=")
+        if not sep or not prefix:
+            raise ValueError(f"path mapping must look like FROM=TO: {rule}")
+        path_map.append((prefix, replacement))
+    return path_map
+
+
+class SourceResolver:
+    """
+    Files are looked up as given first, then with every matching prefix rule in order.
+    Lines of the most recently used files are kept in memory and every (file, line) snippet is only rendered once.
+    """
+
+    def __init__(self, path_map: Optional[list[tuple[str, str]]] = None, max_files: int = 64, context: int = 3):
+        self.path_map = path_map or []
+        self.context = context
+        self.resolve = lru_cache(maxsize=None)(self._resolve)
+        self.lines = lru_cache(maxsize=max_files)(self._lines)
+        self.definitions = lru_cache(maxsize=max_files)(self._definitions)
+        self._snippets: dict[tuple[str, int, int], Optional["Segments"]] = {}
+        self._reported_missing: set[str] = set()
+
+    @cached_property
+    def background_style(self):
+        from rich.syntax import DEFAULT_THEME, Syntax
+
+        return Syntax.get_theme(DEFAULT_THEME).get_background_style()
+
+    def _resolve(self, source_file: str) -> Optional[Path]:
+        file = Path(source_file)
+        if file.is_file():
+            return file
+        for prefix, replacement in self.path_map:
+            if source_file.startswith(prefix):
+                file = Path(replacement + source_file[len(prefix):])
+                if file.is_file():
+                    return file
+        return None
+
+    def _lines(self, file: Path) -> list[str]:
+        with file.open() as f:
+            return f.readlines()
+
+    def _definitions(self, file: Path) -> list[tuple[int, int, str]]:
+        """
+        line range and qualified name of every function and class, outer ones first
+        """
+        try:
+            tree = ast.parse("".join(self.lines(file)))
+        except (SyntaxError, ValueError):
+            return []
+        definitions = []
+        stack = [(tree, "")]
+        while stack:
+            node, prefix = stack.pop()
+            for child in ast.iter_child_nodes(node):
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                    name = prefix + child.name
+                    definitions.append((child.lineno, child.end_lineno, name))
+                    stack.append((child, name + "."))
+                else:
+                    stack.append((child, prefix))
+        return sorted(definitions)
+
+    def enclosing_function(self, source_file: str, source_line: int) -> Optional[str]:
+        """
+        qualified name of the innermost function or class containing the line, None at module level
+        """
+        file = self.resolve(source_file)
+        if file is None:
+            return None
+        name = None
+        for start, end, qualname in self.definitions(file):
+            if start > source_line:
+                break
+            if source_line <= end:
+                name = qualname
+        return name
+
+    def snippet(self, source_file: str, source_line: int, console: "Console") -> Optional["Segments"]:
+        """
+        highlighted lines around `source_line`, rendered for the width of a panel on `console`
+        """
+        from rich.segment import Segment, Segments
+        from rich.syntax import Syntax
+
+        width = console.width - 4  # panel border and padding
+        key = source_file, source_line, width
+        if key in self._snippets:
+            return self._snippets[key]
+        file = self.resolve(source_file)
+        if file is None:
+            if source_file not in self._reported_missing:
+                self._reported_missing.add(source_file)
+                print(f"{source_file} not found")
+            self._snippets[key] = None
+            return None
+        lines = self.lines(file)
+        start_line = max(0, source_line - self.context)
+        end_line = min(len(lines), source_line + 1)
+        syntax = Syntax("".join(lines[start_line:end_line]), "python",
+                        dedent=True, line_numbers=True, indent_guides=True, word_wrap=True,
+                        start_line=start_line + 1, highlight_lines={source_line})
+        rendered = console.render_lines(syntax, console.options.update_width(width), pad=False)
+        segments = []
+        for line in rendered:
+            segments.extend(line)
+            segments.append(Segment.line())
+        self._snippets[key] = Segments(segments[:-1])
+        return self._snippets[key]
@@ -0,0 +1,63 @@
+"""
+range maximum on dense time axes with sparse tables: level k holds the maximum of the 2**k steps starting at each
+index, so every range is covered by two (possibly overlapping) blocks of the same level.
+"""
+import numpy as np
+
+
+def _levels(start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """
+    largest k with 2**k <= end - start + 1
+    """
+    return np.floor(np.log2(end - start + 1)).astype(np.int64)
+
+
+def range_chmax(length: int, starts: np.ndarray, ends: np.ndarray, values: np.ndarray, fill: int = 0) -> np.ndarray:
+    """
+    array of `length` steps where every step holds the maximum of all `values[i]` whose inclusive range
+    `starts[i]` to `ends[i]` covers it (`fill` for steps no range covers).
+    Every range is written into the two blocks covering it and the levels are then pushed down to single steps,
+    O(length log length + n) instead of painting every range.
+    """
+    if len(starts) == 0:
+        return np.full(length, fill, dtype=np.int64)
+    levels = _levels(starts, ends)
+    num_levels = int(levels.max()) + 1
+    table = np.full((num_levels, length), fill, dtype=np.int64)
+    np.maximum.at(table, (levels, starts), values)
+    np.maximum.at(table, (levels, ends - (1 << levels) + 1), values)
+    for k in range(num_levels - 1, 0, -1):
+        half = 1 << (k - 1)
+        width = length - (1 << k) + 1
+        np.maximum(table[k - 1, :width], table[k, :width], out=table[k - 1, :width])
+        np.maximum(table[k - 1, half:half + width], table[k, :width], out=table[k - 1, half:half + width])
+    return table[0]
+
+
+class SparseTable:
+    """
+    maximum of any inclusive range of `values` in O(1) after O(n log n) preprocessing
+    """
+
+    def __init__(self, values: np.ndarray):
+        self.levels = [np.asarray(values, dtype=np.int64)]
+        k = 1
+        while (1 << k) <= len(values):
+            previous = self.levels[-1]
+            half = 1 << (k - 1)
+            self.levels.append(np.maximum(previous[:-half], previous[half:]))
+            k += 1
+
+    def query(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """
+        maximum of every range, vectorized over all ranges (every range must be non-empty)
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        levels = _levels(starts, ends)
+        result = np.empty(len(starts), dtype=np.int64)
+        for k in np.unique(levels).tolist():
+            mask = levels == k
+            table = self.levels[k]
+            result[mask] = np.maximum(table[starts[mask]], table[ends[mask] - (1 << k) + 1])
+        return result
@@ -0,0 +1,210 @@
+"""
+writes synthetic XLA dump directories (buffer-assignment and memory-usage-report pairs and optionally the optimized
+HLO module) without needing JAX, e.g. for benchmarks
+"""
+import random
+from pathlib import Path
+
+dtypes = {"f32": 4, "f64": 8, "s32": 4, "c64": 8, "pred": 1, "u32": 4}
+ops = [
+    "add", "multiply", "subtract", "fusion", "dynamic-slice", "scatter", "gather", "convolution",
+    "all-to-all", "reduce", "transpose", "copy", "select", "broadcast", "get-tuple-element",
+]
+source_files = [
+    "/home/user/project/src/model/acc.py",
+    "/home/user/project/src/model/scatter_and_gather.py",
+    "/home/user/project/src/model/steppers/leapfrog.py",
+    "/opt/venvs/project/lib/python3.11/site-packages/equinox/internal/_omega.py",
+]
+scopes = [
+    "jit(main)", "jit(main)/cond", "jit(main)/while/body", "jit(main)/scan", "jit(main)/cond/branch_1_fun",
+]
+module_names = [
+    "jit_scan", "jit_forward_model", "jit_scatter_gather_func", "jit_function_using_idx", "jit__where",
+    "jit_unnamed_wrapped_function", "jit_convert_element_type", "jit_broadcast_in_dim",
+]
+
+
+def _shape(rng: random.Random, large: bool) -> tuple[str, int]:
+    dtype = rng.choice(list(dtypes))
+    rank = rng.randint(1, 3)
+    limit = 256 if large else 16
+    dims = [rng.randint(1, limit) for _ in range(rank)]
+    size = dtypes[dtype]
+    for d in dims:
+        size *= d
+    layout = ",".join(str(i) for i in reversed(range(rank)))
+    return f"{dtype}[{','.join(map(str, dims))}]{{{layout}}}", size
+
+
+def _constant(rng: random.Random, count: int) -> str:
+    return "{" + ", ".join(f"{rng.random():.10f}" for _ in range(count)) + "}"
+
+
+def generate_module(
+        directory: Path,
+        module_id: int,
+        module_name: str,
+        num_allocations: int = 16,
+        num_values: int = 1000,
+        sequence_length: int = 2000,
+        metadata_density: float = 0.8,
+        seed: int = 0,
+        hlo: bool = True,
+) -> Path:
+    """
+    write one module and return the path of its memory-usage-report
+    """
+    rng = random.Random(seed * 1_000_003 + module_id)
+    sequence_length = max(sequence_length, num_values)
+    positions = sorted(rng.sample(range(sequence_length), num_values))
+    instruction_names = [f"instr.{i}" for i in range(sequence_length)]
+
+    values = []
+    for i, pos in enumerate(positions):
+        op = rng.choice(ops)
+        name = f"{op}.{i}"
+        instruction_names[pos] = name
+        shape, size = _shape(rng, large=rng.random() < 0.1)
+        length = min(int(rng.expovariate(1 / 50)) + 1, sequence_length - pos)
+        values.append({
+            "id": i, "name": name, "op": op, "shape": shape, "size": size,
+            "start": pos, "end": pos + length,
+        })
+    # some values of tuple shaped instructions carry a shape index
+    for v in values[::97]:
+        v["name"] = v["name"] + "{0}"
+
+    num_allocations = max(num_allocations, 1)
+    num_parameters = max(1, num_allocations // 4)
+    allocations = [
+        {"id": a, "values": [], "kind": "parameter" if a < num_parameters else "temp"}
+        for a in range(num_allocations)
+    ]
+    for v in values:
+        if num_allocations == num_parameters or rng.random() < 0.02:
+            alloc = allocations[rng.randrange(num_parameters)]
+        else:
+            alloc = allocations[rng.randrange(num_parameters, num_allocations)]
+        alloc["values"].append(v)
+    for alloc in allocations:
+        # values that are live at the same time are stacked on top of each other
+        active = []
+        top = 0
+        for v in sorted(alloc["values"], key=lambda v: v["start"]):
+            active = [other for other in active if other["end"] >= v["start"]]
+            v["offset"] = max((other["offset"] + other["size"] for other in active), default=0)
+            active.append(v)
+            top = max(top, v["offset"] + v["size"])
+        alloc["size"] = max(top, 4)
+
+    lines = ["BufferAssignment:"]
+    for alloc in allocations:
+        if alloc["kind"] == "parameter":
+            lines.append(f"allocation {alloc['id']}: size {alloc['size']}, parameter {alloc['id']}, "
+                         f"shape |f32[]| at ShapeIndex {{}}:")
+        else:
+            lines.append(f"allocation {alloc['id']}: size {alloc['size']}, preallocated-temp:")
+        for v in sorted(alloc["values"], key=lambda v: v["id"]):
+            lines.append(f" value: <{v['id']} {v['name']} @0> (size={v['size']},offset={v['offset']}): {v['shape']}")
+    total = sum(a["size"] for a in allocations)
+    lines += ["", f"Total bytes used: {total} ({total}B)", "", "Used values:"]
+    instructions = {}
+    for v in values:
+        lines.append(f"<{v['id']} {v['name']} @0>")
+        lines.append(" positions:")
+        lines.append(f"  {v['name']}")
+        lines.append(" uses:")
+        for user in rng.sample(values, k=min(2, len(values))):
+            if user["start"] > v["start"]:
+                lines.append(f"  {user['name'].split('{')[0]}, operand {rng.randint(0, 2)}")
+        instruction_name = v["name"].split("{")[0]
+        if rng.random() < 0.02:
+            instruction = f"%{instruction_name} = {v['shape']} constant({_constant(rng, 256)})"
+        else:
+            operands = ", ".join(f"%{o['name'].split('{')[0]}" for o in rng.sample(values, k=min(2, len(values))))
+            instruction = f"%{instruction_name} = {v['shape']} {v['op']}({operands})"
+            if v["op"] == "fusion":
+                instruction += f", kind=kLoop, calls=%fused_computation.{v['id']}"
+        if rng.random() < metadata_density:
+            instruction += (f', metadata={{op_name="jit(f)/{rng.choice(scopes)}/{v["op"]}" '
+                            f'source_file="{rng.choice(source_files)}" source_line={rng.randint(1, 400)}}}')
+        lines.append(f" from instruction: {instruction}")
+        instructions[instruction_name] = instruction
+    lines += ["", f"HloLiveRange (max {sequence_length}):", "  InstructionSequence:"]
+    for i, name in enumerate(instruction_names):
+        lines.append(f"    {i}:{name.split('{')[0]}")
+    lines.append("  BufferLiveRange:")
+    for v in values:
+        suffix = "" if "{" in v["name"] else "{}"
+        lines.append(f"    {v['name']}{suffix}:{v['start']}-{v['end']}")
+    lines.append(f"  Live ranges at {sequence_length // 2} (peak):")
+    lines.append(f"    {values[0]['name']}: {values[0]['size']} bytes")
+    lines.append("")
+
+    stem = f"module_{module_id:04d}.{module_name}.sm_8.0_gpu_after_optimizations"
+    (directory / f"{stem}-buffer-assignment.txt").write_text("\n".join(lines))
+    if hlo:
+        (directory / f"{stem}.txt").write_text(_hlo_module(module_name, values, instruction_names, instructions))
+    report_file = directory / f"{stem}-memory-usage-report.txt"
+    report_file.write_text(f"Total bytes used: {total} ({total}B)\n\nAllocations sorted by size:\n\n")
+    return report_file
+
+
+def _hlo_module(
+        module_name: str,
+        values: list[dict],
+        instruction_names: list[str],
+        instructions: dict[str, str],
+) -> str:
+    """
+    the entry computation in sequence order, with the same instructions as the used values, and one small fused
+    computation per fusion
+    """
+    lines = [f"HloModule {module_name}, entry_computation_layout={{()->()}}", ""]
+    for v in values:
+        if v["op"] != "fusion":
+            continue
+        lines += [
+            f"%fused_computation.{v['id']} (param_0.{v['id']}: {v['shape']}) -> {v['shape']} {{",
+            f"  %param_0.{v['id']} = {v['shape']} parameter(0)",
+            f"  ROOT %multiply.fused.{v['id']} = {v['shape']} multiply(%param_0.{v['id']}, %param_0.{v['id']})",
+            "}",
+            "",
+        ]
+    lines.append("ENTRY %main () -> () {")
+    seen = set()
+    for name in instruction_names:
+        name = name.split("{")[0]
+        if name in seen:
+            continue
+        seen.add(name)
+        instruction = instructions.get(name, f"%{name} = f32[] constant(0)")
+        lines.append(f"  {instruction}")
+    lines += ["  ROOT %tuple.root = () tuple()", "}", ""]
+    return "\n".join(lines)
+
+
+def generate_dump(
+        directory: Path,
+        num_modules: int = 4,
+        num_allocations: int = 16,
+        num_values: int = 1000,
+        sequence_length: int = 2000,
+        metadata_density: float = 0.8,
+        seed: int = 0,
+        hlo: bool = True,
+) -> list[Path]:
+    directory.mkdir(parents=True, exist_ok=True)
+    return [
+        generate_module(
+            directory, module_id, module_names[(module_id - 1) % len(module_names)],
+            num_allocations=num_allocations,
+            num_values=num_values,
+            sequence_length=sequence_length,
+            metadata_density=metadata_density,
+            seed=seed,
+            hlo=hlo,
+        )
+        for module_id in range(1, num_modules + 1)
+    ]
@@ -0,0 +1,132 @@
+"""
+the "Used values" section of a buffer-assignment file is only indexed while loading a module: every value records
+the byte range of its block. The blocks are parsed here once a report actually needs uses, positions or the
+instruction of a value.
+"""
+import mmap
+import re
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from .decompress import is_compressed, open_dump_file
+from .parse_mlir import parse_mlir_line
+
+used_id_re = re.compile(rb'^[ \t]*<(?P<id>\d+)[ \t]+(?P<name>[^\s@]+) ?(?P<opt_name>\(\w+\))? @(?P<at>\d+)', re.M)
+# the usual layout of one used value, anything else is handled line by line
+used_block_re = re.compile(
+    rb'[ \t]*positions:[ \t\r]*\n'
+    rb'(?P<positions>(?:[ \t]*+(?!positions|uses|from instruction)[^\n]*\n)*)'
+    rb'[ \t]*uses:[ \t\r]*\n'
+    rb'(?P<uses>(?:[ \t]*+(?!positions|uses|from instruction)[^\n]*\n)*)'
+    rb'[ \t]*from instruction:(?P<instruction>[^\n]*)\n?'
+)
+
+
+class UsedValue(NamedTuple):
+    positions: list[str]
+    uses: list[str]
+    instruction_raw: Optional[str]
+
+    @property
+    def instruction(self) -> Optional[dict]:
+        if self.instruction_raw is None:
+            return None
+        return parse_mlir_line(self.instruction_raw)
+
+
+def parse_used_block(block: bytes) -> UsedValue:
+    """
+    parse the lines following the `<id name @at>` line of one used value
+    """
+    positions = []
+    uses = []
+    instruction_raw = None
+    m = used_block_re.fullmatch(block)
+    if m:
+        positions = [line.strip().decode() for line in m["positions"].split(b"\n")[:-1]]
+        uses = [line.strip().decode() for line in m["uses"].split(b"\n")[:-1]]
+        return UsedValue(positions, uses, m["instruction"].strip().decode())
+
+    lines = block.split(b"\n")
+    if lines[-1] == b"":
+        # the trailing newline doesn't start another line
+        lines.pop()
+    uses_mode = None
+    for raw_line in lines:
+        line = raw_line.strip()
+        if line.startswith(b"HloLiveRange"):
+            continue
+        if line.startswith(b"positions"):
+            uses_mode = "positions"
+            continue
+        if line.startswith(b"uses"):
+            uses_mode = "uses"
+            continue
+        if line.startswith(b"from instruction"):
+            instruction_raw = line.split(b":", 1)[1].strip().decode()
+            continue
+        if uses_mode == "positions":
+            positions.append(line.decode())
+        elif uses_mode == "uses":
+            uses.append(line.decode())
+    return UsedValue(positions, uses, instruction_raw)
+
+
+class UsedValuesReader:
+    """
+    reads the blocks of single used values from a memory-mapped buffer-assignment file.
+    Compressed files can't be mapped, instead the byte range `window` (usually the "Used values" section) is
+    decompressed into memory once.
+    """
+
+    def __init__(self, buffer_assignment_file: Path, window: Optional[tuple[int, int]] = None):
+        self.buffer_assignment_file = buffer_assignment_file
+        self.window = window
+        self._data = None
+        # file offset of data[0]
+        self._base = 0
+
+    def _read_window(self) -> bytes:
+        start, end = self.window if self.window is not None else (0, -1)
+        with open_dump_file(self.buffer_assignment_file) as f:
+            while start - self._base > 0:
+                skipped = len(f.read(min(start - self._base, 1024 ** 2)))
+                if not skipped:
+                    break
+                self._base += skipped
+            return f.read(end - self._base if end >= 0 else -1)
+
+    @property
+    def data(self):
+        if self._data is None:
+            if is_compressed(self.buffer_assignment_file):
+                self._data = self._read_window()
+            else:
+                with self.buffer_assignment_file.open("rb") as f:
+                    self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._data
+
+    def read(self, start: int, end: int) -> UsedValue:
+        data = self.data
+        start, end = start - self._base, end - self._base
+        header_end = data.find(b"\n", start, end)
+        if header_end < 0:
+            return UsedValue([], [], None)
+        return parse_used_block(data[header_end + 1:end])
+
+    def read_instruction(self, start: int, end: int) -> Optional[str]:
+        """
+        only the raw `from instruction:` line of a used value
+        """
+        data = self.data
+        start, end = start - self._base, end - self._base
+        pos = data.rfind(b"from instruction:", start, end)
+        if pos < 0:
+            return None
+        line_end = data.find(b"\n", pos, end)
+        return data[pos + len(b"from instruction:"):end if line_end < 0 else line_end].strip().decode()
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = None
@@ -1,3 +1,17 @@
+byte_size_units = {
+    "": 1024 ** 0,
+    "B": 1024 ** 0,
+    "K": 1024 ** 1,
+    "KB": 1024 ** 1,
+    "M": 1024 ** 2,
+    "MB": 1024 ** 2,
+    "G": 1024 ** 3,
+    "GB": 1024 ** 3,
+    "T": 1024 ** 4,
+    "TB": 1024 ** 4,
+}
+
+
 def pretty_byte_size(nbytes: int):
     for unit in ("", "Ki", "Mi", "Gi", "Ti"):
         if abs(nbytes) < 1024.0:
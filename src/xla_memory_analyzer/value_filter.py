@@ -0,0 +1,256 @@
+"""
+`--where` expressions selecting the values of a module, e.g. `size > 1G and op_name ~ "scatter" and source ~ "acc.py"`.
+
+    expression := term ("or" term)*
+    term       := factor ("and" factor)*
+    factor     := "not" factor | "(" expression ")" | FIELD OPERATOR LITERAL
+
+Numeric fields are compared with ==, !=, <, <=, > and >= to numbers, which may have a size unit (4K, 1.5G).
+String fields are compared with == and != or searched with the regular expressions of ~ and !~. In quoted strings
+only \\ and the escaped quote are unescaped, other backslashes are part of the regular expression.
+Values without a live range, source, ... never match, except for != and !~, which are the negation of == and ~.
+
+An expression is compiled once into functions over the value columns of a module. String comparisons are evaluated
+once per distinct string of a StringTable, not once per value.
+"""
+import operator
+import re
+import string
+from typing import Callable
+
+import numpy as np
+
+from . import profiling
+from .models import ModuleStats
+from .utils import byte_size_units
+
+Mask = Callable[[ModuleStats], np.ndarray]
+
+numeric_fields: dict[str, Callable[[ModuleStats], np.ndarray]] = {
+    "size": lambda m: m.value_sizes,
+    "offset": lambda m: m.value_offsets,
+    "id": lambda m: m.value_ids,
+    "at": lambda m: m.value_at,
+    "allocation": lambda m: m.value_alloc_ids,
+    "start": lambda m: m.live_start,
+    "end": lambda m: m.live_end,
+    # live range ends are inclusive
+    "length": lambda m: np.where(m.live_start >= 0, m.live_end - m.live_start + 1, -1),
+    "sequence": lambda m: m.sequence,
+    "line": lambda m: m.source_line,
+}
+# index column and the strings it refers to
+string_fields: dict[str, Callable[[ModuleStats], tuple[np.ndarray, list[str]]]] = {
+    "name": lambda m: (np.arange(len(m.value_names)), m.value_names),
+    "op_name": lambda m: (m.op_name_idx, m.op_name_table.strings),
+    "source": lambda m: (m.source_file_idx, m.source_file_table.strings),
+    "array_info": lambda m: (m.array_info_idx, m.array_info_table.strings),
+}
+
+comparisons = {
+    "==": operator.eq,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+negations = {"!=": "==", "!~": "~"}
+
+token_re = re.compile(r'''
+    \s*(?:
+        (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<number>\d+(?:\.\d*)?[a-zA-Z]*)
+      | (?P<operator>==|!=|<=|>=|!~|=|<|>|~|\(|\))
+      | (?P<word>[A-Za-z_][\w.\-]*)
+    )
+''', re.VERBOSE)
+
+
+def _tokenize(expression: str) -> list[tuple[str, str, int]]:
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        m = token_re.match(expression, pos)
+        if m is None or m.end() == pos:
+            rest = expression[pos:].lstrip()
+            raise ValueError(f"unexpected {rest[:20]!r} at position {len(expression) - len(rest)}")
+        kind = m.lastgroup
+        tokens.append((kind, m[kind], m.start(kind)))
+        pos = m.end()
+    return tokens
+
+
+def _number(text: str) -> float:
+    digits = text.rstrip(string.ascii_letters)
+    unit = text[len(digits):].upper()
+    if unit not in byte_size_units:
+        raise ValueError(f"unknown size unit {unit!r} in {text}")
+    return float(digits) * byte_size_units[unit]
+
+
+def _unquote(text: str) -> str:
+    # other escapes are kept for the regular expressions of ~, e.g. "model\.py"
+    return re.sub(r'\\([\\' + text[0] + '])', r'\1', text[1:-1])
+
+
+def _numeric_comparison(field: str, op: str, value: float) -> Mask:
+    column = numeric_fields[field]
+    compare = comparisons[op]
+
+    def mask(module: ModuleStats) -> np.ndarray:
+        values = column(module)
+        # -1 marks a missing value
+        return compare(values, value) & (values >= 0)
+
+    return mask
+
+
+def _string_comparison(field: str, op: str, value: str) -> Mask:
+    column = string_fields[field]
+    if op == "~":
+        try:
+            pattern = re.compile(value)
+        except re.error as e:
+            raise ValueError(f"invalid regular expression {value!r}: {e}") from None
+        matches = pattern.search
+    elif op == "==":
+        matches = value.__eq__
+    else:
+        raise ValueError(f"{field} is a string, compare it with ==, !=, ~ or !~")
+
+    def mask(module: ModuleStats) -> np.ndarray:
+        idx, strings = column(module)
+        # one more entry for the index -1 of missing strings
+        lut = np.zeros(len(strings) + 1, dtype=bool)
+        lut[:len(strings)] = [bool(matches(s)) for s in strings]
+        return lut[idx]
+
+    return mask
+
+
+class _Parser:
+    def __init__(self, expression: str):
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+
+    def _peek(self) -> tuple[str, str, int]:
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return "end", "", -1
+
+    def _next(self) -> tuple[str, str, int]:
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def _keyword(self, word: str) -> bool:
+        kind, text, _ = self._peek()
+        if kind == "word" and text.lower() == word:
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self) -> Mask:
+        mask = self._expression()
+        kind, text, pos = self._peek()
+        if kind != "end":
+            raise ValueError(f"unexpected {text!r} at position {pos}")
+        return mask
+
+    def _expression(self) -> Mask:
+        masks = [self._term()]
+        while self._keyword("or"):
+            masks.append(self._term())
+        if len(masks) == 1:
+            return masks[0]
+
+        def any_of(module: ModuleStats) -> np.ndarray:
+            result = masks[0](module)
+            for mask in masks[1:]:
+                if result.all():
+                    break
+                result = result | mask(module)
+            return result
+
+        return any_of
+
+    def _term(self) -> Mask:
+        masks = [self._factor()]
+        while self._keyword("and"):
+            masks.append(self._factor())
+        if len(masks) == 1:
+            return masks[0]
+
+        def all_of(module: ModuleStats) -> np.ndarray:
+            # e.g. the op_names aren't read if no value is large enough
+            result = masks[0](module)
+            for mask in masks[1:]:
+                if not result.any():
+                    break
+                result = result & mask(module)
+            return result
+
+        return all_of
+
+    def _factor(self) -> Mask:
+        if self._keyword("not"):
+            inner = self._factor()
+            return lambda module: ~inner(module)
+        kind, text, pos = self._next()
+        if kind == "operator" and text == "(":
+            mask = self._expression()
+            kind, text, pos = self._next()
+            if text != ")":
+                raise ValueError(f"expected ')' at position {pos}" if kind != "end" else "missing ')'")
+            return mask
+        if kind != "word":
+            raise ValueError(f"expected a field at position {pos}" if kind != "end" else "incomplete expression")
+        return self._comparison(text, pos)
+
+    def _comparison(self, field: str, pos: int) -> Mask:
+        if field not in numeric_fields and field not in string_fields:
+            raise ValueError(f"unknown field {field!r} at position {pos}, "
+                             f"fields are {', '.join([*numeric_fields, *string_fields])}")
+        kind, op, pos = self._next()
+        if kind != "operator" or op in "()":
+            raise ValueError(f"expected a comparison after {field}")
+        op = "==" if op == "=" else op
+        kind, literal, pos = self._next()
+        if kind not in ("number", "string", "word"):
+            raise ValueError(f"expected a value after {field} {op}")
+        negated = op in negations
+        op = negations.get(op, op)
+        if field in numeric_fields:
+            if kind != "number":
+                raise ValueError(f"{field} is a number, {literal} isn't")
+            if op == "~":
+                raise ValueError(f"{field} is a number, compare it with ==, !=, <, <=, > or >=")
+            mask = _numeric_comparison(field, op, _number(literal))
+        else:
+            mask = _string_comparison(field, op, _unquote(literal) if kind == "string" else literal)
+        if negated:
+            return lambda module: ~mask(module)
+        return mask
+
+
+class ValueFilter:
+    def __init__(self, expression: str):
+        """
+        raises ValueError if the expression is invalid
+        """
+        self.expression = expression
+        self._mask = _Parser(expression).parse()
+
+    def mask(self, module: ModuleStats) -> np.ndarray:
+        return self._mask(module)
+
+    def apply(self, module: ModuleStats) -> ModuleStats:
+        """
+        the module with only the matching values
+        """
+        with profiling.phase("where", module.label):
+            return module.select(np.flatnonzero(self.mask(module)))
+
+    def __repr__(self):
+        return f"ValueFilter({self.expression!r})"
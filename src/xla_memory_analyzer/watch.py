@@ -0,0 +1,228 @@
+"""
+follows a dump directory while XLA is still writing it.
+A module is parsed as soon as both of its files are complete. With inotify a file is complete once it was closed
+after writing (or moved into the directory), when polling once its size and mtime didn't change for one interval.
+Files that were already there when watching started count as complete.
+"""
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from rich.console import Group
+from rich.live import Live
+from rich.table import Table
+from rich.text import Text
+
+from .cache import ParseCache
+from .dump_files import ModuleSummary, buffer_assignment_path, summarize
+from .utils import pretty_byte_size
+from .value_filter import ValueFilter
+from .xla_memory_analyzer import iter_modules, load_module
+
+dump_file_suffixes = ("memory-usage-report.txt", "buffer-assignment.txt")
+# what the parsers raise for a file that is still being written, the file is parsed again once it changes
+incomplete_file_errors = (ValueError, IndexError, EOFError)
+
+
+def is_dump_file(name: str) -> bool:
+    return name.endswith(dump_file_suffixes)
+
+
+class PollingWatcher:
+    def __init__(self, directory: Path, interval: float):
+        self.directory = directory
+        self.interval = interval
+        self._last_snapshot = None
+
+    def _snapshot(self) -> dict[Path, tuple[int, int]]:
+        snapshot = {}
+        for entry in os.scandir(self.directory):
+            if not is_dump_file(entry.name):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            snapshot[Path(entry.path)] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def complete_files(self) -> set[Path]:
+        if self._last_snapshot is None:
+            self._last_snapshot = self._snapshot()
+            return set(self._last_snapshot)
+        time.sleep(self.interval)
+        snapshot = self._snapshot()
+        complete = {file for file, stat in snapshot.items() if self._last_snapshot.get(file) == stat}
+        self._last_snapshot = snapshot
+        return complete
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    def __init__(self, directory: Path, interval: float):
+        from inotify_simple import INotify, flags
+
+        self.directory = directory
+        self.interval = interval
+        self.inotify = INotify()
+        # register before listing the directory, so that no file can slip through in between
+        self.inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO)
+        self.complete = {Path(entry.path) for entry in os.scandir(directory) if is_dump_file(entry.name)}
+        self._first = True
+
+    def complete_files(self) -> set[Path]:
+        if self._first:
+            self._first = False
+            return set(self.complete)
+        for event in self.inotify.read(timeout=int(self.interval * 1000)):
+            if is_dump_file(event.name):
+                self.complete.add(self.directory / event.name)
+        return set(self.complete)
+
+    def close(self):
+        self.inotify.close()
+
+
+def make_watcher(directory: Path, interval: float, polling: bool = False):
+    if not polling:
+        try:
+            return InotifyWatcher(directory, interval)
+        except (ImportError, OSError):
+            # inotify_simple isn't installed or the platform has no inotify
+            pass
+    return PollingWatcher(directory, interval)
+
+
+def _signature(memory_report_file: Path) -> Optional[tuple]:
+    try:
+        report = memory_report_file.stat()
+        buffer_assignment = buffer_assignment_path(memory_report_file).stat()
+    except FileNotFoundError:
+        return None
+    return report.st_size, report.st_mtime_ns, buffer_assignment.st_size, buffer_assignment.st_mtime_ns
+
+
+class WatchState:
+    """
+    summaries of all parsed modules, keyed by their memory-usage-report
+    """
+
+    def __init__(self, memory_limit: Optional[int] = None):
+        self.memory_limit = memory_limit
+        self.modules: dict[Path, ModuleSummary] = {}
+        self.parsed: dict[Path, tuple] = {}
+        self.failed: dict[Path, tuple] = {}
+        # unexpected errors, shown until the file is parsed
+        self.errors: dict[Path, str] = {}
+        self.waiting = 0
+
+    @property
+    def total_size(self) -> int:
+        return sum(module.total_allocation for module in self.modules.values())
+
+    @property
+    def over_limit(self) -> list[ModuleSummary]:
+        if self.memory_limit is None:
+            return []
+        return [module for module in self.modules.values() if module.total_allocation > self.memory_limit]
+
+    def ready_files(self, complete: set[Path]) -> dict[Path, tuple]:
+        """
+        memory-usage-reports of modules whose files are both complete and changed since they were last parsed
+        """
+        ready = {}
+        self.waiting = 0
+        for file in complete:
+            if not file.name.endswith("memory-usage-report.txt"):
+                continue
+            if buffer_assignment_path(file) not in complete:
+                self.waiting += 1
+                continue
+            signature = _signature(file)
+            if signature is None or signature in (self.parsed.get(file), self.failed.get(file)):
+                continue
+            ready[file] = signature
+        return ready
+
+    def update(self, ready: dict[Path, tuple], jobs: int, cache: Optional[ParseCache], parser: str,
+               where: Optional[ValueFilter] = None):
+        files = sorted(ready)
+        try:
+            modules = list(iter_modules(files, jobs, cache, parser, where))
+        except Exception:
+            # parse the files one by one to keep the others and to tell which one failed, and why
+            modules = []
+            for file in list(files):
+                try:
+                    module = load_module(file, cache, parser)
+                    modules.append(where.apply(module) if where is not None else module)
+                    continue
+                except incomplete_file_errors:
+                    pass
+                except Exception as e:
+                    self.errors[file] = f"{type(e).__name__}: {e}"
+                self.failed[file] = ready[file]
+                files.remove(file)
+        for file, module in zip(files, modules):
+            self.modules[file] = summarize(module)
+            self.parsed[file] = ready[file]
+            self.failed.pop(file, None)
+            self.errors.pop(file, None)
+
+    def render(self, top: int):
+        title = f"{len(self.modules)} modules totalling {pretty_byte_size(self.total_size)}"
+        table = Table(title=title)
+        table.add_column("id", justify="right")
+        table.add_column("name")
+        table.add_column("total", justify="right")
+        table.add_column("peak", justify="right")
+        largest = sorted(self.modules.values(), key=lambda module: -module.total_allocation)
+        for module in largest[:top]:
+            over = self.memory_limit is not None and module.total_allocation > self.memory_limit
+            table.add_row(
+                str(module.id), module.name, pretty_byte_size(module.total_allocation),
+                pretty_byte_size(module.peak_size), style="bold red" if over else None,
+            )
+        status = [f"{self.waiting} modules being written"]
+        if self.failed:
+            status.append(f"{len(self.failed)} could not be parsed yet")
+        if self.over_limit:
+            status.append(f"{len(self.over_limit)} over the memory limit of {pretty_byte_size(self.memory_limit)}")
+        errors = [Text(f"{file.name}: {error}", style="red") for file, error in sorted(self.errors.items())]
+        return Group(table, Text(", ".join(status), style="bold red" if self.over_limit else "dim"), *errors)
+
+
+def watch(
+        directory: Path,
+        interval: float = 1.0,
+        top: int = 20,
+        memory_limit: Optional[int] = None,
+        exit_on_limit: bool = False,
+        polling: bool = False,
+        jobs: int = 1,
+        cache: Optional[ParseCache] = None,
+        parser: str = "regex",
+        where: Optional[ValueFilter] = None,
+) -> WatchState:
+    """
+    runs until interrupted, or until a module exceeds `memory_limit` if `exit_on_limit` is set
+    """
+    state = WatchState(memory_limit)
+    watcher = make_watcher(directory, interval, polling)
+    try:
+        with Live(state.render(top), auto_refresh=False) as live:
+            while True:
+                ready = state.ready_files(watcher.complete_files())
+                if ready:
+                    state.update(ready, jobs, cache, parser, where)
+                live.update(state.render(top), refresh=True)
+                if exit_on_limit and state.over_limit:
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return state
@@ -0,0 +1,107 @@
+"""
+estimates how the peak of a module would change for single values:
+- removed: the value doesn't exist at all
+- shortened: the value is freed `shorten_to` steps after it is defined
+- rematerialized: the value is only live at its definition and recomputed right before its last use,
+  so the steps in between are freed (the cost of recomputing its operands is not taken into account)
+
+Taking a value away lowers the size curve by its size on the freed steps [a, b], so the new peak is
+max(max before a, max after b, max within [a, b] - size). With prefix and suffix maxima and a sparse table for the
+range maximum this is O(1) per value and scenario, the timeline is never rebuilt.
+"""
+from typing import NamedTuple
+
+import numpy as np
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from .models import ModuleStats
+from .sparse_table import SparseTable
+from .utils import pretty_byte_size
+
+scenarios = ["removed", "shortened", "rematerialized"]
+
+
+class PeakSensitivity(NamedTuple):
+    peak: int
+    rows: np.ndarray
+    # new module peak per scenario, aligned with `rows`
+    new_peaks: dict[str, np.ndarray]
+
+    def reduction(self, scenario: str) -> np.ndarray:
+        return self.peak - self.new_peaks[scenario]
+
+
+class PeakModel:
+    """
+    prefix/suffix maxima and range maxima of the size curve of a module
+    """
+
+    def __init__(self, module: ModuleStats):
+        self.times, self.sizes = module.size_over_time
+        self.first = int(self.times[0]) if self.times.size else 0
+        self.peak = int(self.sizes.max()) if self.sizes.size else 0
+        # padded with 0 on both sides, so that empty prefixes and suffixes need no special case
+        self.prefix_max = np.concatenate([[0], np.maximum.accumulate(self.sizes)])
+        self.suffix_max = np.concatenate([np.maximum.accumulate(self.sizes[::-1])[::-1], [0]])
+        self.range_max = SparseTable(self.sizes)
+
+    def peak_without(self, starts: np.ndarray, ends: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+        """
+        new peak if `sizes[i]` bytes are freed on the steps `starts[i]` to `ends[i]` (inclusive, may be empty)
+        """
+        a = np.asarray(starts, dtype=np.int64) - self.first
+        b = np.asarray(ends, dtype=np.int64) - self.first
+        result = np.full(len(a), self.peak, dtype=np.int64)
+        valid = a <= b
+        a, b, sizes = a[valid], b[valid], np.asarray(sizes)[valid]
+        result[valid] = np.maximum.reduce([
+            self.prefix_max[a],
+            self.suffix_max[b + 1],
+            self.range_max.query(a, b) - sizes,
+        ])
+        return result
+
+
+def peak_sensitivity(module: ModuleStats, min_size: int = 0, shorten_to: int = 1) -> PeakSensitivity:
+    model = PeakModel(module)
+    rows = np.flatnonzero((module.live_start >= 0) & (module.value_sizes >= min_size))
+    starts = module.live_start[rows]
+    ends = module.live_end[rows]
+    sizes = module.value_sizes[rows]
+    new_peaks = {
+        "removed": model.peak_without(starts, ends, sizes),
+        "shortened": model.peak_without(starts + shorten_to, ends, sizes),
+        "rematerialized": model.peak_without(starts + 1, ends - 1, sizes),
+    }
+    return PeakSensitivity(model.peak, rows, new_peaks)
+
+
+def print_peak_sensitivity(module: ModuleStats, min_size: int = 0, shorten_to: int = 1, top: int = 25,
+                           sort_by: str = "removed"):
+    console = Console()
+    sensitivity = peak_sensitivity(module, min_size, shorten_to)
+    reductions = {scenario: sensitivity.reduction(scenario) for scenario in scenarios}
+    # ties are broken by the reduction in the other scenarios
+    order = np.lexsort([-reductions[s] for s in reversed(scenarios) if s != sort_by] + [-reductions[sort_by]])
+    order = order[reductions[sort_by][order] > 0][:top]
+    table = Table(title=f"peak {pretty_byte_size(sensitivity.peak)}, largest reductions if {sort_by}",
+                  box=box.MARKDOWN)
+    table.add_column("Size")
+    table.add_column("Name", no_wrap=False)
+    table.add_column("Live range")
+    table.add_column("Removed")
+    table.add_column(f"Shortened to {shorten_to}")
+    table.add_column("Rematerialized")
+    for i in order.tolist():
+        row = int(sensitivity.rows[i])
+        table.add_row(
+            pretty_byte_size(int(module.value_sizes[row])),
+            module.value_names[row],
+            f"{module.live_start[row]}-{module.live_end[row]}",
+            *(f"-{pretty_byte_size(int(reductions[s][i]))}" if reductions[s][i] > 0 else "" for s in scenarios),
+        )
+    console.print(table)
+    if not order.size:
+        console.print("no single value lowers the peak, it is reached at several independent steps")
@@ -1,13 +1,27 @@
 #!/usr/bin/python
+import os
 import re
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Optional
 
 from rich.console import Console
 
-from .memory_stats import print_peak_stats
-from .models import Value, Allocation, ValueDetailed, ModuleStats, DumpDirectory
-from .parse_mlir import parse_mlir_line
+from . import profiling
+from .buffer_reuse import print_buffer_reuse
+from .cache import ParseCache, content_hasher
+from .decompress import is_compressed, open_dump_file
+from .dump_files import buffer_assignment_path, filter_modules, memory_report_files, module_name_and_id, \
+    plan_modules
+from .memory_stats import print_live_values, print_peak_stats
+from .models import ModuleStats, ModuleStatsBuilder, DumpDirectory
+from .parse_mmap import analyze_module_mmap
+from .profiling import module_label
+from .sources import SourceResolver
 from .utils import pretty_byte_size
+from .value_filter import ValueFilter
 
 # dir = Path("/home/lukas/cosmoca/DISCO-DJ/vsc_scripts/scripts/data/dump_host_20599_119")
 # dir = Path("local_test")
@@ -44,144 +58,296 @@ used_header_re = re.compile(r'^Used values:')
 used_id_re = re.compile(r'^<(?P<id>\d+)\s+(?P<name>[^\s@]+) ?(?P<opt_name>\(\w+\))? @(?P<at>\d+)')
 
 
-def analyze_module(memory_report_file: Path):
-    buffer_assignment_file = memory_report_file.parent / memory_report_file.name.replace("memory-usage-report",
-                                                                                         "buffer-assignment")
-    with buffer_assignment_file.open("r") as f:
+def analyze_module(memory_report_file: Path, hasher=None) -> ModuleStats:
+    """
+    `hasher` is fed the content of the buffer-assignment file as it is read
+    """
+    buffer_assignment_file = buffer_assignment_path(memory_report_file)
+    with open_dump_file(buffer_assignment_file, hasher) as f:
         mode = "alloc"
-        uses_mode = None
-        current_used_id = None
-        module_id = int(memory_report_file.stem.split(".")[0].split("_")[1])
-        module_name = memory_report_file.stem.split(".")[1]
-        module_stats = ModuleStats(name=module_name, id=module_id)
-        for line in f:
-            line = line.strip()
+        module_name, module_id = module_name_and_id(memory_report_file)
+        builder = ModuleStatsBuilder(name=module_name, id=module_id, buffer_assignment_file=buffer_assignment_file)
+        offset = 0
+        line_no = -1
+        # (section, first line) for the profile, and lines that matched nothing they should have
+        sections = [(mode, 0)]
+        used_misses = sequence_misses = 0
+        for line_no, raw_line in enumerate(f):
+            line_offset = offset
+            offset += len(raw_line)
+            line = raw_line.decode().strip()
             if used_header_re.match(line):
                 mode = "used"
+                sections.append((mode, line_no))
                 continue
             if line.startswith("HloLiveRange"):
                 continue
+            if mode == "used" and line.startswith(("InstructionSequence", "BufferLiveRange", "Live ranges at")):
+                builder.used_values_end = line_offset
             if line.startswith("InstructionSequence"):
                 mode = "InstructionSequence"
+                sections.append((mode, line_no))
                 continue
             if line.startswith("BufferLiveRange"):
                 mode = "BufferLiveRange"
+                sections.append((mode, line_no))
                 continue
             if line.startswith("Live ranges at"):
                 mode = "LiveRangesPeak"
+                sections.append((mode, line_no))
                 continue
             if mode == "alloc":
                 if line.startswith("allocation"):
                     m = header_re.search(line)
                     if not m:
                         raise ValueError("malformed allocation header")
-                    d = m.groupdict()
-                    for k in d.keys():
-                        d[k] = int(d[k])
-                    alloc_id = d["alloc_id"]
-                    alloc = Allocation(**d)
-                    module_stats.allocations[alloc_id] = alloc
+                    builder.add_allocation(int(m["alloc_id"]), int(m["total_size"]))
 
                 elif line.startswith("value"):
                     m = value_re.search(line)
                     if not m:
                         raise ValueError("malformed allocation value")
-                    d = m.groupdict()
-                    for k in ["id", "at", "size", "offset"]:
-                        d[k] = int(d[k])
-                    d["allocation"] = alloc
-                    value = Value(**d)
-                    module_stats.values[value.id] = value
-                    if value.id in module_stats.value_id_to_name:
-                        raise ValueError("duplicate value id")
-                    module_stats.value_id_to_name[value.id] = value.name
-                    if value.name in module_stats.value_name_to_id:
-                        raise ValueError("duplicate value name")
-                    module_stats.value_name_to_id[value.name] = value.id
+                    builder.add_value(
+                        id=int(m["id"]), name=m["name"], at=int(m["at"]),
+                        size=int(m["size"]), offset=int(m["offset"]), array_info=m["array_info"]
+                    )
             elif mode == "used":
+                # only the start of each used value is recorded, its block is parsed on demand
+                if not line.startswith("<"):
+                    continue
                 m = used_id_re.search(line)
                 if m:
-                    d = m.groupdict()
-                    for k in ["id", "at"]:
-                        d[k] = int(d[k])
-                    value_uses = ValueDetailed(**d)
-                    module_stats.values[value_uses.id].value_detailed = value_uses
-                    current_used_id = value_uses.id
-                    module_stats.used_values[current_used_id] = value_uses
-                    continue
-                if line.startswith("positions"):
-                    uses_mode = "positions"
-                    continue
-                if line.startswith("uses"):
-                    uses_mode = "uses"
-                    continue
-                if line.startswith("from instruction"):
-                    instruction_raw = line.split(':', 1)[1].strip()
-                    instruction = parse_mlir_line(instruction_raw)
-
-                    module_stats.used_values[current_used_id].instruction = instruction
-                    continue
-                if uses_mode == "positions":
-                    module_stats.used_values[current_used_id].positions.append(line)
-                    continue
-                if uses_mode == "uses":
-                    module_stats.used_values[current_used_id].uses.append(line)
+                    builder.add_used_value(int(m["id"]), line_offset, m["opt_name"])
+                else:
+                    used_misses += 1
             elif mode == "BufferLiveRange":
                 val, rangestr = line.split(":")
                 name = val.rstrip("{}")
                 range = tuple(map(int, rangestr.strip().split("-")))
                 try:
-                    value = module_stats.values[module_stats.value_name_to_id[name]]
+                    row = builder.row_of_name(name)
                 except KeyError:
-                    value = module_stats.values[module_stats.value_name_to_id[val]]
-                value.live_range = range
+                    row = builder.row_of_name(val)
+                builder.live_ranges[row] = range
             elif mode == "InstructionSequence":
                 order_str, name = line.split(":")
                 order = int(order_str.strip())
                 try:
-                    value = module_stats.values[module_stats.value_name_to_id[name]]
+                    row = builder.row_of_name(name)
                 except KeyError:
+                    # instructions without a value of their own, not an error
+                    sequence_misses += 1
                     continue
-                value.sequence = order
-    return module_stats
+                builder.sequence[row] = order
+        if mode == "used":
+            builder.used_values_end = offset
+    label = module_label(module_name, module_id)
+    sections.append((None, line_no + 1))
+    for (section, first), (_, end) in zip(sections, sections[1:]):
+        profiling.count(label, f"lines {section}", end - first)
+    profiling.count(label, "misses used value header", used_misses)
+    profiling.count(label, "sequence entries without value", sequence_misses)
+    with profiling.phase("build"):
+        return builder.build()
+
+
+parsers = {
+    "regex": analyze_module,
+    "mmap": analyze_module_mmap,
+}
+
+
+def load_module(
+        memory_report_file: Path,
+        cache: Optional[ParseCache] = None,
+        parser: str = "regex",
+        cache_lookup: bool = True,
+) -> ModuleStats:
+    """
+    without `cache_lookup` the module is always parsed and only stored in the `cache`, for callers that already
+    looked it up there
+    """
+    label = module_label(*module_name_and_id(memory_report_file))
+    if cache is not None and cache_lookup:
+        with profiling.phase("cache load", label):
+            module = cache.load(buffer_assignment_path(memory_report_file))
+        if module is not None:
+            profiling.count(label, "values", len(module.value_ids))
+            return module
+    buffer_assignment_file = buffer_assignment_path(memory_report_file)
+    if is_compressed(buffer_assignment_file):
+        # compressed files can't be memory-mapped, they are always decompressed line by line
+        parser = "regex"
+    # the stat before parsing and the hash of what was parsed, a file changing meanwhile isn't cached as current
+    stat = buffer_assignment_file.stat() if cache is not None else None
+    hasher = content_hasher() if cache is not None else None
+    with profiling.phase("parse", label):
+        module = parsers[parser](memory_report_file, hasher)
+    profiling.count(label, "values", len(module.value_ids))
+    if cache is not None:
+        with profiling.phase("cache store", label):
+            cache.store(buffer_assignment_file, module, stat, hasher.hexdigest())
+    return module
+
+
+def _load_module_arrays(
+        memory_report_file: Path,
+        cache: Optional[ParseCache] = None,
+        parser: str = "regex",
+        profile: bool = False,
+) -> tuple[dict, Optional[tuple]]:
+    """
+    runs in a worker process, which records its own profile if the parent process is profiling.
+    The parent process only submits modules that it didn't find in the cache.
+    """
+    if not profile:
+        return load_module(memory_report_file, cache, parser, cache_lookup=False).to_arrays(), None
+    profiler = profiling.start()
+    try:
+        arrays = load_module(memory_report_file, cache, parser, cache_lookup=False).to_arrays()
+    finally:
+        profiling.stop()
+    return arrays, profiler.export()
+
+
+# modules parsed or waiting to be yielded per worker, bounds the memory of results that are parsed early
+PARSE_WINDOW_PER_JOB = 4
+
+
+def buffer_assignment_size(memory_report_file: Path) -> int:
+    try:
+        return buffer_assignment_path(memory_report_file).stat().st_size
+    except OSError:
+        return 0
+
 
+def iter_modules(
+        files: list[Path],
+        jobs: int = 1,
+        cache: Optional[ParseCache] = None,
+        parser: str = "regex",
+        where: Optional[ValueFilter] = None,
+) -> Iterator[ModuleStats]:
+    """
+    parse all modules and yield them in the order of `files`.
+    With jobs > 1 (or 0 for all cores) the files are parsed in a process pool, largest files first and at most
+    `PARSE_WINDOW_PER_JOB * jobs` of them ahead of the module being yielded, and the workers only send back the
+    flat arrays of each module.
+    Modules found in the `cache` are loaded from it instead.
+    With `where`, only the matching values of each module are kept.
+    """
+    if where is not None:
+        yield from (where.apply(module) for module in iter_modules(files, jobs, cache, parser))
+        return
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    if jobs == 1 or len(files) <= 1:
+        for file in files:
+            yield load_module(file, cache, parser)
+        return
+    cached = set()
+    if cache is not None:
+        with profiling.phase("cache check"):
+            cached = {file for file in files if cache.is_cached(buffer_assignment_path(file))}
+    # the workers start on the largest files, so that a huge module doesn't end up parsed last by one of them
+    to_parse = sorted((file for file in files if file not in cached), key=buffer_assignment_size, reverse=True)
+    if not to_parse:
+        yield from (load_module(file, cache, parser) for file in files)
+        return
+    # parsed modules waiting to be yielded are bounded by the window, modules in the cache are loaded only when
+    # they are yielded and don't count
+    window = PARSE_WINDOW_PER_JOB * jobs
+    profiler = profiling.active()
+    with ProcessPoolExecutor(max_workers=min(jobs, len(to_parse))) as pool:
+        futures = {}
+        queue = deque(to_parse)
 
-def load_all_modules(dir: Path) -> DumpDirectory:
+        def submit(file: Path):
+            futures[file] = pool.submit(_load_module_arrays, file, cache, parser, profiler is not None)
+
+        for file in files:
+            if file in cached:
+                # parsed here if it changed since it was checked
+                yield load_module(file, cache, parser)
+                continue
+            while queue and len(futures) < window:
+                submit(queue.popleft())
+            if file not in futures:
+                # the window is taken by larger modules yielded later, the next one jumps the queue
+                queue.remove(file)
+                submit(file)
+            with profiling.phase("wait for worker", module_label(*module_name_and_id(file))):
+                arrays, worker_profile = futures.pop(file).result()
+            if worker_profile is not None:
+                profiler.merge(*worker_profile)
+            yield ModuleStats.from_arrays(arrays)
+
+
+def load_all_modules(
+        dir: Path,
+        jobs: int = 1,
+        cache: Optional[ParseCache] = None,
+        parser: str = "regex",
+        where: Optional[ValueFilter] = None,
+) -> DumpDirectory:
     modules = []
     total_all_modules = 0
 
-    for file in sorted(dir.glob("*memory-usage-report.txt")):
-        module = analyze_module(file)
+    for module in iter_modules(memory_report_files(dir), jobs, cache, parser, where):
         total_all_modules += module.total_allocation
         modules.append(module)
 
     return DumpDirectory(directory=dir, modules=modules, total_size=total_all_modules)
 
 
+def no_values_match(console: Console, module: ModuleStats, where: Optional[ValueFilter]) -> bool:
+    """
+    prints a note instead of an empty report if `where` left no values of the module
+    """
+    if where is None or len(module.value_ids):
+        return False
+    console.print(f"no values match {where.expression}")
+    return True
+
+
 def main(
         dir: Path,
         interesting_modules: list[str],
         skip_small_modules: bool = True,
         only_main_peak: bool = False,
+        jobs: int = 1,
+        cache: Optional[ParseCache] = None,
+        parser: str = "regex",
+        prominence: float = 0.2,
+        width: Optional[float] = None,
+        plot: Optional[Path] = None,
+        sources: Optional[SourceResolver] = None,
+        where: Optional[ValueFilter] = None,
 ):
     console = Console()
-    total_all_modules = 0
-    for file in sorted(dir.glob("*memory-usage-report.txt")):
-        module = analyze_module(file)
-        total_all_modules += module.total_allocation
-
-        if skip_small_modules and module.total_allocation < 1024 ** 2:  # 1GB
-            continue
-        skip = True
-        for name in interesting_modules:
-            if name in module.name:
-                skip = False
-                break
-        if skip:
-            continue
+    if sources is None:
+        sources = SourceResolver()
+    with profiling.phase("plan"):
+        all_modules = plan_modules(dir)
+    total_all_modules = sum(module.total_allocation for module in all_modules)
+    selected = filter_modules(
+        all_modules,
+        interesting_modules,
+        min_size=1024 ** 2 if skip_small_modules else 0,  # 1MB
+    )
+    for module in iter_modules([module.memory_report_file for module in selected], jobs, cache, parser, where):
         console.rule(f"{module.id} {module.name} ({pretty_byte_size(module.total_allocation)})")
+        if no_values_match(console, module, where):
+            continue
         # print(module.total_allocation, pretty_byte_size(module.total_allocation))
-        print_peak_stats(module, only_main_peak)
+        peaks = [module.main_allocation_peak] if only_main_peak else module.find_peaks(prominence, width)
+        if plot is not None:
+            # Matplotlib is only imported when a plot is requested
+            from .plotting import plot_path, plot_size_over_time
+            with profiling.phase("plot", module.label):
+                plot_size_over_time(module, peaks, plot_path(plot, module, len(selected) > 1))
+        with profiling.phase("report", module.label):
+            print_peak_stats(module, peaks=peaks, sources=sources)
         # memory_buffer_over_time(module)
         # vals_by_line_of_code(module)
         # print(module_stats.values[9].model_dump_json(indent=2))
@@ -189,3 +355,116 @@ def main(
         # make_graph(module_stats)
         # print_peak_stats(module)
     console.rule(f"all modules: {total_all_modules}")
+
+
+def live_at(
+        dir: Path,
+        interesting_modules: list[str],
+        steps: list[tuple[int, int]],
+        limit: int = 0,
+        jobs: int = 1,
+        cache: Optional[ParseCache] = None,
+        parser: str = "regex",
+        where: Optional[ValueFilter] = None,
+):
+    console = Console()
+    with profiling.phase("plan"):
+        selected = filter_modules(plan_modules(dir), interesting_modules)
+    for module in iter_modules([module.memory_report_file for module in selected], jobs, cache, parser, where):
+        console.rule(f"{module.id} {module.name} ({pretty_byte_size(module.total_allocation)})")
+        if no_values_match(console, module, where):
+            continue
+        with profiling.phase("report", module.label):
+            for start, end in steps:
+                print_live_values(module, start, end, limit)
+
+
+def buffer_reuse(
+        dir: Path,
+        interesting_modules: list[str],
+        top: int = 25,
+        jobs: int = 1,
+        cache: Optional[ParseCache] = None,
+        parser: str = "regex",
+        where: Optional[ValueFilter] = None,
+):
+    console = Console()
+    with profiling.phase("plan"):
+        selected = filter_modules(plan_modules(dir), interesting_modules)
+    for module in iter_modules([module.memory_report_file for module in selected], jobs, cache, parser, where):
+        console.rule(f"{module.id} {module.name} ({pretty_byte_size(module.total_allocation)})")
+        if no_values_match(console, module, where):
+            continue
+        with profiling.phase("report", module.label):
+            print_buffer_reuse(module, top)
+
+
+def export(
+        dir: Path,
+        interesting_modules: Optional[list[str]],
+        format: str,
+        output: Path,
+        jobs: int = 1,
+        cache: Optional[ParseCache] = None,
+        parser: str = "regex",
+        where: Optional[ValueFilter] = None,
+) -> int:
+    from .export import export_modules
+
+    with profiling.phase("plan"):
+        selected = filter_modules(plan_modules(dir), interesting_modules)
+    return export_modules(
+        iter_modules([module.memory_report_file for module in selected], jobs, cache, parser, where), format, output
+    )
+
+
+def attribute(
+        dir: Path,
+        interesting_modules: list[str],
+        all_peaks: bool = False,
+        by: str = "both",
+        min_share: float = 0.01,
+        max_children: int = 10,
+        jobs: int = 1,
+        cache: Optional[ParseCache] = None,
+        parser: str = "regex",
+        sources: Optional[SourceResolver] = None,
+        where: Optional[ValueFilter] = None,
+):
+    from .attribute import print_attribution
+
+    console = Console()
+    with profiling.phase("plan"):
+        selected = filter_modules(plan_modules(dir), interesting_modules)
+    for module in iter_modules([module.memory_report_file for module in selected], jobs, cache, parser, where):
+        console.rule(f"{module.id} {module.name} ({pretty_byte_size(module.total_allocation)})")
+        if no_values_match(console, module, where):
+            continue
+        with profiling.phase("report", module.label):
+            peaks = module.allocation_peaks if all_peaks else [module.main_allocation_peak]
+            print_attribution(module, peaks, sources, by, min_share, max_children)
+
+
+def what_if(
+        dir: Path,
+        interesting_modules: list[str],
+        min_size: int = 0,
+        shorten_to: int = 1,
+        sort_by: str = "removed",
+        top: int = 25,
+        jobs: int = 1,
+        cache: Optional[ParseCache] = None,
+        parser: str = "regex",
+        where: Optional[ValueFilter] = None,
+):
+    from .whatif import print_peak_sensitivity
+
+    console = Console()
+    with profiling.phase("plan"):
+        selected = filter_modules(plan_modules(dir), interesting_modules)
+    for module in iter_modules([module.memory_report_file for module in selected], jobs, cache, parser, where):
+        console.rule(f"{module.id} {module.name} ({pretty_byte_size(module.total_allocation)})")
+        if no_values_match(console, module, where):
+            continue
+        with profiling.phase("report", module.label):
+            print_peak_sensitivity(module, min_size, shorten_to, top, sort_by)
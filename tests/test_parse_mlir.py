@@ -0,0 +1,72 @@
+import pytest
+
+from xla_memory_analyzer.parse_mlir import index_comment_re, parse_mlir_line, parse_mlir_line_regex
+
+lines = [
+    '%constant_1513_0 = f32[8]{0} constant({0.0608953461, 0.0608953387, 0.060895294, 0.0608953536, 0.0608953238, '
+    '0.0608952641, 0.0608952641, 0.0608953238})',
+    '%loop_dynamic_slice_fusion.3 = f32[1]{0} fusion(%constant_1513_0, %param.42), kind=kLoop, '
+    'calls=%fused_dynamic_slice.3, metadata={op_name="jit(<unnamed wrapped function>)/jit(main)/dynamic_slice" '
+    'source_file="/home/user/src/discodj/nbody/steppers/dkd_leapfrog.py" source_line=37 '
+    'deduplicated_name="loop_dynamic_slice_fusion.2"}',
+    '%loop_add_fusion.1 = f32[226492416,3]{1,0} fusion(%input_concatenate_fusion.4, %loop_dynamic_slice_fusion.3, '
+    '%param.41, %param.43, %get-tuple-element.275), kind=kLoop, calls=%fused_add.1, '
+    'metadata={op_name="jit(<unnamed wrapped function>)/jit(main)/add" '
+    'source_file="/opt/venvs/lib/python3.11/site-packages/equinox/internal/_omega.py" source_line=100}',
+    '%tuple.131.0 = (f32[226492416,3]{1,0}, f32[226492416,3]{1,0}) tuple(%loop_add_fusion.1, '
+    '%input_concatenate_fusion.4)',
+    '%tuple.7 = (f32[8]{0}, f32[8]{0}, s32[]{:T(128)}, f32[8]{0}, f32[8]{0}, /*index=5*/f32[8]{0}, c64[4]{0}) '
+    'tuple(%fusion.1, %fusion.1, %param.3, %param.4, %param.4, /*index=5*/%fusion.2, %fft.1), '
+    'metadata={op_name="jit(main)/while/body" source_file="/home/user/src/scan.py" source_line=12}',
+    '%while.3 = (s32[], f32[8]{0}, f32[8]{0}, f32[8]{0}, f32[8]{0}, /*index=5*/f32[8]{0}, /*index=6*/f32[8]{0}) '
+    'while(%tuple.7), condition=%cond.1, body=%body.1',
+    '%conditional = () conditional(%loop_compare_fusion, %tuple.109.0, %tuple.109.0), '
+    'true_computation=%true_computation, false_computation=%region_5.368_spmd, '
+    'metadata={op_name="jit(<unnamed wrapped function>)/jit(main)/cond/branch_1_fun/debug_callback" '
+    'source_file="/home/user/src/discodj/core/scatter_and_gather.py" source_line=1330}',
+]
+
+
+def _normalized(instruction: dict) -> dict:
+    """
+    the old parser keeps the `/*index=N*/` comments in the type and operands
+    """
+    return {
+        "var": instruction["var"],
+        "dtype": index_comment_re.sub("", instruction["dtype"]),
+        "op": instruction["op"],
+        "operands": [index_comment_re.sub("", operand) for operand in instruction["operands"]],
+        "metadata": instruction["metadata"],
+    }
+
+
+@pytest.mark.parametrize("line", lines)
+def test_matches_regex_parser(line):
+    expected = _normalized(parse_mlir_line_regex(line))
+    if expected["op"] == "constant":
+        # the old parser splits the literal into operands, the tokenizer skips it
+        expected["operands"] = []
+    assert _normalized(parse_mlir_line(line)) == expected
+
+
+def test_index_comments_are_removed():
+    instruction = parse_mlir_line(lines[4])
+    assert instruction is not None
+    assert "/*" not in instruction["dtype"]
+    assert instruction["operands"][5] == "%fusion.2"
+    assert instruction["metadata"]["source_line"] == 12
+
+
+def test_large_constant():
+    line = "%constant.big = f32[4096]{0} constant({" + ", ".join(f"{i / 4096:.10f}" for i in range(4096)) + "})"
+    instruction = parse_mlir_line(line)
+    assert instruction["op"] == "constant"
+    assert instruction["operands"] == []
+    assert instruction["dtype"] == "f32[4096]{0}"
+
+
+def test_strings_are_shared():
+    strings = {}
+    first = parse_mlir_line(lines[2], strings)
+    second = parse_mlir_line(lines[2], strings)
+    assert first["metadata"]["source_file"] is second["metadata"]["source_file"]
@@ -0,0 +1,76 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from xla_memory_analyzer import profiling
+from xla_memory_analyzer.dump_files import buffer_assignment_path, memory_report_files
+from xla_memory_analyzer.parse_mmap import analyze_module_mmap
+from xla_memory_analyzer.synthetic import generate_dump
+from xla_memory_analyzer.xla_memory_analyzer import analyze_module
+
+data_dir = Path(__file__).parent / "data"
+# only its name is read, the values come from the buffer-assignment file next to it
+fixture = data_dir / "module_0007.jit_fixture.sm_8.0_gpu_after_optimizations-memory-usage-report.txt"
+
+
+def assert_same_arrays(memory_report_file: Path):
+    expected = analyze_module(memory_report_file).to_arrays()
+    actual = analyze_module_mmap(memory_report_file).to_arrays()
+    assert actual.keys() == expected.keys()
+    for key in expected:
+        np.testing.assert_array_equal(actual[key], expected[key], err_msg=key)
+
+
+def test_fixture():
+    assert_same_arrays(fixture)
+
+
+def test_fixture_contents():
+    module = analyze_module_mmap(fixture)
+    assert module.value_names == [
+        "Arg_0.1", "constant.2", "tuple.8{}", "tuple.3{}", "while.4{}", "while.4{0}", "while.4{1}", "fusion.5",
+        "get-tuple-element.6", "add.7",
+    ]
+    assert module.allocation_sizes.tolist() == [64, 4, 16, 192]
+    assert module.opt_names == {3: "(phi)", 4: "(phi)", 5: "(phi)"}
+    while_value = module.used_value(module.row_of(4))
+    assert while_value.positions == ["while.4 {0}"]
+    assert while_value.uses == []
+    assert module.live_start[module.row_of(5)] == 3
+    assert module.live_end[module.row_of(5)] == 5
+    # bitcast.9 has no value of its own
+    assert sorted(module.sequence[module.sequence >= 0].tolist()) == [0, 1, 4, 5, 6]
+
+
+def test_crlf(tmp_path):
+    memory_report_file = tmp_path / fixture.name
+    buffer_assignment_file = buffer_assignment_path(memory_report_file)
+    buffer_assignment_file.write_bytes(buffer_assignment_path(fixture).read_bytes().replace(b"\n", b"\r\n"))
+    assert_same_arrays(memory_report_file)
+
+
+def test_profile_counters(tmp_path):
+    memory_report_file = tmp_path / fixture.name
+    buffer_assignment_file = buffer_assignment_path(memory_report_file)
+    buffer_assignment_file.write_bytes(
+        buffer_assignment_path(fixture).read_bytes().replace(b"Used values:\n", b"Used values:\n<not a value>\n"))
+    counters = []
+    for analyze in [analyze_module, analyze_module_mmap]:
+        profiler = profiling.start()
+        try:
+            analyze(memory_report_file)
+        finally:
+            profiling.stop()
+        (module_counters,) = [c for module, c in profiler.counters.items() if module is not None]
+        lines = sum(n for counter, n in module_counters.items() if counter.startswith("lines "))
+        counters.append((lines, module_counters["misses used value header"],
+                         module_counters["sequence entries without value"]))
+    assert counters[0] == counters[1] == (124, 1, 4)
+
+
+@pytest.mark.parametrize("metadata_density", [0.0, 0.8])
+def test_synthetic(tmp_path, metadata_density):
+    generate_dump(tmp_path, 2, 4, 300, 600, metadata_density)
+    for memory_report_file in memory_report_files(tmp_path):
+        assert_same_arrays(memory_report_file)
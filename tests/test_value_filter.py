@@ -0,0 +1,93 @@
+import re
+from pathlib import Path
+
+import pytest
+
+from xla_memory_analyzer.value_filter import ValueFilter, _tokenize, _unquote
+from xla_memory_analyzer.xla_memory_analyzer import analyze_module
+
+data_dir = Path(__file__).parent / "data"
+module = analyze_module(
+    data_dir / "module_0007.jit_fixture.sm_8.0_gpu_after_optimizations-memory-usage-report.txt")
+
+
+def names(expression: str) -> list[str]:
+    return ValueFilter(expression).apply(module).value_names
+
+
+def test_tokenize():
+    assert _tokenize('size>=1.5K and (source ~ "a \\"b\\"")') == [
+        ("word", "size", 0),
+        ("operator", ">=", 4),
+        ("number", "1.5K", 6),
+        ("word", "and", 11),
+        ("operator", "(", 15),
+        ("word", "source", 16),
+        ("operator", "~", 23),
+        ("string", '"a \\"b\\""', 25),
+        ("operator", ")", 34),
+    ]
+
+
+def test_unquote():
+    assert _unquote('"a \\"b\\" \\\\"') == 'a "b" \\'
+    assert _unquote("'it\\'s'") == "it's"
+    # kept for the regular expression
+    assert _unquote('"model\\.py"') == "model\\.py"
+    assert _unquote("'\\\"'") == '\\"'
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("size > 16", ["Arg_0.1", "while.4{1}", "fusion.5", "get-tuple-element.6", "add.7"]),
+    ("size = 4", ["constant.2", "while.4{0}"]),
+    ("size >= 0.0625K and size < 1K", ["Arg_0.1", "while.4{1}", "fusion.5", "get-tuple-element.6", "add.7"]),
+    ("size >= 1M", []),
+    ("size < 1.5G and size <= 4B", ["constant.2", "while.4{0}"]),
+    ("name == 'fusion.5'", ["fusion.5"]),
+    ("name ~ '^while\\.4\\{\\d\\}$'", ["while.4{0}", "while.4{1}"]),
+    ('source ~ "f\\.py" and line = 9', ["add.7"]),
+    ("op_name ~ 'while/body'", ["fusion.5"]),
+])
+def test_comparisons(expression, expected):
+    assert names(expression) == expected
+
+
+def test_precedence():
+    # and binds tighter than or
+    assert names("name = add.7 or size = 4 and name = constant.2") == ["constant.2", "add.7"]
+    assert names("(name = add.7 or size = 4) and name = constant.2") == ["constant.2"]
+    assert names("not size > 16 and not size < 16") == ["tuple.8{}", "tuple.3{}", "while.4{}"]
+    assert names("not (size > 4 or size < 16)") == []
+    assert names("NOT name ~ '\\.' OR name = constant.2") == ["constant.2"]
+
+
+def test_missing_values():
+    # only fusion.5 and add.7 have a source
+    assert names("line >= 0") == ["fusion.5", "add.7"]
+    assert names("not line >= 0") == [n for n in module.value_names if n not in ("fusion.5", "add.7")]
+    assert names("line != 7") == [n for n in module.value_names if n != "fusion.5"]
+    assert names("source == '/tmp/f.py'") == ["fusion.5", "add.7"]
+    assert len(names("source != '/tmp/f.py'")) == len(module.value_names) - 2
+    assert names("source ~ ''") == ["fusion.5", "add.7"]
+    assert names("source !~ 'f'") == names("not source ~ 'f'")
+
+
+@pytest.mark.parametrize("expression, message", [
+    ("", "incomplete expression"),
+    ("size >", "expected a value after size >"),
+    ("size 4", "expected a comparison after size"),
+    ("bytes > 4", "unknown field 'bytes' at position 0"),
+    ("size > 4X", "unknown size unit 'X' in 4X"),
+    ("size > big", "size is a number, big isn't"),
+    ("size ~ 4", "size is a number, compare it with"),
+    ("name > 'a'", "name is a string, compare it with"),
+    ("name ~ '('", "invalid regular expression '('"),
+    ("(size > 4", "missing ')'"),
+    ("(size > 4 size", "expected ')' at position 10"),
+    ("size > 4 size", "unexpected 'size' at position 9"),
+    ("size > 4 & size < 8", "unexpected '& size < 8' at position 9"),
+    ("name = 'a", "unexpected \"'a\" at position 7"),
+])
+def test_errors(expression, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        ValueFilter(expression)